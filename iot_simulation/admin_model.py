@@ -1,6 +1,7 @@
 import MySQLdb
 import os
 from dotenv import load_dotenv
+from iot_simulation.db import get_pool
 
 load_dotenv()
 
@@ -12,11 +13,14 @@ def get_db_connection():
         database=os.getenv('MYSQL_DATABASE')
     )
 
-def get_admin_by_email(email):
-    conn = get_db_connection()
+def get_admin_by_email(email, conn=None):
+    # Use the caller's connection (e.g. the request's) or borrow one from the pool
+    if conn is None:
+        with get_pool().connection() as conn:
+            return get_admin_by_email(email, conn)
+
     cursor = conn.cursor(MySQLdb.cursors.DictCursor)
     cursor.execute("SELECT * FROM admin WHERE email = %s", (email,))
     admin = cursor.fetchone()
     cursor.close()
-    conn.close()
     return admin
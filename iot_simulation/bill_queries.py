@@ -0,0 +1,138 @@
+import sys
+import datetime
+import MySQLdb
+from iot_simulation.db import get_db_connection
+
+# Daily table, quantity column and bill column of each billed utility
+BILL_TABLES = {
+    'electricity': ('daily_electricity_consumption', 'units_consumed', 'daily_bill'),
+    'water': ('daily_water_consumption', 'liters_consumed', 'daily_bill'),
+    'gas': ('daily_gas_consumption', 'gas_used_cubic_meters', 'gas_cost'),
+    'fuel': ('daily_fuel_consumption', 'fuel_used_liters', 'fuel_cost'),
+}
+
+# One calendar month as a half-open date range. Unlike MONTH()/YEAR() on the column,
+# this lets MySQL range-scan a (user_id, consumption_date, ...) index.
+MONTH_RANGE_SQL = "user_id = %s AND consumption_date >= %s AND consumption_date < %s"
+
+
+def month_range(year, month):
+    # First day of the month and first day of the next one
+    start = datetime.date(int(year), int(month), 1)
+    end = datetime.date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def is_valid_month(year, month):
+    # Whether month_range can build the range: month 1-12 and both first days within date's limits
+    return 1 <= month <= 12 and datetime.MINYEAR <= year and (year, month) < (datetime.MAXYEAR, 12)
+
+
+def month_params(user_id, year, month):
+    # Parameters for MONTH_RANGE_SQL
+    return (user_id, *month_range(year, month))
+
+
+def detail_query(utility):
+    table, quantity, bill = BILL_TABLES[utility]
+    return f"""
+        SELECT consumption_date, {quantity}, {bill}
+        FROM {table}
+        WHERE {MONTH_RANGE_SQL}
+        ORDER BY consumption_date
+    """
+
+
+def due_amount_query(utility):
+    # Fuel rows have no provider
+    table, quantity, bill = BILL_TABLES[utility]
+    provider = "NULL" if utility == 'fuel' else "MAX(utility_provider_id)"
+    return f"""
+        SELECT SUM({bill}) AS total_amount, {provider} AS provider_id
+        FROM {table}
+        WHERE {MONTH_RANGE_SQL}
+        AND payment_status = 'due'
+    """
+
+
+def mark_paid_query(utility):
+    table, quantity, bill = BILL_TABLES[utility]
+    return f"""
+        UPDATE {table}
+        SET payment_status = 'paid'
+        WHERE {MONTH_RANGE_SQL}
+        AND payment_status = 'due'
+    """
+
+
+DETAIL_SQL = {utility: detail_query(utility) for utility in BILL_TABLES}
+DUE_AMOUNT_SQL = {utility: due_amount_query(utility) for utility in BILL_TABLES}
+MARK_PAID_SQL = {utility: mark_paid_query(utility) for utility in BILL_TABLES}
+
+
+def month_queries():
+    # Every per-month query the bill detail and payment routes run, by name
+    queries = {}
+    for utility in BILL_TABLES:
+        queries[f"{utility}_detail"] = DETAIL_SQL[utility]
+        queries[f"{utility}_due_amount"] = DUE_AMOUNT_SQL[utility]
+        queries[f"{utility}_mark_paid"] = MARK_PAID_SQL[utility]
+    return queries
+
+
+def busiest_user_month(conn):
+    # (user_id, year, month) with the most electricity rows, or None before anything is logged
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT user_id, year, month
+            FROM monthly_electricity_summary
+            ORDER BY paid_records + due_records DESC
+            LIMIT 1
+        """)
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def explain_month_query(conn, sql, user_id, year, month):
+    # First EXPLAIN row of one per-month query, as a dict
+    cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+    try:
+        cursor.execute("EXPLAIN " + sql, month_params(user_id, year, month))
+        return cursor.fetchall()[0]
+    finally:
+        cursor.close()
+
+
+def check_range_scans(conn, user_id, year, month):
+    """
+    EXPLAIN every per-month route query for one user and month and return
+    {name: (ok, access type, key)}. ok means the daily table is read with a range
+    scan on an index that starts with (user_id, consumption_date).
+    """
+    results = {}
+    for name, sql in month_queries().items():
+        plan = explain_month_query(conn, sql, user_id, year, month)
+        ok = plan['type'] == 'range' and plan['key'] is not None
+        results[name] = (ok, plan['type'], plan['key'])
+    return results
+
+
+if __name__ == "__main__":
+    # python -m iot_simulation.bill_queries [user_id year month]; defaults to the busiest user-month
+    conn = get_db_connection()
+    if len(sys.argv) == 4:
+        user_id, year, month = (int(arg) for arg in sys.argv[1:])
+    else:
+        row = busiest_user_month(conn)
+        if not row:
+            print("❌ No consumption logged yet; pass user_id year month")
+            sys.exit(1)
+        user_id, year, month = row
+
+    results = check_range_scans(conn, user_id, year, month)
+    conn.close()
+    for name, (ok, access_type, key) in results.items():
+        print(f"{'✅' if ok else '❌'} {name}: type={access_type}, key={key}")
+    sys.exit(0 if all(ok for ok, _, _ in results.values()) else 1)
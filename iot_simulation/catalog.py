@@ -0,0 +1,173 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import MySQLdb
+from dotenv import load_dotenv
+from iot_simulation.search_index import NgramIndex
+
+load_dotenv()
+
+# Seconds a cached catalog entry is served before it is reloaded. Admin writes invalidate
+# the cache of the process that served them; other worker processes catch up within this.
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '300'))
+# Upper bound on cached entries
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv('CATALOG_CACHE_MAX_ENTRIES', '1024'))
+# Default and maximum number of vehicle typeahead results
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+PROVIDERS_SQL = """
+    SELECT id, provider_name, energy_type, region
+    FROM utility_providers
+    ORDER BY id
+"""
+
+VEHICLES_SQL = """
+    SELECT id, model_name
+    FROM vehicles
+    ORDER BY id
+"""
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire ttl seconds after they were loaded.
+    Keys are tuples whose first item names the catalog, so invalidate(kind) can drop a
+    catalog together with everything derived from it.
+    """
+
+    def __init__(self, ttl=CATALOG_CACHE_TTL, max_entries=CATALOG_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        # Load outside the lock so a slow query doesn't block hits on other keys
+        value = load()
+
+        with self._lock:
+            # An invalidation during the load means value may predate the write, so serve it once but don't keep it
+            if self._generation == generation:
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def update(self, key, apply):
+        # Apply an in-place change to the cached value, if any. Like invalidate, it bumps the
+        # generation, so a load already in flight (which may predate the change) isn't kept.
+        with self._lock:
+            self._generation += 1
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                apply(entry[1])
+
+    def invalidate(self, kind=None):
+        with self._lock:
+            self._generation += 1
+            if kind is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == kind]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_cache = TTLCache()
+
+
+def load_providers_by_region(conn):
+    # Whole provider catalog grouped by region; MySQL compared regions case-insensitively, so do we
+    cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+    try:
+        cursor.execute(PROVIDERS_SQL)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    by_region = {}
+    for row in rows:
+        region = (row['region'] or '').strip().lower()
+        by_region.setdefault(region, []).append(
+            {'id': row['id'], 'provider_name': row['provider_name'], 'energy_type': row['energy_type']}
+        )
+    return by_region
+
+
+def load_vehicle_index(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(VEHICLES_SQL)
+        return NgramIndex(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def providers_for_division(conn, division):
+    """
+    Providers serving a division plus the nationwide ones, as returned by
+    /get_providers. conn is only used on a cache miss. Treat the result as read-only.
+    """
+    by_region = _cache.get_or_load(('providers',), lambda: load_providers_by_region(conn))
+    region = division.strip().lower()
+    if region == 'nationwide':
+        return by_region.get(region, [])
+    return by_region.get(region, []) + by_region.get('nationwide', [])
+
+
+def vehicle_index(conn):
+    # The model-name index, rebuilt from the database when the TTL runs out; conn is only used then
+    return _cache.get_or_load(('vehicles',), lambda: load_vehicle_index(conn))
+
+
+def search_vehicles(conn, query, limit=SEARCH_LIMIT):
+    """
+    Up to limit vehicles whose model name contains query (case-insensitive): names
+    starting with it first, then names with a word starting with it, then the rest.
+    """
+    return vehicle_index(conn).search(query, min(limit, MAX_SEARCH_LIMIT))
+
+
+def add_vehicle_to_index(vehicle_id, model_name):
+    # After inserting a vehicle; if no index is cached, the next load reads the new row anyway
+    _cache.update(('vehicles',), lambda index: index.add(vehicle_id, model_name))
+
+
+def warm_catalog(conn):
+    """
+    Load the provider catalog and the vehicle search index ahead of the first request.
+    A failure is only reported: both are loaded on first use instead.
+    """
+    try:
+        providers_for_division(conn, 'nationwide')
+        vehicle_index(conn)
+    except MySQLdb.Error as err:
+        print(f"⚠️ Catalog not preloaded, it will be loaded on first use: {err}")
+
+
+def invalidate_catalog(kind=None):
+    # Call after writing to utility_providers ('providers') or vehicles ('vehicles'); None drops everything
+    _cache.invalidate(kind)
+
+
+def catalog_cache_stats():
+    return _cache.stats()
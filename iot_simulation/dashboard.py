@@ -0,0 +1,301 @@
+import MySQLdb
+import json
+import datetime
+from decimal import Decimal
+
+# Days of daily history shown on the dashboard
+RECENT_DAYS = 15
+
+# Used when a user has no safe_limits row yet
+DEFAULT_SAFE_LIMITS = {
+    'electricity': 200,
+    'gas': 200,
+    'fuel': 200,
+    'water': 50,
+    'total': 500
+}
+
+SAVE_SNAPSHOT_SQL = """
+    INSERT INTO dashboard_snapshots (user_id, payload)
+    VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE payload = VALUES(payload)
+"""
+
+# The snapshot is keyed by user id; google_id is unique on user, so this is one indexed lookup
+LOAD_SNAPSHOT_SQL = """
+    SELECT u.id AS user_id, ds.payload
+    FROM user u
+    LEFT JOIN dashboard_snapshots ds ON ds.user_id = u.id
+    WHERE u.google_id = %s
+"""
+
+
+def to_json(value):
+    # MySQLdb hands back Decimal for DECIMAL columns and date objects for DATE columns
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Can't serialize {type(value).__name__}")
+
+
+def build_dashboard_snapshot(cursor, user_id):
+    """
+    Run every dashboard query for one user and return the template data as a
+    JSON-serializable dict. cursor must be a DictCursor.
+    """
+    # Fetch user details
+    cursor.execute("""
+        SELECT u.display_name, u.email, u.phone, u.address, u.division,
+               up.provider_name AS electricity_provider,
+               uw.provider_name AS water_provider,
+               ug.provider_name AS gas_provider, u.gas_type
+        FROM user u
+        LEFT JOIN utility_providers up ON u.electricity_provider = up.id
+        LEFT JOIN utility_providers uw ON u.water_provider = uw.id
+        LEFT JOIN utility_providers ug ON u.gas_provider = ug.id
+        WHERE u.id = %s
+    """, (user_id,))
+    user_data = cursor.fetchone()
+
+    # Fetch housing details
+    cursor.execute("""
+        SELECT house_size_sqft, num_members, solar_panel_watt, wind_source_watt, other_renewable_source
+        FROM user_housing
+        WHERE user_id = %s
+    """, (user_id,))
+    housing_data = cursor.fetchone()
+
+    # Fetch the last days of each utility
+    cursor.execute("""
+        SELECT consumption_date, units_consumed, daily_bill
+        FROM daily_electricity_consumption
+        WHERE user_id = %s
+        ORDER BY consumption_date DESC
+        LIMIT %s
+    """, (user_id, RECENT_DAYS))
+    consumption_records = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT consumption_date, liters_consumed, daily_bill
+        FROM daily_water_consumption
+        WHERE user_id = %s
+        ORDER BY consumption_date DESC
+        LIMIT %s
+    """, (user_id, RECENT_DAYS))
+    water_consumption_records = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT consumption_date, gas_used_cubic_meters, gas_cost
+        FROM daily_gas_consumption
+        WHERE user_id = %s
+        ORDER BY consumption_date DESC
+        LIMIT %s
+    """, (user_id, RECENT_DAYS))
+    gas_consumption_records = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT consumption_date, fuel_used_liters, fuel_cost
+        FROM daily_fuel_consumption
+        WHERE user_id = %s
+        ORDER BY consumption_date DESC
+        LIMIT %s
+    """, (user_id, RECENT_DAYS))
+    fuel_consumption_records = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT consumption_date, total_emission_kg, emission_tag, suggestions
+        FROM daily_carbon_footprint
+        WHERE user_id = %s
+        ORDER BY consumption_date DESC
+        LIMIT %s
+    """, (user_id, RECENT_DAYS))
+    carbon_footprint_records = cursor.fetchall()
+
+    # Monthly aggregates, read from the trigger-maintained summaries
+    cursor.execute("""
+        SELECT month AS bill_month, year AS bill_year, total_units, total_bill
+        FROM monthly_electricity_summary
+        WHERE user_id = %s AND paid_records + due_records > 0
+        ORDER BY bill_year DESC, bill_month DESC
+    """, (user_id,))
+    monthly_electricity_data = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT month, year, total_liters, total_bill
+        FROM monthly_water_summary
+        WHERE user_id = %s AND paid_records + due_records > 0
+        ORDER BY year DESC, month DESC
+    """, (user_id,))
+    monthly_water_data = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT month, year, total_cubic_meters, total_bill
+        FROM monthly_gas_summary
+        WHERE user_id = %s AND paid_records + due_records > 0
+        ORDER BY year DESC, month DESC
+    """, (user_id,))
+    monthly_gas_data = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT month, year, total_liters, total_bill
+        FROM monthly_fuel_summary
+        WHERE user_id = %s AND paid_records + due_records > 0
+        ORDER BY year DESC, month DESC
+    """, (user_id,))
+    monthly_fuel_data = cursor.fetchall()
+
+    # Monthly carbon footprint, per utility and in total
+    cursor.execute("""
+        SELECT
+            month,
+            year,
+            electricity_emission_kg AS total_electricity_kg,
+            fuel_emission_kg AS total_fuel_kg,
+            gas_emission_kg AS total_gas_kg,
+            water_emission_kg AS total_water_kg,
+            total_emission_kg AS total_carbon_kg
+        FROM monthly_carbon_summary
+        WHERE user_id = %s AND days > 0
+        ORDER BY year DESC, month DESC
+    """, (user_id,))
+    monthly_carbon_detailed_data = cursor.fetchall()
+    monthly_carbon_data = [
+        {'month': row['month'], 'year': row['year'], 'total_carbon_kg': row['total_carbon_kg']}
+        for row in monthly_carbon_detailed_data
+    ]
+
+    # Fetch the user's safe limits
+    cursor.execute("""
+        SELECT electricity_safe_limit, gas_safe_limit, fuel_safe_limit, water_safe_limit, total_safe_limit
+        FROM safe_limits
+        WHERE user_id = %s
+    """, (user_id,))
+    safe_limits_row = cursor.fetchone()
+
+    if safe_limits_row:
+        safe_limits = {
+            'electricity': safe_limits_row['electricity_safe_limit'],
+            'gas': safe_limits_row['gas_safe_limit'],
+            'fuel': safe_limits_row['fuel_safe_limit'],
+            'water': safe_limits_row['water_safe_limit'],
+            'total': safe_limits_row['total_safe_limit'],
+        }
+    else:
+        safe_limits = dict(DEFAULT_SAFE_LIMITS)
+
+    # Determine average emission level
+    emission_levels = [record['emission_tag'] for record in carbon_footprint_records]
+
+    if emission_levels.count('high') > len(emission_levels) * 0.5:
+        average_emission_level = "high"
+    elif emission_levels.count('moderate') > len(emission_levels) * 0.5:
+        average_emission_level = "moderate"
+    else:
+        average_emission_level = "low"
+
+    reduction_suggestions = list(set(
+        record['suggestions'] for record in carbon_footprint_records if record['suggestions']
+    ))
+
+    # Fetch user's vehicles
+    cursor.execute("""
+        SELECT v.model_name
+        FROM user_vehicles uv
+        JOIN vehicles v ON uv.vehicle_id = v.id
+        WHERE uv.user_id = %s
+    """, (user_id,))
+    car_list = [car['model_name'] for car in cursor.fetchall()]
+
+    # Fetch wallet balance, 0 if no wallet exists
+    cursor.execute("""
+        SELECT balance
+        FROM user_wallet
+        WHERE user_id = %s
+    """, (user_id,))
+    wallet_balance = cursor.fetchone()
+
+    return {
+        'details': user_data,
+        'housing': housing_data,
+        'cars': car_list,
+        'recent_consumption': [
+            {"date": record["consumption_date"].strftime("%m-%d"), "units": record["units_consumed"], "bill": record["daily_bill"]}
+            for record in consumption_records
+        ],
+        'recent_water_consumption': [
+            {"date": record["consumption_date"].strftime("%m-%d"), "liters": record["liters_consumed"], "bill": record["daily_bill"]}
+            for record in water_consumption_records
+        ],
+        'recent_gas_consumption': [
+            {"date": record["consumption_date"].strftime("%m-%d"), "cubic_meters": record["gas_used_cubic_meters"], "bill": record["gas_cost"]}
+            for record in gas_consumption_records
+        ],
+        'recent_fuel_consumption': [
+            {"date": record["consumption_date"].strftime("%m-%d"), "liters": record["fuel_used_liters"], "bill": record["fuel_cost"]}
+            for record in fuel_consumption_records
+        ],
+        'recent_carbon_footprint': [
+            {
+                "date": record["consumption_date"].strftime("%m-%d"),
+                "carbon_kg": record["total_emission_kg"],
+                "level": record["emission_tag"],
+                "suggestion": record["suggestions"]
+            }
+            for record in carbon_footprint_records
+        ],
+        'monthly_electricity_data': monthly_electricity_data,
+        'monthly_water_data': monthly_water_data,
+        'monthly_gas_data': monthly_gas_data,
+        'monthly_fuel_data': monthly_fuel_data,
+        'monthly_carbon_data': monthly_carbon_data,
+        'monthly_carbon_detailed_data': monthly_carbon_detailed_data,
+        'average_emission_level': average_emission_level,
+        'reduction_suggestions': reduction_suggestions,
+        'safe_limits': safe_limits,
+        'wallet_balance': wallet_balance['balance'] if wallet_balance else 0.00,
+    }
+
+
+def refresh_dashboard_snapshot(conn, user_id):
+    # Rebuild one user's snapshot, store it and return it as the route would read it back
+    cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+    try:
+        payload = json.dumps(build_dashboard_snapshot(cursor, user_id), default=to_json)
+        cursor.execute(SAVE_SNAPSHOT_SQL, (user_id, payload))
+        conn.commit()
+    finally:
+        cursor.close()
+    return json.loads(payload)
+
+
+def refresh_dashboard_snapshots(conn, user_ids=None):
+    # Refresh after ingestion: the given users, or everyone
+    if user_ids is None:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM user")
+        user_ids = [user_id for user_id, in cursor.fetchall()]
+        cursor.close()
+
+    for user_id in user_ids:
+        refresh_dashboard_snapshot(conn, user_id)
+    print(f"✅ Refreshed {len(user_ids)} dashboard snapshots")
+
+
+def load_dashboard_snapshot(conn, google_id):
+    """
+    Return (user_id, snapshot) for a Google account, rebuilding the snapshot if it's
+    missing. Returns (None, None) for an unknown account.
+    """
+    cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+    try:
+        cursor.execute(LOAD_SNAPSHOT_SQL, (google_id,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if not row:
+        return None, None
+    if row['payload'] is None:
+        return row['user_id'], refresh_dashboard_snapshot(conn, row['user_id'])
+    return row['user_id'], json.loads(row['payload'])
@@ -1,5 +1,11 @@
 import MySQLdb
 import os
+import datetime
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -8,7 +14,15 @@ load_dotenv()
 MYSQL_HOST = os.getenv('MYSQL_HOST')
 MYSQL_USER = os.getenv('MYSQL_USER')
 MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD')
-MYSQL_DATABASE = "care_env"
+MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'care_env')
+
+# Connection pool sizing for the web app; each process (e.g. each pre-forked worker) has its own pool
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+# Seconds a request waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Connections idle longer than this are pinged before reuse, so MySQL's wait_timeout can't hand out a dead one
+DB_POOL_PING_INTERVAL = float(os.getenv('DB_POOL_PING_INTERVAL', '30'))
 
 
 def get_db_connection():
@@ -23,3 +37,283 @@ def get_db_connection():
     except MySQLdb.Error as err:
         print(f"Error: Unable to connect to the database. {err}")
         raise
+
+
+def insert_rows(conn, sql, rows, batch_size=1000):
+    # executemany folds an INSERT ... VALUES statement into one multi-row statement per batch
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, rows[start:start + batch_size])
+            conn.commit()
+    except MySQLdb.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def write_batches(conn, sql, rows, batch_size=1000, flush_interval=5.0):
+    """
+    Buffer rows from any iterable (e.g. a generator) and write them in executemany
+    batches on one connection. A batch is committed once it holds batch_size rows, or
+    when a row arrives flush_interval seconds after the last commit. Returns the
+    number of rows written.
+    """
+    cursor = conn.cursor()
+    buffer, written = [], 0
+    last_flush = time.monotonic()
+    try:
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= batch_size or time.monotonic() - last_flush >= flush_interval:
+                cursor.executemany(sql, buffer)
+                conn.commit()
+                written += len(buffer)
+                buffer = []
+                last_flush = time.monotonic()
+        if buffer:
+            cursor.executemany(sql, buffer)
+            conn.commit()
+            written += len(buffer)
+        return written
+    except MySQLdb.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def stream_query(conn, sql, params=None):
+    # Server-side cursor: rows are fetched as they are consumed instead of all at once.
+    # The connection can't run other statements until the generator is exhausted.
+    cursor = conn.cursor(MySQLdb.cursors.SSDictCursor)
+    try:
+        cursor.execute(sql, params)
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+
+def fetch_watermarks(conn, table, key='user_id'):
+    # Latest logged consumption_date per key (user by default), in one grouped query
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT {key}, MAX(consumption_date)
+            FROM {table}
+            GROUP BY {key}
+        """)
+        return {key_id: last_date for key_id, last_date in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def resume_start_date(watermark, window_start):
+    # First date still to simulate: the day after the watermark, never before the window
+    if watermark is None:
+        return window_start
+    return max(watermark + datetime.timedelta(days=1), window_start)
+
+
+def fetch_existing_days(conn, table, window_start, window_end):
+    """
+    Days already logged in table between window_start and window_end, in one query.
+    Returns {user_id: bitmap}, where bit i of the np.packbits array is set when
+    window_start + i days is present.
+    """
+    n_days = (window_end - window_start).days + 1
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT user_id, DATEDIFF(consumption_date, %s)
+            FROM {table}
+            WHERE consumption_date BETWEEN %s AND %s
+        """, (window_start, window_start, window_end))
+        keys = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    finally:
+        cursor.close()
+
+    user_ids, rows = np.unique(keys[:, 0], return_inverse=True)
+    present = np.zeros((len(user_ids), n_days), dtype=bool)
+    present[rows, keys[:, 1]] = True
+    return {int(user_id): np.packbits(days) for user_id, days in zip(user_ids, present)}
+
+
+def missing_days(bitmap, window_start, window_end, start_date=None):
+    # Dates from start_date (default window_start) to window_end that aren't set in bitmap
+    n_days = (window_end - window_start).days + 1
+    first = 0 if start_date is None else max(0, (start_date - window_start).days)
+    if bitmap is None:
+        offsets = range(first, n_days)
+    else:
+        present = np.unpackbits(bitmap, count=n_days).astype(bool)
+        offsets = first + np.flatnonzero(~present[first:])
+    return [window_start + datetime.timedelta(days=int(offset)) for offset in offsets]
+
+
+class PoolTimeout(MySQLdb.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MySQLdb connections. acquire() hands out an idle connection
+    (pinging it first if it sat idle for ping_interval seconds, and reconnecting if
+    the ping fails) or opens a new one while fewer than max_size exist; otherwise it
+    waits up to timeout seconds for a release(). Connections inherited across a fork
+    are dropped, never shared, so pre-forked workers each build their own pool.
+    """
+
+    def __init__(self, connect=None, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, ping_interval=DB_POOL_PING_INTERVAL):
+        self.connect = connect or get_db_connection
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._lock = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = deque()  # (connection, time it was released)
+        self._size = 0
+        self._counters = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'reconnects': 0, 'opened': 0, 'discarded': 0}
+
+    def _check_pid(self):
+        # After a fork the sockets belong to the parent; closing them here would end its sessions
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _open(self):
+        conn = self.connect()
+        self._counters['opened'] += 1
+        return conn
+
+    def _healthy(self, conn, idle_since):
+        if time.monotonic() - idle_since < self.ping_interval:
+            return True
+        try:
+            conn.ping()
+            return True
+        except MySQLdb.Error:
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            self._check_pid()
+            # Warm up to min_size the first time this process needs a connection
+            while self._size < self.min_size:
+                self._idle.append((self._open(), time.monotonic()))
+                self._size += 1
+
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection free after {self.timeout}s")
+                self._counters['waits'] += 1
+                self._lock.wait(remaining)
+
+            self._counters['checkouts'] += 1
+            if self._idle:
+                conn, idle_since = self._idle.pop()
+            else:
+                # Reserve the slot before connecting so concurrent callers respect max_size
+                self._size += 1
+                conn, idle_since = None, None
+
+        if conn is not None:
+            if self._healthy(conn, idle_since):
+                return conn
+            self._close(conn)
+            with self._lock:
+                self._counters['reconnects'] += 1
+        try:
+            conn = self.connect()
+        except MySQLdb.Error:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._counters['opened'] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        # End any open transaction so the next borrower starts clean
+        if not discard:
+            try:
+                conn.rollback()
+            except MySQLdb.Error:
+                discard = True
+
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            if discard:
+                self._size -= 1
+                self._counters['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+        if discard:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except MySQLdb.OperationalError:
+            # Lost or broken connection: don't hand it out again
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            self._check_pid()
+            return {
+                'pid': self._pid,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                **self._counters,
+            }
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # The process-wide pool, created on first use with the MYSQL_* and DB_POOL_* settings
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
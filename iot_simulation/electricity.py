@@ -2,57 +2,137 @@ import MySQLdb
 import numpy as np
 import os
 import datetime
+from collections import namedtuple
+from functools import lru_cache, partial
 from dotenv import load_dotenv
+from iot_simulation.db import insert_rows, fetch_watermarks, resume_start_date
+from iot_simulation.parallel import make_shards, run_shards, cell_rng
 
 load_dotenv()
 
-# Appliance definitions
-appliances = {
+# Appliance definitions: usage hours as (distribution, *params) per season slot
+appliance_hours = {
     "fan": {
         "power": 0.07,
-        "summer_hours": lambda: max(0, np.random.normal(14, 2)),
-        "winter_hours": lambda: max(0, np.random.normal(2, 1))
+        "summer_hours": ("normal", 14, 2),
+        "winter_hours": ("normal", 2, 1)
     },
     "light": {
         "power": 0.01,
-        "daily_hours": lambda: max(0, np.random.normal(5, 1.5))
+        "daily_hours": ("normal", 5, 1.5)
     },
     "ac": {
         "power": 1.0,
-        "summer_hours": lambda: max(0, np.random.normal(6, 2)),
-        "winter_hours": lambda: max(0, np.random.uniform(0, 0.5))
+        "summer_hours": ("normal", 6, 2),
+        "winter_hours": ("uniform", 0, 0.5)
     },
     "fridge": {
         "power": 0.15,
-        "daily_hours": lambda: max(0, np.random.normal(24, 0.1))
+        "daily_hours": ("normal", 24, 0.1)
     },
     "tv": {
         "power": 0.08,
-        "daily_hours": lambda: max(0, np.random.normal(4, 1.5))
+        "daily_hours": ("normal", 4, 1.5)
     },
     "washing_machine": {
         "power": 0.5,
-        "daily_hours": lambda: max(0, np.random.exponential(0.5))
+        "daily_hours": ("exponential", 0.5)
     },
     "computer": {
         "power": 0.15,
-        "daily_hours": lambda: max(0, np.random.normal(6, 2))
+        "daily_hours": ("normal", 6, 2)
     },
     "microwave": {
         "power": 1.0,
-        "daily_hours": lambda: max(0, np.random.exponential(0.3))
+        "daily_hours": ("exponential", 0.3)
     },
     "router": {
         "power": 0.01,
-        "daily_hours": lambda: 24
+        "daily_hours": ("constant", 24)
     },
     "water_heater": {
         "power": 1.0,
-        "winter_hours": lambda: max(0, np.random.normal(1, 0.5)),
-        "summer_hours": lambda: max(0, np.random.normal(0.5, 0.2))
+        "winter_hours": ("normal", 1, 0.5),
+        "summer_hours": ("normal", 0.5, 0.2)
     }
 }
 
+# Time-of-day usage windows per appliance: (start_hour, end_hour, relative weight)
+appliance_usage_windows = {
+    "fan": [(0, 7, 1.0), (12, 18, 0.8), (18, 24, 1.0)],
+    "light": [(5, 7, 0.4), (18, 24, 1.0)],
+    "ac": [(0, 6, 0.7), (13, 18, 0.8), (21, 24, 1.0)],
+    "fridge": [(0, 24, 1.0)],
+    "tv": [(12, 14, 0.3), (19, 24, 1.0)],
+    "washing_machine": [(8, 12, 1.0), (16, 18, 0.4)],
+    "computer": [(9, 17, 0.7), (19, 23, 1.0)],
+    "microwave": [(7, 9, 1.0), (12, 14, 0.8), (19, 21, 1.0)],
+    "router": [(0, 24, 1.0)],
+    "water_heater": [(5, 9, 1.0), (18, 21, 0.5)]
+}
+
+def load_curve(windows):
+    # 24 hourly weights summing to 1
+    curve = np.zeros(24)
+    for start_hour, end_hour, weight in windows:
+        curve[start_hour:end_hour] += weight
+    return curve / curve.sum()
+
+# Appliances duplicated per house-size multiplier
+SIZE_SCALED_APPLIANCES = ["fan", "light", "tv", "computer"]
+
+SEASONS = ("summer", "transition", "winter")
+
+# Usage-hour multipliers applied on transition-season days
+TRANSITION_MULTIPLIERS = {"fan": 0.7, "ac": 0.7, "water_heater": 1.2}
+
+# Seasonal renewable output: (mean, std) of the daily capacity factor and the season multiplier
+SOLAR_FACTORS = {"summer": (5, 1), "transition": (4, 1), "winter": (3, 1)}
+WIND_FACTORS = {"summer": (3, 1), "transition": (5, 1.5), "winter": (4, 1)}
+RENEWABLE_SEASON_FACTORS = {"summer": 1.2, "transition": 1.0, "winter": 0.8}
+
+# The same tables as (mean, std) / factor arrays indexed by position in SEASONS
+SOLAR_PARAMS = np.array([SOLAR_FACTORS[s] for s in SEASONS], dtype=float)
+WIND_PARAMS = np.array([WIND_FACTORS[s] for s in SEASONS], dtype=float)
+RENEWABLE_SEASON_FACTOR_ARRAY = np.array([RENEWABLE_SEASON_FACTORS[s] for s in SEASONS])
+SOLAR_EFFICIENCY = 0.2
+WIND_EFFICIENCY = 0.3
+
+# Tariff used by InsertElectricityConsumption (sql_files/pl_sql.sql)
+ELECTRICITY_MULTIPLIERS = [1.00, 1.35, 1.41, 1.48, 2.63]
+ELECTRICITY_TIERS = [75, 125, 100, 200, float('inf')]
+
+# Rows per multi-row INSERT statement
+INSERT_BATCH_SIZE = 5000
+
+# Existing (user_id, consumption_date) rows are skipped without an update, so reruns fire no update triggers
+INSERT_ELECTRICITY_SQL = """
+    INSERT IGNORE INTO daily_electricity_consumption
+    (user_id, utility_provider_id, consumption_date, units_consumed, daily_bill, payment_status)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+INSERT_HOURLY_LOAD_SQL = """
+    INSERT IGNORE INTO hourly_electricity_load (user_id, consumption_date, hourly_kwh)
+    VALUES (%s, %s, %s)
+"""
+
+# Compiled profiles kept per (size category, member count); there are only 12 combinations
+PROFILE_CACHE_SIZE = 32
+
+DISTRIBUTION_KINDS = ("none", "normal", "uniform", "exponential", "constant")
+
+# Data-only appliance set for one household type; every array is indexed [appliance, season]
+ApplianceProfile = namedtuple("ApplianceProfile", [
+    "names",               # appliance names, size-scaled ones expanded as fan_0, fan_1, ...
+    "power",               # kW per appliance
+    "kinds",               # index into DISTRIBUTION_KINDS, 0 where the appliance is off that season
+    "params",              # distribution parameters, shape (appliances, seasons, 2)
+    "season_mask",         # True where the appliance runs in that season
+    "hour_multipliers",    # member factor x transition multiplier applied to drawn hours
+    "load_curves"          # share of each appliance's daily energy per hour, shape (appliances, 24)
+])
+
 # DB settings
 MYSQL_HOST = os.getenv('MYSQL_HOST')
 MYSQL_USER = os.getenv('MYSQL_USER')
@@ -107,38 +187,89 @@ def get_house_size_category(square_footage):
     else:
         return "large"
 
-def scale_appliances(house_size, num_members):
-    size_multiplier = {
-        "small": 1.0,
-        "medium": 1.3,
-        "large": 1.6
-    }
-    member_factor = min(4, num_members) / 3
-    
-    scaled = {}
-    for appliance, details in appliances.items():
-        summer_func = (lambda base=details.get('summer_hours'): (lambda: max(0, base() * member_factor)))() if 'summer_hours' in details else None
-        winter_func = (lambda base=details.get('winter_hours'): (lambda: max(0, base() * member_factor)))() if 'winter_hours' in details else None
-        daily_func = (lambda base=details.get('daily_hours'): (lambda: max(0, base() * member_factor)))() if 'daily_hours' in details else None
-        
-        scaled[appliance] = {
-            "power": details["power"],
-            "summer_hours": summer_func,
-            "winter_hours": winter_func,
-            "daily_hours": daily_func
-        }
-
-    final_appliances = {}
-    multiplier = int(size_multiplier[get_house_size_category(house_size)])
-    
-    for appliance in ["fan", "light", "tv", "computer"]:
-        for i in range(multiplier):
-            final_appliances[f"{appliance}_{i}"] = scaled[appliance]
-    
-    for appliance in ["ac", "fridge", "washing_machine", "microwave", "router", "water_heater"]:
-        final_appliances[appliance] = scaled[appliance]
-    
-    return final_appliances
+SIZE_MULTIPLIERS = {
+    "small": 1.0,
+    "medium": 1.3,
+    "large": 1.6
+}
+
+def season_hours_spec(details, season):
+    # Transition days only use daily_hours, so fan, ac and water_heater are off then
+    if season == "summer" and details.get("summer_hours"):
+        return details["summer_hours"]
+    if season == "winter" and details.get("winter_hours"):
+        return details["winter_hours"]
+    return details.get("daily_hours")
+
+@lru_cache(maxsize=PROFILE_CACHE_SIZE)
+def compile_appliance_profile(size_category, member_count):
+    member_factor = member_count / 3
+    copies = int(SIZE_MULTIPLIERS[size_category])
+
+    names, power, kinds, params, multipliers, curves = [], [], [], [], [], []
+    for appliance, details in appliance_hours.items():
+        appliance_copies = [f"{appliance}_{i}" for i in range(copies)] if appliance in SIZE_SCALED_APPLIANCES else [appliance]
+        for name in appliance_copies:
+            names.append(name)
+            power.append(details["power"])
+            curves.append(load_curve(appliance_usage_windows[appliance]))
+            row_kinds, row_params, row_multipliers = [], [], []
+            for season in SEASONS:
+                spec = season_hours_spec(details, season)
+                kind, *values = spec if spec else ("none",)
+                row_kinds.append(DISTRIBUTION_KINDS.index(kind))
+                row_params.append((list(values) + [0, 0])[:2])
+                transition = TRANSITION_MULTIPLIERS.get(appliance, 1.0) if season == "transition" else 1.0
+                row_multipliers.append(member_factor * transition)
+            kinds.append(row_kinds)
+            params.append(row_params)
+            multipliers.append(row_multipliers)
+
+    kinds = np.array(kinds, dtype=np.int8)
+    profile = ApplianceProfile(
+        names=tuple(names),
+        power=np.array(power),
+        kinds=kinds,
+        params=np.array(params, dtype=float),
+        season_mask=kinds != 0,
+        hour_multipliers=np.array(multipliers),
+        load_curves=np.array(curves)
+    )
+    for array in profile[1:]:
+        array.setflags(write=False)
+    return profile
+
+def appliance_profile_key(house_size, num_members):
+    return get_house_size_category(house_size), min(4, int(num_members))
+
+def simulate_appliance_energy(profile, season_idx, n_users, rng=np.random):
+    """
+    Draw daily energy (kWh) per appliance for users sharing one profile.
+    Returns a (n_users, len(season_idx), len(profile.names)) array.
+    """
+    energy = np.zeros((n_users, len(season_idx), len(profile.names)))
+    users = np.arange(n_users)
+    for season in range(len(SEASONS)):
+        days = np.flatnonzero(season_idx == season)
+        if not days.size:
+            continue
+        for kind_code, kind in enumerate(DISTRIBUTION_KINDS):
+            apps = np.flatnonzero(profile.kinds[:, season] == kind_code)
+            if kind == "none" or not apps.size:
+                continue
+            first, second = profile.params[apps, season].T
+            size = (n_users, days.size, apps.size)
+            if kind == "normal":
+                hours = rng.normal(first, second, size=size)
+            elif kind == "uniform":
+                hours = rng.uniform(first, second, size=size)
+            elif kind == "exponential":
+                hours = rng.exponential(first, size=size)
+            else:
+                hours = np.broadcast_to(first, size)
+            hours = np.maximum(0, hours) * profile.hour_multipliers[apps, season]
+            energy[np.ix_(users, days, apps)] = hours * profile.power[apps]
+    return energy
 
 def get_season(date_obj):
     month = date_obj.month
@@ -167,73 +298,152 @@ def get_simulation_date_ranges():
     return date_ranges
 
 
-def simulate_renewable_generation(solar_capacity, wind_capacity, season="summer"):
-    solar_factors = {"summer": np.random.normal(5, 1), "transition": np.random.normal(4, 1), "winter": np.random.normal(3, 1)}
-    wind_factors = {"summer": np.random.normal(3, 1), "transition": np.random.normal(5, 1.5), "winter": np.random.normal(4, 1)}
-    solar_output = solar_capacity * 0.2 * solar_factors[season]
-    wind_output = wind_capacity * 0.3 * wind_factors[season]
-    return max(0, solar_output + wind_output)
-
-def simulate_daily_consumption(square_footage, num_members, date_obj, solar_capacity=0, wind_capacity=0):
-    season = get_season(date_obj)
-    appliance_set = scale_appliances(square_footage, num_members)
-    
-    total_consumption = 0
-    for appliance, details in appliance_set.items():
-        try:
-            if season == "summer" and details["summer_hours"]:
-                hours = details["summer_hours"]()
-            elif season == "winter" and details["winter_hours"]:
-                hours = details["winter_hours"]()
-            elif details["daily_hours"]:
-                hours = details["daily_hours"]()
-            else:
-                hours = 0
+def season_indices(dates):
+    return np.array([SEASONS.index(get_season(d)) for d in dates], dtype=int)
+
+def simulate_renewable_generation_block(dates, solar_capacity, wind_capacity, rng=np.random):
+    """
+    Renewable generation for each user (rows) on each date (columns). Only users with a
+    nonzero solar or wind capacity draw samples for that source; everyone else gets 0.
+    dates may also be an array of SEASONS indices.
+    """
+    solar_capacity = np.asarray(solar_capacity, dtype=float)
+    wind_capacity = np.asarray(wind_capacity, dtype=float)
+    dates = np.asarray(dates)
+    season_idx = dates if dates.dtype.kind == 'i' else season_indices(dates)
+
+    generation = np.zeros((len(solar_capacity), len(season_idx)))
+    for capacity, params, efficiency in (
+        (solar_capacity, SOLAR_PARAMS, SOLAR_EFFICIENCY),
+        (wind_capacity, WIND_PARAMS, WIND_EFFICIENCY)
+    ):
+        rows = np.flatnonzero(capacity)
+        if rows.size:
+            mean, std = params[season_idx].T
+            factors = rng.normal(mean, std, size=(rows.size, len(season_idx)))
+            generation[rows] += capacity[rows, None] * efficiency * factors
+    return np.maximum(0, generation)
 
-            if season == "transition":
-                if appliance.startswith(("fan", "ac")):
-                    hours *= 0.7
-                elif appliance == "water_heater":
-                    hours *= 1.2
+def simulate_renewable_generation(solar_capacity, wind_capacity, season="summer"):
+    generation = simulate_renewable_generation_block([SEASONS.index(season)], [solar_capacity], [wind_capacity])
+    return float(generation[0, 0])
+
+def estimate_renewable_generation(dates=None, rng=np.random):
+    """
+    Bulk-estimate daily generation for every household with solar or wind capacity.
+    Returns {user_id: generation per date} over dates (the simulation window by default).
+    """
+    dates = get_simulation_dates() if dates is None else dates
+    conn = get_db_connection()
+    cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+    cursor.execute("""
+        SELECT user_id, solar_panel_watt, wind_source_watt
+        FROM user_housing
+        WHERE solar_panel_watt > 0 OR wind_source_watt > 0
+    """)
+    households = cursor.fetchall()
+    cursor.close()
+    conn.close()
 
-            total_consumption += details["power"] * hours
-        except Exception as e:
-            print(f"Error with {appliance}: {str(e)}")
-            continue
+    generation = simulate_renewable_generation_block(
+        dates,
+        [h['solar_panel_watt'] or 0 for h in households],
+        [h['wind_source_watt'] or 0 for h in households],
+        rng=rng
+    ) * RENEWABLE_SEASON_FACTOR_ARRAY[season_indices(dates)]
+    return {h['user_id']: row for h, row in zip(households, generation)}
 
-    renewable_generation = simulate_renewable_generation(solar_capacity, wind_capacity, season)
-    renewable_factor = 1.2 if season == "summer" else (0.8 if season == "winter" else 1.0)
-    renewable_generation *= renewable_factor
-    
-    net_consumption = max(5, total_consumption - renewable_generation)
-    return round(net_consumption, 2)
+def simulate_daily_consumption(square_footage, num_members, date_obj, solar_capacity=0, wind_capacity=0):
+    units = simulate_consumption_block([square_footage], [num_members], [date_obj], [solar_capacity], [wind_capacity])
+    return float(units[0, 0])
+
+def simulate_consumption_block(house_sizes, num_members, dates, solar_capacity=None, wind_capacity=None, rng=np.random, hourly=False):
+    """
+    Simulate net daily consumption (kWh) for a block of users over the same dates.
+    Draws every appliance's hours as (users x days) arrays from the cached household
+    profiles. Returns a (len(users), len(dates)) array, or with hourly=True a
+    (daily, hourly) pair where hourly has shape (users, days, 24) and sums to daily.
+    """
+    n_users, n_days = len(house_sizes), len(dates)
+    solar_capacity = np.zeros(n_users) if solar_capacity is None else np.asarray(solar_capacity, dtype=float)
+    wind_capacity = np.zeros(n_users) if wind_capacity is None else np.asarray(wind_capacity, dtype=float)
+
+    season_idx = season_indices(dates)
+
+    # Users sharing a household type share one compiled profile
+    groups = {}
+    for row, (size, members) in enumerate(zip(house_sizes, num_members)):
+        groups.setdefault(appliance_profile_key(size, members), []).append(row)
+
+    total = np.zeros((n_users, n_days))
+    gross_hourly = np.zeros((n_users, n_days, 24)) if hourly else None
+    for key, rows in groups.items():
+        profile = compile_appliance_profile(*key)
+        energy = simulate_appliance_energy(profile, season_idx, len(rows), rng)
+        total[rows] = energy.sum(axis=2)
+        if hourly:
+            gross_hourly[rows] = energy @ profile.load_curves
+
+    # Renewable offset
+    renewable_generation = simulate_renewable_generation_block(
+        season_idx, solar_capacity, wind_capacity, rng
+    ) * RENEWABLE_SEASON_FACTOR_ARRAY[season_idx]
+
+    net_consumption = np.round(np.maximum(5, total - renewable_generation), 2)
+    if not hourly:
+        return net_consumption
+
+    # The net total is spread over the day in proportion to the gross appliance load
+    net_hourly = gross_hourly * (net_consumption / total)[..., None]
+    return net_consumption, reconcile_hourly_load(net_hourly, net_consumption)
+
+def reconcile_hourly_load(hourly, daily):
+    """
+    Cast hourly loads to float32 and push the rounding residual into each day's peak
+    hour, so the stored 24 values add up to the daily total.
+    """
+    hourly = hourly.astype(np.float32)
+    residual = daily - hourly.sum(axis=-1, dtype=np.float64)
+    peak = hourly.argmax(axis=-1)[..., None]
+    np.put_along_axis(hourly, peak, np.take_along_axis(hourly, peak, axis=-1) + residual[..., None].astype(np.float32), axis=-1)
+    return hourly
+
+def pack_hourly_load(hourly):
+    # One user-day as a 96-byte little-endian float32[24] blob
+    return np.asarray(hourly, dtype='<f4').tobytes()
+
+def unpack_hourly_load(blob):
+    return np.frombuffer(blob, dtype='<f4')
 
 def fetch_all_users():
     conn = get_db_connection()
     cursor = conn.cursor(MySQLdb.cursors.DictCursor)
     cursor.execute("""
         SELECT u.id AS user_id, u.electricity_provider AS utility_provider_id,
-               uh.house_size_sqft, uh.num_members, uh.solar_panel_watt, uh.wind_source_watt
+               uh.house_size_sqft, uh.num_members, uh.solar_panel_watt, uh.wind_source_watt,
+               up.unit_price AS base_rate
         FROM user u
         LEFT JOIN user_housing uh ON u.id = uh.user_id
+        LEFT JOIN utility_providers up ON u.electricity_provider = up.id
     """)
     users = cursor.fetchall()
     cursor.close()
     conn.close()
     return users
 
+def get_payment_status(date, today=None):
+    today = today or datetime.date.today()
+    # If the date is in the current month or previous month → due
+    if (date.year == today.year and date.month >= today.month - 1) or (date.year == today.year and today.month == 1 and date.month == 12):
+        return 'due'
+    return 'paid'
+
 def log_daily_consumption(user_id, utility_provider_id, date, units_consumed):
     conn = get_db_connection()
     cursor = conn.cursor()
 
     try:
-        today = datetime.date.today()
-        # If the date is in the current month or previous month → due
-        if (date.year == today.year and date.month >= today.month - 1) or (date.year == today.year and today.month == 1 and date.month == 12):
-            payment_status = 'due'
-        else:
-            payment_status = 'paid'
-
+        payment_status = get_payment_status(date)
         cursor.callproc('InsertElectricityConsumption', (user_id, utility_provider_id, date, units_consumed, payment_status))
         print(f"✅ Inserted or Skipped: {user_id} on {date} - {units_consumed} kWh - Status: {payment_status}")
     except Exception as e:
@@ -263,24 +473,150 @@ def calculate_bill(total_units, base_rate, multipliers, tiers, service_charge=10
     vat = subtotal * vat_rate
     return subtotal + vat
 
-def calculate_and_log_consumption():
-    all_users = fetch_all_users()
-    date_ranges = get_simulation_date_ranges()
-
-    for user in all_users:
-        user_id = user['user_id']
-        utility_provider_id = user['utility_provider_id']
-        house_size = user['house_size_sqft']
-        num_members = user['num_members'] or 4
-        solar_capacity = user['solar_panel_watt'] or 0
-        wind_capacity = user['wind_source_watt'] or 0
-
-        for start_date, end_date in date_ranges:
-            current_date = start_date
-            while current_date <= end_date:
-                units = simulate_daily_consumption(house_size, num_members, current_date, solar_capacity, wind_capacity)
-                log_daily_consumption(user_id, utility_provider_id, current_date, units)
-                current_date += datetime.timedelta(days=1)
+def calculate_bills(units, base_rates, multipliers=ELECTRICITY_MULTIPLIERS, tiers=ELECTRICITY_TIERS, service_charge=10, demand_charge=30, meter_rent=10, vat_rate=0.05):
+    """
+    Array version of calculate_bill: units and base_rates broadcast against each other,
+    e.g. a (users, days) units array with a (users, 1) column of provider rates.
+    """
+    units = np.asarray(units, dtype=float)
+    base_rates = np.asarray(base_rates, dtype=float)
+    total = np.zeros(np.broadcast(units, base_rates).shape)
+    remaining = units
+
+    for limit, multiplier in zip(tiers, multipliers):
+        in_this_tier = np.clip(remaining, 0, limit)
+        total += in_this_tier * base_rates * multiplier
+        remaining = remaining - in_this_tier
+
+    total += np.maximum(remaining, 0) * base_rates * multipliers[-1]
+
+    subtotal = total + service_charge + demand_charge + meter_rent
+    vat = subtotal * vat_rate
+    return subtotal + vat
+
+def get_simulation_dates():
+    # Chronological list of every day in get_simulation_date_ranges
+    dates = []
+    for start_date, end_date in get_simulation_date_ranges():
+        current_date = start_date
+        while current_date <= end_date:
+            dates.append(current_date)
+            current_date += datetime.timedelta(days=1)
+    return sorted(dates)
+
+def group_users_by_start(users, dates, watermarks=None):
+    """
+    Yield (first_date_index, users) groups. Without watermarks every user starts at
+    dates[0]; with them each user resumes the day after their last logged date and
+    users that are already up to date are dropped.
+    """
+    if watermarks is None:
+        yield 0, users
+        return
+
+    by_start = {}
+    for user in users:
+        start_date = resume_start_date(watermarks.get(user['user_id']), dates[0])
+        if start_date > dates[-1]:
+            continue
+        by_start.setdefault((start_date - dates[0]).days, []).append(user)
+    yield from sorted(by_start.items(), key=lambda item: item[0])
+
+def simulate_electricity_day(user, date_obj, seed=None, rng=np.random, hourly=False):
+    """
+    Simulate one user-day. With a seed the draws come from the keyed (user, date) stream,
+    so the same cell always gets the same units and can be regenerated on its own.
+    With hourly=True returns (units, 24 hourly kWh values).
+    """
+    if seed is not None:
+        rng = cell_rng(seed, "electricity", user['user_id'], date_obj)
+    result = simulate_consumption_block(
+        [user['house_size_sqft']],
+        [user['num_members'] or 4],
+        [date_obj],
+        [user['solar_panel_watt'] or 0],
+        [user['wind_source_watt'] or 0],
+        rng=rng,
+        hourly=hourly
+    )
+    if hourly:
+        units, hourly_load = result
+        return float(units[0, 0]), hourly_load[0, 0]
+    return float(result[0, 0])
+
+def simulate_electricity_shard(shard, rng, keyed_seed=None, hourly=False):
+    # Runs in a worker process: simulate one block of users and return their rows
+    # (and with hourly=True, their packed hourly load rows as well)
+    dates, payment_statuses, users = shard
+    block_hourly = None
+    if keyed_seed is None:
+        result = simulate_consumption_block(
+            [user['house_size_sqft'] for user in users],
+            [user['num_members'] or 4 for user in users],
+            dates,
+            [user['solar_panel_watt'] or 0 for user in users],
+            [user['wind_source_watt'] or 0 for user in users],
+            rng=rng,
+            hourly=hourly
+        )
+        block_units, block_hourly = result if hourly else (result, None)
+    else:
+        cells = [[simulate_electricity_day(user, d, keyed_seed, hourly=hourly) for d in dates] for user in users]
+        if hourly:
+            block_units = np.array([[units for units, _ in row] for row in cells])
+            block_hourly = np.array([[load for _, load in row] for row in cells])
+        else:
+            block_units = np.array(cells)
+    block_bills = calculate_bills(block_units, [[user['base_rate']] for user in users])
+
+    rows = [
+        (user['user_id'], user['utility_provider_id'], current_date, units, bill, status)
+        for user, user_units, user_bills in zip(users, block_units.tolist(), block_bills.tolist())
+        for current_date, units, bill, status in zip(dates, user_units, user_bills, payment_statuses)
+    ]
+    if not hourly:
+        return rows
+
+    hourly_rows = [
+        (user['user_id'], current_date, pack_hourly_load(day_load))
+        for user, user_hourly in zip(users, block_hourly)
+        for current_date, day_load in zip(dates, user_hourly)
+    ]
+    return rows, hourly_rows
+
+def calculate_and_log_consumption(resume=False, workers=None, seed=None, keyed_seed=None, hourly=False):
+    all_users = [
+        user for user in fetch_all_users()
+        if user['house_size_sqft'] is not None and user['base_rate'] is not None
+    ]
+    dates = get_simulation_dates()
+    today = datetime.date.today()
+    payment_statuses = [get_payment_status(d, today) for d in dates]
+
+    # Hourly rows must belong to newly simulated days only, so hourly runs always resume
+    resume = resume or hourly
+
+    conn = get_db_connection()
+    try:
+        watermarks = fetch_watermarks(conn, 'daily_electricity_consumption') if resume else None
+
+        shards = [
+            (dates[first_day:], payment_statuses[first_day:], block)
+            for first_day, users in group_users_by_start(all_users, dates, watermarks)
+            for block in make_shards(users)
+        ]
+
+        # Workers simulate; this process is the only writer
+        # keyed_seed switches to per-cell streams, e.g. to regenerate or repair single days
+        simulate_shard = partial(simulate_electricity_shard, keyed_seed=keyed_seed, hourly=hourly)
+        for (shard_dates, _, block), result in zip(shards, run_shards(simulate_shard, shards, workers, seed)):
+            rows, hourly_rows = result if hourly else (result, [])
+            insert_rows(conn, INSERT_ELECTRICITY_SQL, rows, INSERT_BATCH_SIZE)
+            if hourly_rows:
+                insert_rows(conn, INSERT_HOURLY_LOAD_SQL, hourly_rows, INSERT_BATCH_SIZE)
+            print(f"✅ Logged electricity for {len(block)} users from {shard_dates[0]} ({len(rows)} rows)")
+    finally:
+        conn.close()
 
 def main(user_id):
     user = fetch_user_data(user_id)
@@ -292,15 +628,13 @@ def main(user_id):
     
     today = datetime.date.today()
     total_units = sum(simulate_daily_consumption(house_size, num_members, today - datetime.timedelta(days=i), solar_capacity, wind_capacity) for i in range(31))
-    multipliers = [1.00, 1.35, 1.41, 1.48, 2.63]
-    tiers = [75, 125, 100, 200, float('inf')]
-    total_bill = calculate_bill(total_units, base_rate, multipliers, tiers)
+    total_bill = calculate_bill(total_units, base_rate, ELECTRICITY_MULTIPLIERS, ELECTRICITY_TIERS)
     
     print(f"Total Monthly Consumption: {total_units:.2f} kWh")
     print(f"Total Electricity Bill: Tk {total_bill:.2f}")
 
 if __name__ == "__main__":
-    calculate_and_log_consumption()
+    calculate_and_log_consumption(resume=True)
 
 
 # https://bdepoint.com/electric-bill-calculation-bangladesh/
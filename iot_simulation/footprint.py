@@ -1,8 +1,12 @@
+import sys
 import MySQLdb
+import numpy as np
 import os
 import datetime
 from dotenv import load_dotenv
 from dateutil.relativedelta import relativedelta
+from iot_simulation.db import insert_rows, fetch_watermarks, resume_start_date
+from iot_simulation.dashboard import refresh_dashboard_snapshots
 
 load_dotenv()
 
@@ -33,14 +37,127 @@ EMISSION_FACTORS = {
     "water": 0.00025       # kg CO2 per liter
 }
 
+CONSUMPTION_TABLES = [
+    'daily_electricity_consumption',
+    'daily_fuel_consumption',
+    'daily_gas_consumption',
+    'daily_water_consumption'
+]
+
+# Average across fuel types, used for the per-user daily fuel total
+AVERAGE_FUEL_FACTOR = 2.4
+
+# Emission classes: (upper bound in kg, tag, suggestion), checked in order
+EMISSION_CLASSES = [
+    (10, "Good", "Excellent! Your carbon footprint is low. Keep it up!"),
+    (25, "Moderate", "Moderate footprint. Try reducing fuel or electricity usage."),
+    (float("inf"), "High", "High footprint! Consider using public transport, saving water, and switching to renewable energy.")
+]
+
+# Table and daily value column for each utility
+FOOTPRINT_SOURCES = {
+    "electricity_units": ("daily_electricity_consumption", "units_consumed"),
+    "fuel_liters": ("daily_fuel_consumption", "fuel_used_liters"),
+    "gas_cubic_meters": ("daily_gas_consumption", "gas_used_cubic_meters"),
+    "water_liters": ("daily_water_consumption", "liters_consumed")
+}
+
+# Work set of one refresh: the footprint_changes rows it read, so exactly those are cleared.
+# Trigger rows committed while it runs (even with lower ids) are left for the next refresh.
+CREATE_WORK_SET_SQL = """
+    CREATE TEMPORARY TABLE footprint_work (
+        id BIGINT PRIMARY KEY,
+        user_id INT NOT NULL,
+        consumption_date DATE NOT NULL,
+        INDEX (user_id, consumption_date)
+    )
+"""
+
+READ_CHANGES_SQL = """
+    SELECT id, user_id, consumption_date
+    FROM footprint_changes
+"""
+
+FILL_WORK_SET_SQL = """
+    INSERT INTO footprint_work (id, user_id, consumption_date)
+    VALUES (%s, %s, %s)
+"""
+
+CLEAR_CHANGES_SQL = """
+    DELETE c FROM footprint_changes c
+    JOIN footprint_work w ON w.id = c.id
+"""
+
+# Dirty user-days of the current work set
+CHANGED_DAYS_SQL = """
+    SELECT DISTINCT user_id, consumption_date
+    FROM footprint_work
+"""
+
+def window_query(table, column, changed_only=False):
+    # Daily value per (user, day offset from the window start) for the whole window at once.
+    # changed_only restricts it to CHANGED_DAYS_SQL, the user-days in footprint_work.
+    changed_join = f"JOIN ({CHANGED_DAYS_SQL}) c ON c.user_id = t.user_id AND c.consumption_date = t.consumption_date" if changed_only else ""
+    return f"""
+        SELECT t.user_id, DATEDIFF(t.consumption_date, %s), SUM(t.{column})
+        FROM {table} t
+        {changed_join}
+        WHERE t.consumption_date BETWEEN %s AND %s
+        GROUP BY t.user_id, t.consumption_date
+    """
+
+WINDOW_QUERIES = {key: window_query(*source) for key, source in FOOTPRINT_SOURCES.items()}
+CHANGED_WINDOW_QUERIES = {key: window_query(*source, changed_only=True) for key, source in FOOTPRINT_SOURCES.items()}
+
+# Emission factor per WINDOW_QUERIES column, in the same order
+WINDOW_FACTORS = np.array([EMISSION_FACTORS['electricity'], AVERAGE_FUEL_FACTOR, EMISSION_FACTORS['gas'], EMISSION_FACTORS['water']])
+
+LOGGED_FOOTPRINTS_SQL = """
+    SELECT user_id, DATEDIFF(consumption_date, %s)
+    FROM daily_carbon_footprint
+    WHERE consumption_date BETWEEN %s AND %s
+"""
+
+INSERT_BATCH_SIZE = 5000
+
+INSERT_FOOTPRINT_SQL = """
+    INSERT IGNORE INTO daily_carbon_footprint
+    (user_id, consumption_date, electricity_emission_kg, fuel_emission_kg, gas_emission_kg, water_emission_kg, total_emission_kg, emission_tag, suggestions)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+UPSERT_FOOTPRINT_SQL = """
+    INSERT INTO daily_carbon_footprint
+    (user_id, consumption_date, electricity_emission_kg, fuel_emission_kg, gas_emission_kg, water_emission_kg, total_emission_kg, emission_tag, suggestions)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        electricity_emission_kg = VALUES(electricity_emission_kg),
+        fuel_emission_kg = VALUES(fuel_emission_kg),
+        gas_emission_kg = VALUES(gas_emission_kg),
+        water_emission_kg = VALUES(water_emission_kg),
+        total_emission_kg = VALUES(total_emission_kg),
+        emission_tag = VALUES(emission_tag),
+        suggestions = VALUES(suggestions)
+"""
+
+DELETE_FOOTPRINT_SQL = """
+    DELETE FROM daily_carbon_footprint
+    WHERE user_id = %s AND consumption_date = %s
+"""
+
 # Classify emissions
 def classify_emission(total_emission_kg):
-    if total_emission_kg <= 10:
-        return "Good", "Excellent! Your carbon footprint is low. Keep it up!"
-    elif total_emission_kg <= 25:
-        return "Moderate", "Moderate footprint. Try reducing fuel or electricity usage."
-    else:
-        return "High", "High footprint! Consider using public transport, saving water, and switching to renewable energy."
+    for upper_bound, tag, suggestion in EMISSION_CLASSES:
+        if total_emission_kg <= upper_bound:
+            return tag, suggestion
+
+def classify_emissions(total_emission_kg):
+    # Array version of classify_emission: returns (tags, suggestions)
+    *bounded, (_, default_tag, default_suggestion) = EMISSION_CLASSES
+    conditions = [total_emission_kg <= upper_bound for upper_bound, _, _ in bounded]
+    tags = np.select(conditions, [tag for _, tag, _ in bounded], default_tag)
+    suggestions = np.select(conditions, [suggestion for _, _, suggestion in bounded], default_suggestion)
+    return tags, suggestions
 
 # Fetch all daily consumption for a specific date
 def fetch_daily_consumption(date_obj):
@@ -93,7 +210,7 @@ def fetch_daily_consumption(date_obj):
 # Calculate emissions
 def calculate_emissions(data):
     electricity_emission = data.get('electricity_units', 0) * EMISSION_FACTORS['electricity']
-    fuel_emission = data.get('fuel_liters', 0) * 2.4  # Average across fuel types
+    fuel_emission = data.get('fuel_liters', 0) * AVERAGE_FUEL_FACTOR  # Average across fuel types
     gas_emission = data.get('gas_cubic_meters', 0) * EMISSION_FACTORS['gas']
     water_emission = data.get('water_liters', 0) * EMISSION_FACTORS['water']
 
@@ -146,24 +263,173 @@ def log_carbon_footprint(user_id, date_obj, emissions, tag, suggestion):
         cursor.close()
         conn.close()
 
+def window_keys(user_ids, day_offsets, n_days):
+    # One int64 key per (user_id, day offset) pair
+    return np.asarray(user_ids, dtype=np.int64) * n_days + np.asarray(day_offsets, dtype=np.int64)
+
+def fetch_window_consumption(conn, window_start, window_end, changed_only=False):
+    """
+    Every utility's daily values between window_start and window_end, one query per utility,
+    joined on (user_id, day offset). Returns (keys, values): the window_keys of each user-day
+    and one value column per WINDOW_QUERIES entry, 0 where a utility has no row.
+    With changed_only only the user-days in the footprint_work table are read.
+    """
+    queries = CHANGED_WINDOW_QUERIES if changed_only else WINDOW_QUERIES
+    params = (window_start, window_start, window_end)
+    cursor = conn.cursor()
+    columns = []
+    try:
+        for query in queries.values():
+            cursor.execute(query, params)
+            columns.append(np.array(cursor.fetchall(), dtype=float).reshape(-1, 3))
+    finally:
+        cursor.close()
+
+    n_days = (window_end - window_start).days + 1
+    keys = [window_keys(column[:, 0], column[:, 1], n_days) for column in columns]
+    all_keys, rows = np.unique(np.concatenate(keys), return_inverse=True)
+
+    values = np.zeros((len(all_keys), len(columns)))
+    start = 0
+    for i, column in enumerate(columns):
+        values[rows[start:start + len(column)], i] = column[:, 2]
+        start += len(column)
+    return all_keys, values
+
+def fetch_logged_keys(conn, window_start, window_end):
+    # window_keys of the footprints already logged in the window
+    cursor = conn.cursor()
+    try:
+        cursor.execute(LOGGED_FOOTPRINTS_SQL, (window_start, window_start, window_end))
+        logged = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    finally:
+        cursor.close()
+    return window_keys(logged[:, 0], logged[:, 1], (window_end - window_start).days + 1)
+
+def calculate_window_emissions(values):
+    # Per-utility and total emissions (kg) for rows of WINDOW_QUERIES values
+    emissions = values * WINDOW_FACTORS
+    return np.round(emissions, 2), np.round(emissions.sum(axis=1), 2)
+
+def footprint_rows(keys, values, window_start, n_days):
+    # daily_carbon_footprint rows for window_keys and their WINDOW_QUERIES values
+    emissions, totals = calculate_window_emissions(values)
+    tags, suggestions = classify_emissions(totals)
+    dates = [window_start + datetime.timedelta(days=offset) for offset in range(n_days)]
+    return [
+        (user_id, dates[offset], *user_emissions, total, tag, suggestion)
+        for user_id, offset, user_emissions, total, tag, suggestion in zip(
+            (keys // n_days).tolist(), (keys % n_days).tolist(), emissions.tolist(), totals.tolist(), tags.tolist(), suggestions.tolist()
+        )
+    ]
+
 # Main calculation over past 6 months
-def calculate_and_log_for_past_six_months():
+def calculate_and_log_for_past_six_months(resume=False):
     today = datetime.date.today()
     six_months_ago = today.replace(day=1) - relativedelta(months=6)
 
-    current_date = six_months_ago
-    while current_date <= today:
-        print(f"\nProcessing {current_date}...")
-        all_data = fetch_daily_consumption(current_date)
+    conn = get_db_connection()
+    try:
+        watermarks = {}
+        window_start = six_months_ago
+        if resume:
+            watermarks = fetch_watermarks(conn, 'daily_carbon_footprint')
+            # Every user with logged consumption, including those without a footprint yet
+            consuming_users = set()
+            for table in CONSUMPTION_TABLES:
+                consuming_users.update(fetch_watermarks(conn, table))
+            if not consuming_users:
+                return
+            window_start = min(resume_start_date(watermarks.get(user_id), six_months_ago) for user_id in consuming_users)
+        if window_start > today:
+            return
+
+        print(f"Processing {window_start} to {today}...")
+        n_days = (today - window_start).days + 1
+        keys, values = fetch_window_consumption(conn, window_start, today)
+
+        # Anti-join against footprints already logged in the window
+        keep = ~np.isin(keys, fetch_logged_keys(conn, window_start, today))
+        if watermarks:
+            user_ids, day_offsets = keys // n_days, keys % n_days
+            # Resumed users are never backfilled on or before their last footprint
+            users, user_rows = np.unique(user_ids, return_inverse=True)
+            watermark_offsets = np.array([
+                (watermarks[user_id] - window_start).days if user_id in watermarks else -1
+                for user_id in users.tolist()
+            ], dtype=np.int64)
+            keep &= day_offsets > watermark_offsets[user_rows]
+
+        rows = footprint_rows(keys[keep], values[keep], window_start, n_days)
+        insert_rows(conn, INSERT_FOOTPRINT_SQL, rows, INSERT_BATCH_SIZE)
+        print(f"Logged {len(rows)} footprint records")
+    finally:
+        conn.close()
+
+def refresh_changed_footprints():
+    """
+    Recompute and upsert the footprints of the user-days recorded in footprint_changes by
+    the consumption triggers, so late or corrected consumption rows are picked up and the
+    work scales with what changed. Days left with no consumption lose their footprint.
+    The upserts, deletes and the clearing of the processed changes commit together.
+    Returns the ids of the users whose consumption changed.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # The change rows are read once and copied into the work set; every later step uses only those
+        cursor.execute(READ_CHANGES_SQL)
+        changes = cursor.fetchall()
+        if not changes:
+            conn.rollback()
+            print("No consumption changes to refresh")
+            return []
 
-        for user_id, consumptions in all_data.items():
-            emissions = calculate_emissions(consumptions)
-            tag, suggestion = classify_emission(emissions['total_kg'])
-            log_carbon_footprint(user_id, current_date, emissions, tag, suggestion)
+        cursor.execute(CREATE_WORK_SET_SQL)
+        for start in range(0, len(changes), INSERT_BATCH_SIZE):
+            cursor.executemany(FILL_WORK_SET_SQL, changes[start:start + INSERT_BATCH_SIZE])
 
-        current_date += datetime.timedelta(days=1)
+        changed = sorted({(user_id, consumption_date) for _, user_id, consumption_date in changes})
+        window_start = min(consumption_date for _, consumption_date in changed)
+        window_end = max(consumption_date for _, consumption_date in changed)
+        n_days = (window_end - window_start).days + 1
+        changed_keys = window_keys([user_id for user_id, _ in changed], [(d - window_start).days for _, d in changed], n_days)
+
+        keys, values = fetch_window_consumption(conn, window_start, window_end, changed_only=True)
+        rows = footprint_rows(keys, values, window_start, n_days)
+        emptied = changed_keys[~np.isin(changed_keys, keys)]
+        deleted = [(int(key // n_days), window_start + datetime.timedelta(days=int(key % n_days))) for key in emptied]
+
+        # One transaction, so a failure leaves the footprints and the change log as they were
+        for sql, batch_rows in ((UPSERT_FOOTPRINT_SQL, rows), (DELETE_FOOTPRINT_SQL, deleted)):
+            for start in range(0, len(batch_rows), INSERT_BATCH_SIZE):
+                cursor.executemany(sql, batch_rows[start:start + INSERT_BATCH_SIZE])
+        cursor.execute(CLEAR_CHANGES_SQL)
+        conn.commit()
+        print(f"Refreshed {len(rows)} footprint records, removed {len(deleted)}")
+        return sorted({user_id for user_id, _ in changed})
+    except MySQLdb.Error:
+        conn.rollback()
+        raise
+    finally:
+        # The temporary work set goes with the connection
+        cursor.close()
+        conn.close()
 
 if __name__ == "__main__":
-    print("Starting full carbon footprint simulation...")
-    calculate_and_log_for_past_six_months()
+    # Nightly path: every consumption write is logged in footprint_changes, so the refresher
+    # alone covers new and corrected days. --backfill additionally fills footprints for
+    # consumption logged before the triggers existed; it runs after the refresher and skips
+    # the days already logged, so no day is computed twice.
+    backfill = "--backfill" in sys.argv[1:]
+    print("Starting carbon footprint refresh...")
+    changed_users = refresh_changed_footprints()
+    if backfill:
+        # Not resumed: the refresher may just have moved each user's watermark to the latest day
+        calculate_and_log_for_past_six_months()
+
+    # Footprints are the last ingestion step, so the dashboards of changed users are rebuilt now
+    conn = get_db_connection()
+    refresh_dashboard_snapshots(conn, None if backfill else changed_users)
+    conn.close()
     print("\nCarbon footprint simulation completed ✅")
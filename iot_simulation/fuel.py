@@ -4,6 +4,10 @@ from datetime import datetime, timedelta, date
 import os
 from dotenv import load_dotenv
 from dateutil.relativedelta import relativedelta
+from functools import partial
+from itertools import groupby
+from iot_simulation.db import insert_rows, stream_query, fetch_watermarks, resume_start_date
+from iot_simulation.parallel import SHARD_SIZE, make_shards, run_shards, cell_rng
 
 load_dotenv()
 
@@ -35,6 +39,27 @@ WEEKEND_USAGE_MULTIPLIER = {
     "bus": {"urban": 1.0, "highway": 1.0}
 }
 
+# Share of the remaining distance given to each vehicle type (uniform low, high)
+DISTANCE_PORTIONS = {
+    "truck": (0.5, 0.8),
+    "bus": (0.7, 0.9),
+    "car": (0.3, 0.6),
+    "motorcycle": (0.1, 0.3)
+}
+
+WEEKEND_DISTANCE_MULTIPLIER = 1.5
+DAILY_VARIATION = (1.0, 0.075)
+
+INSERT_BATCH_SIZE = 5000
+
+INSERT_FUEL_SQL = """
+    INSERT IGNORE INTO daily_fuel_consumption (
+        user_id, vehicle_id, user_vehicle_id, consumption_date,
+        fuel_used_liters, fuel_cost, driving_condition, payment_status
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
 def get_db_connection():
     try:
         conn = MySQLdb.connect(
@@ -59,19 +84,21 @@ def validate_vehicle_data(vehicle):
     vehicle['highway_efficiency'] = max(8, min(60, vehicle.get('highway_efficiency', 15)))
     return vehicle
 
+USER_VEHICLES_SQL = """
+    SELECT uv.id as user_vehicle_id, uv.user_id, uv.vehicle_id,
+           uv.custom_daily_km, v.model_name, v.vehicle_type, v.fuel_type,
+           v.urban_efficiency, v.highway_efficiency, v.daily_average_km, v.description
+    FROM user_vehicles uv
+    JOIN vehicles v ON uv.vehicle_id = v.id
+    WHERE v.fuel_type != 'electric'
+    ORDER BY uv.user_id, v.vehicle_type DESC, v.daily_average_km DESC
+"""
+
 def fetch_user_vehicles():
     try:
         conn = get_db_connection()
         cursor = conn.cursor(MySQLdb.cursors.DictCursor)
-        cursor.execute("""
-            SELECT uv.id as user_vehicle_id, uv.user_id, uv.vehicle_id,
-                   uv.custom_daily_km, v.model_name, v.vehicle_type, v.fuel_type,
-                   v.urban_efficiency, v.highway_efficiency, v.daily_average_km, v.description
-            FROM user_vehicles uv
-            JOIN vehicles v ON uv.vehicle_id = v.id
-            WHERE v.fuel_type != 'electric'
-            ORDER BY uv.user_id, v.vehicle_type DESC, v.daily_average_km DESC
-        """)
+        cursor.execute(USER_VEHICLES_SQL)
         user_vehicles = {}
         for row in cursor.fetchall():
             user_id = row['user_id']
@@ -85,7 +112,28 @@ def fetch_user_vehicles():
         print(f"Database error fetching vehicles: {err}")
         return {}
 
-def calculate_vehicle_usage(user_vehicles, date_obj):
+def stream_user_fleets(conn):
+    """
+    Yield (user_id, vehicles) one user at a time from an unbuffered cursor. Rows arrive
+    ordered by user_id, so only the current user's fleet is held in memory.
+    """
+    rows = stream_query(conn, USER_VEHICLES_SQL)
+    for user_id, fleet_rows in groupby(rows, key=lambda row: row['user_id']):
+        yield user_id, [validate_vehicle_data(row) for row in fleet_rows]
+
+def iter_fleet_shards(fleets, max_vehicles=SHARD_SIZE):
+    # Group consecutive fleets into shards of about max_vehicles vehicles; a larger fleet is a shard of its own
+    shard, vehicle_count = [], 0
+    for fleet in fleets:
+        if shard and vehicle_count + len(fleet[1]) > max_vehicles:
+            yield shard
+            shard, vehicle_count = [], 0
+        shard.append(fleet)
+        vehicle_count += len(fleet[1])
+    if shard:
+        yield shard
+
+def calculate_vehicle_usage(user_vehicles, date_obj, rng=np.random):
     if not user_vehicles:
         return []
 
@@ -105,13 +153,13 @@ def calculate_vehicle_usage(user_vehicles, date_obj):
             distance = remaining_km
         else:
             if vehicle['vehicle_type'] == 'truck':
-                portion = np.random.uniform(0.5, 0.8)
+                portion = rng.uniform(0.5, 0.8)
             elif vehicle['vehicle_type'] == 'bus':
-                portion = np.random.uniform(0.7, 0.9)
+                portion = rng.uniform(0.7, 0.9)
             elif vehicle['vehicle_type'] == 'car':
-                portion = np.random.uniform(0.3, 0.6)
+                portion = rng.uniform(0.3, 0.6)
             else:
-                portion = np.random.uniform(0.1, 0.3)
+                portion = rng.uniform(0.1, 0.3)
             distance = remaining_km * portion
             remaining_km -= distance
 
@@ -120,20 +168,20 @@ def calculate_vehicle_usage(user_vehicles, date_obj):
 
     return results
 
-def simulate_daily_fuel_usage(vehicle, date_obj, distance):
+def simulate_daily_fuel_usage(vehicle, date_obj, distance, rng=np.random):
     try:
         if vehicle['fuel_type'] == 'electric':
             return 0, 0, 'none'
 
         season = get_season(date_obj)
         is_weekend = date_obj.weekday() >= 5
-        driving_condition = np.random.choice(
+        driving_condition = rng.choice(
             list(DRIVING_CONDITION_PROBS[season].keys()),
             p=list(DRIVING_CONDITION_PROBS[season].values())
         )
         efficiency = vehicle[f"{driving_condition}_efficiency"]
         base_fuel_used = distance / efficiency
-        daily_variation = np.random.normal(1.0, 0.075)
+        daily_variation = rng.normal(1.0, 0.075)
         fuel_used = max(0.1, base_fuel_used * daily_variation)
 
         if is_weekend:
@@ -146,6 +194,12 @@ def simulate_daily_fuel_usage(vehicle, date_obj, distance):
         print(f"Error simulating for vehicle {vehicle.get('model_name', 'unknown')}: {str(e)}")
         return 5.0, "urban"
 
+def get_payment_status(date_obj, today=None):
+    today = today or date.today()
+    if (date_obj.year == today.year and date_obj.month >= today.month - 1) or (date_obj.year == today.year and today.month == 1 and date_obj.month == 12):
+        return 'due'
+    return 'paid'
+
 def log_daily_consumption(user_id, vehicle_id, user_vehicle_id, date_obj, fuel_used, fuel_price, driving_condition):
     conn = None
     try:
@@ -153,11 +207,7 @@ def log_daily_consumption(user_id, vehicle_id, user_vehicle_id, date_obj, fuel_u
         cursor = conn.cursor()
 
         # Determine payment status
-        today = date.today()
-        if (date_obj.year == today.year and date_obj.month >= today.month - 1) or (date_obj.year == today.year and today.month == 1 and date_obj.month == 12):
-            payment_status = 'due'
-        else:
-            payment_status = 'paid'
+        payment_status = get_payment_status(date_obj)
 
         cursor.callproc('InsertFuelConsumption', (
             user_id,
@@ -197,37 +247,161 @@ def get_simulation_date_ranges():
     date_ranges.append(("current_month", today.replace(day=1), today))
     return date_ranges
 
-def calculate_and_log_fuel_consumption():
-    user_vehicles = fetch_user_vehicles()
-    if not user_vehicles:
-        print("No fuel-powered user vehicles found")
-        return False
+def simulate_fuel_day(user_id, vehicles, single_date, seed=None, rng=np.random):
+    """
+    Simulate one user-day for the whole fleet and return log_daily_consumption arguments
+    per vehicle. With a seed the draws come from the keyed (user, date) stream.
+    """
+    if seed is not None:
+        rng = cell_rng(seed, "fuel", user_id, single_date)
 
-    date_ranges = get_simulation_date_ranges()
+    rows = []
+    vehicle_distances = calculate_vehicle_usage(vehicles, single_date, rng)
 
-    for period_name, start_date, end_date in date_ranges:
-        print(f"\nProcessing {period_name.replace('_', ' ')} ({start_date} to {end_date})")
+    for vehicle, distance in vehicle_distances:
+        if distance <= 0 or vehicle['fuel_type'] == 'electric':
+            continue
 
-        for user_id, vehicles in user_vehicles.items():
-            for single_date in (start_date + timedelta(n) for n in range((end_date - start_date).days + 1)):
-                vehicle_distances = calculate_vehicle_usage(vehicles, single_date)
+        fuel_used, driving_condition = simulate_daily_fuel_usage(vehicle, single_date, distance, rng)
+        fuel_price = FUEL_PRICES.get(vehicle['fuel_type'], 0)
 
-                for vehicle, distance in vehicle_distances:
-                    if distance <= 0 or vehicle['fuel_type'] == 'electric':
-                        continue
+        rows.append((
+            user_id,
+            vehicle['vehicle_id'],
+            vehicle['user_vehicle_id'],
+            single_date,
+            fuel_used,
+            fuel_price,
+            str(driving_condition)
+        ))
+    return rows
+
+def simulate_fleet_block(vehicles, dates, rng=np.random):
+    """
+    Array version of calculate_vehicle_usage + simulate_daily_fuel_usage for one fleet over
+    all dates. The fleet is sorted once; returns the sorted vehicles and (vehicles, days)
+    arrays of distance, fuel used and an urban (True) / highway (False) mask.
+    """
+    fleet = sorted(vehicles, key=lambda x: x['vehicle_type'], reverse=True)
+    n_days = len(dates)
+    weekend = np.array([d.weekday() >= 5 for d in dates])
+    urban_probability = np.array([DRIVING_CONDITION_PROBS[get_season(d)]["urban"] for d in dates])
+
+    total_km = sum(v['daily_km'] for v in fleet) * np.where(weekend, WEEKEND_DISTANCE_MULTIPLIER, 1.0)
+    if len(fleet) == 1:
+        distance = total_km[None, :]
+    else:
+        # Each vehicle takes a portion of what the vehicles before it left over; the last takes the rest
+        low, high = np.array([DISTANCE_PORTIONS.get(v['vehicle_type'], (0.1, 0.3)) for v in fleet[:-1]]).T
+        portions = rng.uniform(low[:, None], high[:, None], size=(len(fleet) - 1, n_days))
+        left_over = np.cumprod(1 - portions, axis=0)
+        shares = np.vstack([portions[:1], portions[1:] * left_over[:-1], left_over[-1:]])
+        distance = np.round(np.clip(total_km * shares, 1, 500), 2)
+
+    urban = rng.random((len(fleet), n_days)) < urban_probability
+    efficiency = np.where(
+        urban,
+        np.array([v['urban_efficiency'] for v in fleet], dtype=float)[:, None],
+        np.array([v['highway_efficiency'] for v in fleet], dtype=float)[:, None]
+    )
+    daily_variation = rng.normal(*DAILY_VARIATION, size=(len(fleet), n_days))
+    fuel_used = np.maximum(0.1, distance / efficiency * daily_variation)
+
+    weekend_multiplier = np.where(
+        urban,
+        np.array([WEEKEND_USAGE_MULTIPLIER.get(v['vehicle_type'], {}).get("urban", 1.0) for v in fleet])[:, None],
+        np.array([WEEKEND_USAGE_MULTIPLIER.get(v['vehicle_type'], {}).get("highway", 1.0) for v in fleet])[:, None]
+    )
+    fuel_used = np.round(np.where(weekend, fuel_used * weekend_multiplier, fuel_used), 2)
+    return fleet, distance, fuel_used, urban
+
+def get_simulation_dates(start_date):
+    # Every date from start_date through today
+    today = date.today()
+    return [start_date + timedelta(n) for n in range((today - start_date).days + 1)]
+
+def fuel_row(user_id, vehicle, single_date, fuel_used, driving_condition, today):
+    fuel_price = FUEL_PRICES.get(vehicle['fuel_type'], 0)
+    return (
+        user_id,
+        vehicle['vehicle_id'],
+        vehicle['user_vehicle_id'],
+        single_date,
+        fuel_used,
+        fuel_used * fuel_price,
+        driving_condition,
+        get_payment_status(single_date, today)
+    )
+
+def simulate_fuel_shard(shard, rng, keyed_seed=None):
+    # Runs in a worker process: returns INSERT_FUEL_SQL rows for each vehicle-day
+    today = date.today()
+    rows = []
+    for user_id, vehicles, resume_from in shard:
+        dates = get_simulation_dates(resume_from)
+        if not dates:
+            continue
+
+        if keyed_seed is not None:
+            vehicles_by_id = {v['user_vehicle_id']: v for v in vehicles}
+            for single_date in dates:
+                for _, _, user_vehicle_id, _, fuel_used, _, driving_condition in simulate_fuel_day(user_id, vehicles, single_date, keyed_seed):
+                    rows.append(fuel_row(user_id, vehicles_by_id[user_vehicle_id], single_date, fuel_used, driving_condition, today))
+            continue
+
+        fleet, _, fuel_used, urban = simulate_fleet_block(vehicles, dates, rng)
+        for vehicle, vehicle_fuel, vehicle_urban in zip(fleet, fuel_used.tolist(), urban.tolist()):
+            rows.extend(
+                fuel_row(user_id, vehicle, single_date, liters, "urban" if is_urban else "highway", today)
+                for single_date, liters, is_urban in zip(dates, vehicle_fuel, vehicle_urban)
+            )
+    return rows
+
+def calculate_and_log_fuel_consumption(resume=False, workers=None, seed=None, keyed_seed=None, stream=False):
+    """
+    Simulate and log fuel for every user's fleet. With stream=True fleets are read through
+    an unbuffered cursor and simulated as they arrive, so peak memory follows the largest
+    single fleet instead of the whole user_vehicles table.
+    """
+    window_start = min(start_date for _, start_date, _ in get_simulation_date_ranges())
+
+    conn = get_db_connection()
+    read_conn = get_db_connection() if stream else None
+    try:
+        # Rows are per vehicle, so is the watermark: a vehicle added after the user's last
+        # logged day has none and starts the fleet at window_start
+        watermarks = fetch_watermarks(conn, 'daily_fuel_consumption', 'user_vehicle_id') if resume else {}
 
-                    fuel_used, driving_condition = simulate_daily_fuel_usage(vehicle, single_date, distance)
-                    fuel_price = FUEL_PRICES.get(vehicle['fuel_type'], 0)
+        if stream:
+            user_fleets = stream_user_fleets(read_conn)
+        else:
+            user_fleets = fetch_user_vehicles().items()
 
-                    log_daily_consumption(
-                        user_id,
-                        vehicle['vehicle_id'],
-                        vehicle['user_vehicle_id'],
-                        single_date,
-                        fuel_used,
-                        fuel_price,
-                        driving_condition
-                    )
+        # The whole fleet is simulated from its earliest missing day; INSERT IGNORE skips
+        # the vehicle-days already logged
+        fleets = (
+            (user_id, vehicles, min(resume_start_date(watermarks.get(v['user_vehicle_id']), window_start) for v in vehicles))
+            for user_id, vehicles in user_fleets
+        )
+        shards = iter_fleet_shards(fleets) if stream else make_shards(list(fleets))
+
+        # Workers simulate; this process is the only writer
+        # keyed_seed switches to per-(user, date) streams so reruns reproduce the same values
+        simulate_shard = partial(simulate_fuel_shard, keyed_seed=keyed_seed)
+        logged = 0
+        for rows in run_shards(simulate_shard, shards, workers, seed):
+            insert_rows(conn, INSERT_FUEL_SQL, rows, INSERT_BATCH_SIZE)
+            logged += len(rows)
+            if rows:
+                print(f"Logged {len(rows)} fuel records for users {rows[0][0]}..{rows[-1][0]}")
+    finally:
+        conn.close()
+        if read_conn:
+            read_conn.close()
+
+    if not logged and not watermarks:
+        print("No fuel-powered user vehicles found")
+        return False
     return True
 
 def generate_fuel_report(user_id):
@@ -308,7 +482,7 @@ def generate_fuel_report(user_id):
 
 if __name__ == "__main__":
     print("Starting fuel consumption simulation...")
-    if calculate_and_log_fuel_consumption():
+    if calculate_and_log_fuel_consumption(resume=True, stream=True):
         print("\nSimulation completed successfully!")
         generate_fuel_report(1)
     else:
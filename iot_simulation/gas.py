@@ -1,10 +1,12 @@
 import MySQLdb
 import numpy as np
 import os
-from datetime import date, timedelta
+from datetime import date
 from dotenv import load_dotenv
-import calendar
+from functools import partial
 from dateutil.relativedelta import relativedelta
+from iot_simulation.db import insert_rows, fetch_watermarks, resume_start_date, fetch_existing_days, missing_days
+from iot_simulation.parallel import make_shards, run_shards, cell_rng
 
 load_dotenv()
 
@@ -29,14 +31,80 @@ SINGLE_BURNER_RATE = 750  # Tk/month
 DOUBLE_BURNER_RATE = 800  # Tk/month
 METERED_GAS_PRICE = 9.10  # Tk/cubic meter
 
-def simulate_metered_daily_gas_consumption(num_members):
-    activities = {
-        "cooking": lambda: np.random.normal(0.5, 0.1) * num_members,
-        "water_heating": lambda: np.random.normal(0.3, 0.05) * num_members,
-        "space_heating": lambda: np.random.uniform(1.0, 2.0)
-    }
-    daily_gas_usage = sum(func() for func in activities.values())
-    return max(0, daily_gas_usage)
+# Metered usage parameters: per-member normal (mean, std) and household uniform (low, high)
+COOKING_PER_MEMBER = (0.5, 0.1)
+WATER_HEATING_PER_MEMBER = (0.3, 0.05)
+SPACE_HEATING = (1.0, 2.0)
+
+BURNER_TYPES = np.array(["double", "single"])
+BURNER_PROBABILITIES = [0.9, 0.1]
+# Monthly usage and rate per burner type, in BURNER_TYPES order
+BURNER_MONTHLY_USAGE = np.array([NON_METERED_DOUBLE_BURNER_MONTHLY, NON_METERED_SINGLE_BURNER_MONTHLY])
+BURNER_MONTHLY_RATE = np.array([DOUBLE_BURNER_RATE, SINGLE_BURNER_RATE])
+
+# Days in each month (index 1-12), plus one for February in leap years
+DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+INSERT_BATCH_SIZE = 5000
+
+INSERT_GAS_SQL = """
+    INSERT IGNORE INTO daily_gas_consumption (
+        user_id, utility_provider_id, consumption_date,
+        gas_used_cubic_meters, gas_cost,
+        household_type, burner_type, num_members,
+        payment_status
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# A household keeps its burner, so reruns reuse the last one logged
+LAST_BURNER_SQL = """
+    SELECT g.user_id, g.burner_type
+    FROM daily_gas_consumption g
+    JOIN (
+        SELECT user_id, MAX(consumption_date) AS last_date
+        FROM daily_gas_consumption
+        WHERE burner_type IS NOT NULL
+        GROUP BY user_id
+    ) l ON l.user_id = g.user_id AND l.last_date = g.consumption_date
+"""
+
+def simulate_metered_daily_gas_consumption(num_members, rng=np.random):
+    return float(simulate_metered_gas_block([num_members], 1, rng)[0, 0])
+
+def days_in_months(dates):
+    years = np.array([d.year for d in dates])
+    months = np.array([d.month for d in dates])
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    return DAYS_IN_MONTH[months] + (leap & (months == 2))
+
+def simulate_metered_gas_block(num_members, n_days, rng=np.random):
+    # Metered usage (cubic meters) for every user (rows) on every day (columns)
+    members = np.asarray(num_members, dtype=float)[:, None]
+    size = (len(members), n_days)
+    cooking = rng.normal(*COOKING_PER_MEMBER, size=size) * members
+    water_heating = rng.normal(*WATER_HEATING_PER_MEMBER, size=size) * members
+    space_heating = rng.uniform(*SPACE_HEATING, size=size)
+    return np.maximum(0, cooking + water_heating + space_heating)
+
+def choose_burner_types(n_users, rng=np.random):
+    # Index into BURNER_TYPES, drawn once per user
+    return rng.choice(len(BURNER_TYPES), size=n_users, p=BURNER_PROBABILITIES)
+
+def user_burner_types(users, rng=np.random):
+    # Index into BURNER_TYPES per user: the logged burner if there is one, otherwise a new draw
+    burner_index = {burner_type: i for i, burner_type in enumerate(BURNER_TYPES.tolist())}
+    burner_types = np.array([burner_index.get(user.get('burner_type'), -1) for user in users], dtype=np.int64)
+    unknown = burner_types < 0
+    burner_types[unknown] = choose_burner_types(int(unknown.sum()), rng)
+    return burner_types
+
+def simulate_non_metered_gas_block(burner_types, dates):
+    # Each day's share of the monthly burner allowance and rate
+    month_days = days_in_months(dates)
+    daily_usage = BURNER_MONTHLY_USAGE[burner_types][:, None] / month_days
+    daily_cost = BURNER_MONTHLY_RATE[burner_types][:, None] / month_days
+    return daily_usage, daily_cost
 
 def fetch_all_users_gas_info():
     conn = get_db_connection()
@@ -55,21 +123,31 @@ def fetch_all_users_gas_info():
     conn.close()
     return users
 
-def log_daily_gas_consumption(user_id, utility_provider_id, date_obj, gas_used, gas_cost, household_type, burner_type=None, num_members=None):
+def fetch_burner_types(conn):
+    # {user_id: burner_type} of each user's last logged non-metered day
+    cursor = conn.cursor()
+    try:
+        cursor.execute(LAST_BURNER_SQL)
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+def get_payment_status(date_obj, today=None):
+    today = today or date.today()
+    if (date_obj.year == today.year and date_obj.month >= today.month - 1) or (today.month == 1 and date_obj.month == 12 and date_obj.year == today.year - 1):
+        return 'due'
+    return 'paid'
+
+def normalize_gas_type(gas_type):
+    return (gas_type or "metered").strip().lower().replace("-", "_")  # fallback if null
+
+def log_daily_gas_consumption(user_id, utility_provider_id, date_obj, gas_used, gas_cost, household_type, burner_type=None, num_members=None, payment_status=None):
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        # Check if record already exists
-        cursor.execute("""
-            SELECT 1 FROM daily_gas_consumption 
-            WHERE user_id = %s AND consumption_date = %s
-        """, (user_id, date_obj))
-        
-        if cursor.fetchone():
-            return False  # Already logged
-
+        # Existing days are filtered out before simulation (see fetch_existing_days)
         # Call the updated stored procedure with utility_provider_id
         cursor.callproc('InsertGasConsumption', (
             user_id,
@@ -79,7 +157,8 @@ def log_daily_gas_consumption(user_id, utility_provider_id, date_obj, gas_used,
             gas_cost,
             household_type,
             burner_type,
-            num_members
+            num_members,
+            payment_status or get_payment_status(date_obj)
         ))
 
         # Always fetch all results after callproc
@@ -105,68 +184,142 @@ def log_daily_gas_consumption(user_id, utility_provider_id, date_obj, gas_used,
                 print(f"⚡ Error closing connection: {close_err}")
 
 
-def simulate_and_log_all_users_gas():
+def simulate_gas_day(user, single_date, seed=None, rng=np.random):
+    """
+    Simulate one user-day and return the log_daily_gas_consumption arguments, or None for
+    an unknown gas type. With a seed the draws come from the keyed (user, date) stream.
+    """
+    burner_rng = rng
+    if seed is not None:
+        rng = cell_rng(seed, "gas", user['id'], single_date)
+        # The burner belongs to the household, so it comes from a per-user stream
+        burner_rng = cell_rng(seed, "gas", user['id'], date.min)
+
+    user_id = user['id']
+    num_members = user['num_members'] if user['num_members'] else 4
+    utility_provider_id = user['gas_provider']
+    
+    # Normalize gas type
+    household_type = normalize_gas_type(user['gas_type'])
+
+    if household_type == "metered":
+        daily_usage = simulate_metered_daily_gas_consumption(num_members, rng)
+        daily_cost = daily_usage * METERED_GAS_PRICE
+        return (user_id, utility_provider_id, single_date, daily_usage, daily_cost, "metered", None, num_members)
+
+    if household_type == "non_metered":
+        burner_type = str(BURNER_TYPES[user_burner_types([user], burner_rng)[0]])
+        days_in_month = int(days_in_months([single_date])[0])
+        
+        if burner_type == "single":
+            daily_usage = NON_METERED_SINGLE_BURNER_MONTHLY / days_in_month
+            daily_cost = SINGLE_BURNER_RATE / days_in_month
+        else:
+            daily_usage = NON_METERED_DOUBLE_BURNER_MONTHLY / days_in_month
+            daily_cost = DOUBLE_BURNER_RATE / days_in_month
+
+        return (user_id, utility_provider_id, single_date, daily_usage, daily_cost, "non_metered", burner_type, None)
+
+    return None
+
+def simulate_gas_block(users, dates, rng=np.random):
+    """
+    Simulate every user over the same dates in one pass. Returns (usage, cost) arrays of
+    shape (users, days) and each user's burner type (None for metered households).
+    """
+    household_types = [normalize_gas_type(user['gas_type']) for user in users]
+    usage = np.zeros((len(users), len(dates)))
+    cost = np.zeros((len(users), len(dates)))
+    burners = [None] * len(users)
+
+    metered = [i for i, household_type in enumerate(household_types) if household_type == "metered"]
+    if metered:
+        num_members = [users[i]['num_members'] or 4 for i in metered]
+        usage[metered] = simulate_metered_gas_block(num_members, len(dates), rng)
+        cost[metered] = usage[metered] * METERED_GAS_PRICE
+
+    non_metered = [i for i, household_type in enumerate(household_types) if household_type == "non_metered"]
+    if non_metered:
+        burner_types = user_burner_types([users[i] for i in non_metered], rng)
+        usage[non_metered], cost[non_metered] = simulate_non_metered_gas_block(burner_types, dates)
+        for i, burner_type in zip(non_metered, burner_types):
+            burners[i] = str(BURNER_TYPES[burner_type])
+
+    return usage, cost, burners
+
+def simulate_gas_shard(shard, rng, keyed_seed=None):
+    # Runs in a worker process: returns INSERT_GAS_SQL rows for each user-day
+    today = date.today()
+    known = [(user, dates) for user, dates in shard if normalize_gas_type(user['gas_type']) in ("metered", "non_metered")]
+    for user, _ in shard:
+        if normalize_gas_type(user['gas_type']) not in ("metered", "non_metered"):
+            print(f"Unknown gas type for user {user['id']}: {user['gas_type']} - skipping")
+
+    rows = []
+    if keyed_seed is not None:
+        for user, dates in known:
+            for single_date in dates:
+                row = simulate_gas_day(user, single_date, keyed_seed)
+                rows.append(row + (get_payment_status(single_date, today),))
+        return rows
+
+    # Users missing the same days are simulated as one block
+    blocks = {}
+    for user, dates in known:
+        blocks.setdefault(tuple(dates), []).append(user)
+    for dates, users in blocks.items():
+        usage, cost, burners = simulate_gas_block(users, dates, rng)
+        payment_statuses = [get_payment_status(single_date, today) for single_date in dates]
+        for user, user_usage, user_cost, burner_type in zip(users, usage.tolist(), cost.tolist(), burners):
+            household_type = "metered" if burner_type is None else "non_metered"
+            num_members = (user['num_members'] or 4) if burner_type is None else None
+            rows.extend(
+                (user['id'], user['gas_provider'], single_date, daily_usage, daily_cost, household_type, burner_type, num_members, status)
+                for single_date, daily_usage, daily_cost, status in zip(dates, user_usage, user_cost, payment_statuses)
+            )
+    return rows
+
+def simulate_and_log_all_users_gas(resume=False, workers=None, seed=None, keyed_seed=None):
     users = fetch_all_users_gas_info()
     today = date.today()
     
     start_date = (today.replace(day=1) - relativedelta(months=6))  # 6 months back
     end_date = today
 
-    print(f"Starting simulation from {start_date} to {end_date}")
-    
-    for user in users:
-        user_id = user['id']
-        raw_household_type = user['gas_type'] or "metered"  # fallback if null
-        num_members = user['num_members'] if user['num_members'] else 4
-        utility_provider_id = user['gas_provider']
-        
-        # Normalize gas type
-        household_type = raw_household_type.strip().lower().replace("-", "_")
-        
-        for single_date in (start_date + timedelta(n) for n in range((end_date - start_date).days + 1)):
-        
-            if household_type == "metered":
-                daily_usage = simulate_metered_daily_gas_consumption(num_members)
-                daily_cost = daily_usage * METERED_GAS_PRICE
-                log_daily_gas_consumption(
-                    user_id,
-                    utility_provider_id,
-                    single_date,
-                    daily_usage,
-                    daily_cost,
-                    "metered",
-                    num_members=num_members
-                )
-            
-            elif household_type == "non_metered":
-                burner_type = np.random.choice(["double", "single"], p=[0.9, 0.1])
-                days_in_month = calendar.monthrange(single_date.year, single_date.month)[1]
-                
-                if burner_type == "single":
-                    daily_usage = NON_METERED_SINGLE_BURNER_MONTHLY / days_in_month
-                    daily_cost = SINGLE_BURNER_RATE / days_in_month
-                else:
-                    daily_usage = NON_METERED_DOUBLE_BURNER_MONTHLY / days_in_month
-                    daily_cost = DOUBLE_BURNER_RATE / days_in_month
-
-                log_daily_gas_consumption(
-                    user_id,
-                    utility_provider_id,
-                    single_date,
-                    daily_usage,
-                    daily_cost,
-                    "non_metered",
-                    burner_type=burner_type
-                )
-            
-            else:
-                print(f"Unknown gas type for user {user_id}: {raw_household_type} - skipping")
+    conn = get_db_connection()
+    try:
+        # Days already logged in the window, as one bitmap per user
+        existing_days = fetch_existing_days(conn, 'daily_gas_consumption', start_date, end_date)
+        watermarks = fetch_watermarks(conn, 'daily_gas_consumption') if resume else {}
+        burner_types = fetch_burner_types(conn)
+        for user in users:
+            user['burner_type'] = burner_types.get(user['id'])
+
+        print(f"Starting simulation from {start_date} to {end_date}")
+
+        # Only days that aren't logged yet are simulated; fully logged users are skipped
+        user_days = []
+        for user in users:
+            user_start = resume_start_date(watermarks.get(user['id']), start_date)
+            dates = missing_days(existing_days.get(user['id']), start_date, end_date, user_start)
+            if dates:
+                user_days.append((user, dates))
+        print(f"{len(users) - len(user_days)} of {len(users)} users already fully logged")
+
+        # Workers simulate; this process is the only writer
+        # keyed_seed switches to per-(user, date) streams so reruns reproduce the same values
+        simulate_shard = partial(simulate_gas_shard, keyed_seed=keyed_seed)
+        for rows in run_shards(simulate_shard, make_shards(user_days), workers, seed):
+            insert_rows(conn, INSERT_GAS_SQL, rows, INSERT_BATCH_SIZE)
+            print(f"✅ Logged {len(rows)} gas records")
+    finally:
+        conn.close()
     
     print("Simulation completed for all users ✅")
 
 if __name__ == "__main__":
     print("Starting gas consumption simulation...")
-    simulate_and_log_all_users_gas()
+    simulate_and_log_all_users_gas(resume=True)
     print("Gas consumption simulation fully completed.")
 
 
@@ -0,0 +1,75 @@
+import os
+from collections import deque
+from itertools import count, islice
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Worker processes used when a caller doesn't ask for a specific number
+SIMULATION_WORKERS = int(os.getenv('SIMULATION_WORKERS', '1'))
+
+# Users per shard. Shards, not workers, own the random streams, so changing the
+# worker count never changes the simulated values for a given seed.
+SHARD_SIZE = 256
+
+
+def make_shards(items, shard_size=SHARD_SIZE):
+    return [items[start:start + shard_size] for start in range(0, len(items), shard_size)]
+
+
+def iter_shards(items, shard_size=SHARD_SIZE):
+    # Lazy make_shards for streamed items: only one shard is held at a time
+    items = iter(items)
+    while True:
+        shard = list(islice(items, shard_size))
+        if not shard:
+            return
+        yield shard
+
+
+def run_shard(simulate_shard, shard, seed_sequence):
+    return simulate_shard(shard, np.random.default_rng(seed_sequence))
+
+
+def run_shards(simulate_shard, shards, workers=None, seed=None):
+    """
+    Call simulate_shard(shard, rng) for every shard and yield the results in shard order,
+    so the caller can act as the single writer. Each shard gets its own Generator spawned
+    from one SeedSequence(seed). shards may be a lazy iterable; it is consumed only as
+    fast as results are taken. simulate_shard must be a module-level function so it can
+    be sent to worker processes.
+    """
+    workers = workers or SIMULATION_WORKERS
+    root_seed = np.random.SeedSequence(seed)
+    # Spawning one child at a time yields the same children as spawn(len(shards))
+    seeds = (root_seed.spawn(1)[0] for _ in count())
+
+    if workers <= 1:
+        for shard, seed_sequence in zip(shards, seeds):
+            yield run_shard(simulate_shard, shard, seed_sequence)
+        return
+
+    # Keep a bounded number of shards in flight so finished results don't pile up
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for shard, seed_sequence in zip(shards, seeds):
+            pending.append(executor.submit(run_shard, simulate_shard, shard, seed_sequence))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Keyed streams: the random numbers for one (utility, user_id, date) cell come from a
+# counter-based Philox generator, so any cell can be regenerated alone and always
+# gets the same values for the same seed.
+STREAM_UTILITIES = {"electricity": 1, "water": 2, "gas": 3, "fuel": 4}
+
+
+def cell_rng(seed, utility, user_id, date_obj):
+    key = (int(seed) << 64) | (STREAM_UTILITIES[utility] << 32) | int(user_id)
+    # The date picks a block of 2**128 counter values that the cell draws from
+    counter = [0, 0, date_obj.toordinal(), 0]
+    return np.random.Generator(np.random.Philox(key=key, counter=counter))
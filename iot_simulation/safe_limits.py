@@ -1,9 +1,41 @@
 import MySQLdb
+import numpy as np
 import os
 from dotenv import load_dotenv
+from iot_simulation.db import insert_rows
+from iot_simulation.dashboard import refresh_dashboard_snapshot, refresh_dashboard_snapshots
 
 load_dotenv()
 
+# Default per member safe limits
+BASE_LIMITS = {
+    'electricity': 65,
+    'gas': 27.5,
+    'fuel': 47.5,
+    'water': 7
+}
+
+UPSERT_BATCH_SIZE = 1000
+
+UPSERT_SAFE_LIMITS_SQL = """
+    INSERT INTO safe_limits
+    (user_id, electricity_safe_limit, gas_safe_limit, fuel_safe_limit, water_safe_limit, total_safe_limit)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        electricity_safe_limit = VALUES(electricity_safe_limit),
+        gas_safe_limit = VALUES(gas_safe_limit),
+        fuel_safe_limit = VALUES(fuel_safe_limit),
+        water_safe_limit = VALUES(water_safe_limit),
+        total_safe_limit = VALUES(total_safe_limit)
+"""
+
+USERS_SQL = """
+    SELECT u.id AS user_id, uh.num_members,
+           u.electricity_provider, u.gas_provider, u.water_provider
+    FROM user u
+    LEFT JOIN user_housing uh ON u.id = uh.user_id
+"""
+
 def get_db_connection():
     return MySQLdb.connect(
         host=os.getenv('MYSQL_HOST'),
@@ -12,155 +44,81 @@ def get_db_connection():
         database=os.getenv('MYSQL_DATABASE')
     )
 
+def load_emission_factors(cursor):
+    # Every provider's emission factor in one query; missing factors count as 1.0
+    cursor.execute("SELECT id, emission_factor FROM utility_providers")
+    return {
+        row['id']: row['emission_factor'] if row['emission_factor'] is not None else 1.0
+        for row in cursor.fetchall()
+    }
+
+def calculate_safe_limits(users, emission_factors):
+    """
+    Safe limits for every user at once. Returns upsert rows of
+    (user_id, electricity, gas, fuel, water, total).
+    """
+    num_members = np.array([user['num_members'] or 4 for user in users], dtype=float)
+
+    def factors(provider_column):
+        # Users without a provider, or with an unknown one, keep a factor of 1.0
+        return np.array([emission_factors.get(user[provider_column], 1.0) for user in users], dtype=float)
+
+    electricity_limit = BASE_LIMITS['electricity'] * num_members * factors('electricity_provider')
+    gas_limit = BASE_LIMITS['gas'] * num_members * factors('gas_provider')
+    fuel_limit = BASE_LIMITS['fuel'] * num_members
+    water_limit = BASE_LIMITS['water'] * num_members * factors('water_provider')
+
+    total_safe_limit = electricity_limit + gas_limit + fuel_limit + water_limit
+
+    return list(zip(
+        [user['user_id'] for user in users],
+        electricity_limit.tolist(),
+        gas_limit.tolist(),
+        fuel_limit.tolist(),
+        water_limit.tolist(),
+        total_safe_limit.tolist()
+    ))
+
 def create_safe_limits_for_all_users():
     conn = get_db_connection()
     cursor = conn.cursor(MySQLdb.cursors.DictCursor)
 
-    # Fetch users with housing and providers
-    cursor.execute("""
-        SELECT u.id AS user_id, uh.num_members, 
-               u.electricity_provider, u.gas_provider, u.water_provider
-        FROM user u
-        LEFT JOIN user_housing uh ON u.id = uh.user_id
-    """)
-    users = cursor.fetchall()
-
-    # Default per member safe limits
-    base_limits = {
-        'electricity': 65,  
-        'gas': 27.5,
-        'fuel': 47.5,
-        'water': 7
-    }
+    try:
+        # Fetch users with housing and providers
+        cursor.execute(USERS_SQL)
+        users = cursor.fetchall()
+        emission_factors = load_emission_factors(cursor)
+    finally:
+        cursor.close()
 
-    for user in users:
-        user_id = user['user_id']
-        num_members = user['num_members'] or 4
-
-        # Default safe limits
-        electricity_limit = base_limits['electricity'] * num_members
-        gas_limit = base_limits['gas'] * num_members
-        fuel_limit = base_limits['fuel'] * num_members
-        water_limit = base_limits['water'] * num_members
-
-        def fetch_emission_factor(provider_id):
-            if not provider_id:
-                return 1.0
-            cursor.execute("SELECT emission_factor FROM utility_providers WHERE id = %s", (provider_id,))
-            result = cursor.fetchone()
-            if result and result['emission_factor'] is not None:
-                return result['emission_factor']
-            return 1.0
-
-        electricity_factor = fetch_emission_factor(user['electricity_provider'])
-        gas_factor = fetch_emission_factor(user['gas_provider'])
-        water_factor = fetch_emission_factor(user['water_provider'])
-
-        electricity_limit *= electricity_factor
-        gas_limit *= gas_factor
-        water_limit *= water_factor
-
-        total_safe_limit = electricity_limit + gas_limit + fuel_limit + water_limit
-
-        # 🔥 Check if user already has a record
-        cursor.execute("SELECT id FROM safe_limits WHERE user_id = %s", (user_id,))
-        existing = cursor.fetchone()
-
-        if existing:
-            # ✅ If exists, UPDATE
-            cursor.execute("""
-                UPDATE safe_limits
-                SET electricity_safe_limit = %s,
-                    gas_safe_limit = %s,
-                    fuel_safe_limit = %s,
-                    water_safe_limit = %s,
-                    total_safe_limit = %s
-                WHERE user_id = %s
-            """, (electricity_limit, gas_limit, fuel_limit, water_limit, total_safe_limit, user_id))
-        else:
-            # ✅ If doesn't exist, INSERT
-            cursor.execute("""
-                INSERT INTO safe_limits
-                (user_id, electricity_safe_limit, gas_safe_limit, fuel_safe_limit, water_safe_limit, total_safe_limit)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (user_id, electricity_limit, gas_limit, fuel_limit, water_limit, total_safe_limit))
-
-
-    conn.commit()
-    cursor.close()
-    conn.close()
+    try:
+        # One multi-row upsert per batch
+        rows = calculate_safe_limits(users, emission_factors)
+        insert_rows(conn, UPSERT_SAFE_LIMITS_SQL, rows, UPSERT_BATCH_SIZE)
+        # The dashboards show the limits, so rebuild the snapshots of every user just recomputed
+        refresh_dashboard_snapshots(conn, [row[0] for row in rows])
+    finally:
+        conn.close()
 
 def update_safe_limits_for_user(user_id):
     conn = get_db_connection()
     cursor = conn.cursor(MySQLdb.cursors.DictCursor)
 
-    # Fetch updated housing and providers
-    cursor.execute("""
-        SELECT uh.num_members,
-               u.electricity_provider, u.gas_provider, u.water_provider
-        FROM user u
-        LEFT JOIN user_housing uh ON u.id = uh.user_id
-        WHERE u.id = %s
-    """, (user_id,))
-    user = cursor.fetchone()
-
-    if not user:
+    try:
+        # Fetch updated housing and providers
+        cursor.execute(USERS_SQL + " WHERE u.id = %s", (user_id,))
+        user = cursor.fetchone()
+        if not user:
+            return
+
+        emission_factors = load_emission_factors(cursor)
+        cursor.execute(UPSERT_SAFE_LIMITS_SQL, calculate_safe_limits([user], emission_factors)[0])
+        conn.commit()
+        refresh_dashboard_snapshot(conn, user_id)
+    finally:
         cursor.close()
         conn.close()
-        return
-
-    num_members = user['num_members'] or 4
-
-    # Default per member safe limits
-    base_limits = {
-        'electricity': 65,  
-        'gas': 27.5,
-        'fuel': 47.5,
-        'water': 7
-    }
-
-
-    # Calculate base safe limits
-    electricity_limit = base_limits['electricity'] * num_members
-    gas_limit = base_limits['gas'] * num_members
-    fuel_limit = base_limits['fuel'] * num_members
-    water_limit = base_limits['water'] * num_members
-
-    # Apply provider-specific emission factors
-    def fetch_emission_factor(provider_id):
-        if not provider_id:
-            return 1.0
-        cursor.execute("SELECT emission_factor FROM utility_providers WHERE id = %s", (provider_id,))
-        result = cursor.fetchone()
-        if result and result['emission_factor'] is not None:
-            return result['emission_factor']
-        return 1.0
-
-    electricity_factor = fetch_emission_factor(user['electricity_provider'])
-    gas_factor = fetch_emission_factor(user['gas_provider'])
-    water_factor = fetch_emission_factor(user['water_provider'])
-
-    electricity_limit *= electricity_factor
-    gas_limit *= gas_factor
-    water_limit *= water_factor
-
-    total_safe_limit = electricity_limit + gas_limit + fuel_limit + water_limit
-
-    # Now UPDATE safe_limits table
-    cursor.execute("""
-        UPDATE safe_limits
-        SET electricity_safe_limit = %s,
-            gas_safe_limit = %s,
-            fuel_safe_limit = %s,
-            water_safe_limit = %s,
-            total_safe_limit = %s
-        WHERE user_id = %s
-    """, (electricity_limit, gas_limit, fuel_limit, water_limit, total_safe_limit, user_id))
-
-    conn.commit()
-    cursor.close()
-    conn.close()
 
 
 if __name__ == "__main__":
-    create_safe_limits_for_all_users()
\ No newline at end of file
+    create_safe_limits_for_all_users()
@@ -0,0 +1,126 @@
+import re
+import heapq
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+# Length of the n-grams used for substring matches. Bigrams are indexed too so two-letter
+# queries still find substrings; one-letter queries match prefixes only.
+NGRAM_SIZE = 3
+
+# A word starts after any non-alphanumeric character ("Corolla", "X5" in "BMW X5", "Cross" in "Corolla-Cross")
+WORD_START = re.compile(r'(?<![0-9a-z])[0-9a-z]')
+
+
+def fold(text):
+    return ' '.join(text.casefold().split())
+
+
+def ngrams(text, n=NGRAM_SIZE):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def indexed_grams(text, n=NGRAM_SIZE):
+    return ngrams(text, n) | ngrams(text, 2)
+
+
+class NgramIndex:
+    """
+    In-memory search index over (id, name) pairs for typeahead. search() ranks names
+    that start with the query first, then names with a word starting with it, then
+    names that merely contain it, and returns at most limit matches.
+
+    Prefix matches come from sorted key lists via bisect, and substring candidates from
+    intersecting n-gram posting sets, so a lookup never scans the whole catalog.
+    """
+
+    def __init__(self, items=(), n=NGRAM_SIZE):
+        self.n = n
+        self._names = {}  # id -> original name
+        self._folded = {}  # id -> folded name
+        self._name_keys = []  # sorted (folded name, id)
+        self._word_keys = []  # sorted (folded name from a later word start, id)
+        self._postings = defaultdict(set)  # n-gram -> ids
+        self._lock = threading.Lock()
+        for item_id, name in items:
+            self._add(item_id, name, sort=False)
+        self._name_keys.sort()
+        self._word_keys.sort()
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, item_id, name):
+        # Incremental update, e.g. after a new vehicle model is inserted
+        with self._lock:
+            if item_id in self._names:
+                self._remove(item_id)
+            self._add(item_id, name, sort=True)
+
+    def _add(self, item_id, name, sort):
+        folded = fold(name)
+        self._names[item_id] = name
+        self._folded[item_id] = folded
+        keys = [(folded, item_id)]
+        words = [(folded[match.start():], item_id) for match in WORD_START.finditer(folded) if match.start() > 0]
+        if sort:
+            insort(self._name_keys, keys[0])
+            for key in words:
+                insort(self._word_keys, key)
+        else:
+            self._name_keys.extend(keys)
+            self._word_keys.extend(words)
+        for gram in indexed_grams(folded, self.n):
+            self._postings[gram].add(item_id)
+
+    def _remove(self, item_id):
+        folded = self._folded.pop(item_id)
+        del self._names[item_id]
+        self._name_keys.remove((folded, item_id))
+        self._word_keys = [key for key in self._word_keys if key[1] != item_id]
+        for gram in indexed_grams(folded, self.n):
+            self._postings[gram].discard(item_id)
+
+    @staticmethod
+    def _prefixed(keys, prefix):
+        # Sorted keys starting with prefix, in order
+        for position in range(bisect_left(keys, (prefix,)), len(keys)):
+            key, item_id = keys[position]
+            if not key.startswith(prefix):
+                return
+            yield item_id
+
+    def search(self, query, limit=10):
+        """
+        Return up to limit {'id', 'model_name'} dicts whose name contains query,
+        case-insensitively, best matches first.
+        """
+        needle = fold(query)
+        if not needle or limit <= 0:
+            return []
+
+        with self._lock:
+            found = []
+            seen = set()
+            for keys in (self._name_keys, self._word_keys):
+                for item_id in self._prefixed(keys, needle):
+                    if item_id not in seen:
+                        seen.add(item_id)
+                        found.append(item_id)
+                        if len(found) >= limit:
+                            return self._rows(found)
+
+            if len(needle) >= 2:
+                # Rarest n-grams first so the candidate set shrinks as fast as possible
+                grams = ngrams(needle, min(self.n, len(needle)))
+                postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+                candidates = set.intersection(*postings) - seen
+                matches = (item_id for item_id in candidates if needle in self._folded[item_id])
+                found.extend(heapq.nsmallest(
+                    limit - len(found), matches,
+                    key=lambda item_id: (len(self._folded[item_id]), self._folded[item_id], item_id)
+                ))
+            return self._rows(found)
+
+    def _rows(self, item_ids):
+        return [{'id': item_id, 'model_name': self._names[item_id]} for item_id in item_ids]
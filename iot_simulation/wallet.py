@@ -0,0 +1,216 @@
+import os
+import secrets
+import MySQLdb
+from dotenv import load_dotenv
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from werkzeug.security import check_password_hash
+from iot_simulation.bill_queries import DUE_AMOUNT_SQL, MARK_PAID_SQL, month_params
+
+load_dotenv()
+
+# Seconds a wallet unlock token stays valid after the password was checked
+WALLET_UNLOCK_TTL = int(os.getenv('WALLET_UNLOCK_TTL', '300'))
+
+UNLOCK_SALT = 'wallet-unlock'
+
+ISSUE_TOKEN_SQL = """
+    INSERT INTO wallet_unlock_tokens (token_id, user_id, expires_at)
+    VALUES (%s, %s, NOW() + INTERVAL %s SECOND)
+"""
+
+# Expired and revoked tokens are dropped whenever the user unlocks again
+PURGE_TOKENS_SQL = """
+    DELETE FROM wallet_unlock_tokens
+    WHERE user_id = %s AND (expires_at <= NOW() OR revoked_at IS NOT NULL)
+"""
+
+CHECK_TOKEN_SQL = """
+    SELECT 1
+    FROM wallet_unlock_tokens
+    WHERE token_id = %s AND user_id = %s AND revoked_at IS NULL AND expires_at > NOW()
+"""
+
+REVOKE_TOKENS_SQL = """
+    UPDATE wallet_unlock_tokens
+    SET revoked_at = NOW()
+    WHERE user_id = %s AND revoked_at IS NULL
+"""
+
+
+def _serializer(secret_key):
+    return URLSafeTimedSerializer(secret_key, salt=UNLOCK_SALT)
+
+
+def issue_unlock_token(conn, secret_key, user_id, ttl=WALLET_UNLOCK_TTL):
+    # Record a new token server-side (so it can be revoked) and return it signed
+    token_id = secrets.token_hex(16)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(PURGE_TOKENS_SQL, (user_id,))
+        cursor.execute(ISSUE_TOKEN_SQL, (token_id, user_id, ttl))
+        conn.commit()
+    finally:
+        cursor.close()
+    return _serializer(secret_key).dumps({'user_id': user_id, 'token_id': token_id})
+
+
+def verify_unlock_token(conn, secret_key, user_id, token, ttl=WALLET_UNLOCK_TTL):
+    """
+    True if token was issued to user_id, is within its TTL and hasn't been revoked.
+    The signature and age are checked first, so forged or stale tokens never reach
+    the database; a valid one costs a primary key lookup instead of a password hash.
+    """
+    if not token:
+        return False
+    try:
+        data = _serializer(secret_key).loads(token, max_age=ttl)
+    except BadSignature:
+        return False
+    if not isinstance(data, dict) or data.get('user_id') != user_id:
+        return False
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CHECK_TOKEN_SQL, (data.get('token_id'), user_id))
+        return cursor.fetchone() is not None
+    finally:
+        cursor.close()
+
+
+def revoke_unlock_tokens(conn, user_id):
+    # Lock the wallet again, e.g. on logout or password change
+    cursor = conn.cursor()
+    try:
+        cursor.execute(REVOKE_TOKENS_SQL, (user_id,))
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def unlock_wallet(conn, secret_key, user_id, password=None, token=None):
+    """
+    Authorize a wallet payment. A valid unlock token is accepted as is; otherwise the
+    wallet password is checked and, if it matches, a new token is issued.
+    Returns (unlocked, new_token); new_token is None unless one was issued.
+    """
+    if verify_unlock_token(conn, secret_key, user_id, token):
+        return True, None
+    if not password:
+        return False, None
+
+    cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+    try:
+        cursor.execute("""
+            SELECT password_hash
+            FROM user_wallet_auth
+            WHERE user_id = %s
+        """, (user_id,))
+        wallet_auth = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if not wallet_auth or not check_password_hash(wallet_auth['password_hash'], password):
+        return False, None
+    return True, issue_unlock_token(conn, secret_key, user_id)
+
+
+# Bill payments. All four pay_* routes go through pay_monthly_bill, which takes row
+# locks in one fixed order (the month's due rows, then the wallet row) so concurrent
+# payments for the same bill serialize and payments for different bills don't deadlock.
+
+PAYMENT_DESCRIPTIONS = {
+    'electricity': 'Electricity bill payment',
+    'water': 'Water bill payment',
+    'gas': 'Gas bill payment',
+    'fuel': 'Fuel bill payment',
+}
+
+# The row only commits together with the payment, so its presence means "already paid"
+CLAIM_PAYMENT_SQL = """
+    INSERT INTO payment_requests (user_id, idempotency_key, utility_type, reference_id)
+    VALUES (%s, %s, %s, %s)
+"""
+
+FIND_PAYMENT_SQL = """
+    SELECT utility_type, reference_id, amount, transaction_id
+    FROM payment_requests
+    WHERE user_id = %s AND idempotency_key = %s
+"""
+
+COMPLETE_PAYMENT_SQL = """
+    UPDATE payment_requests
+    SET amount = %s, transaction_id = %s
+    WHERE user_id = %s AND idempotency_key = %s
+"""
+
+# Debit only if the balance covers it; a zero row count means it didn't
+DEBIT_WALLET_SQL = """
+    UPDATE user_wallet
+    SET balance = balance - %s
+    WHERE user_id = %s AND balance >= %s
+"""
+
+RECORD_PAYMENT_SQL = """
+    INSERT INTO transactions (
+        user_id, provider_id, amount, transaction_type, utility_type, reference_id, description
+    )
+    VALUES (%s, %s, %s, 'payment', %s, %s, %s)
+"""
+
+DUPLICATE_KEY = 1062
+
+
+def pay_monthly_bill(conn, user_id, utility, year, month, idempotency_key=None):
+    """
+    Pay every due day of one utility bill month from the user's wallet, in one
+    transaction. Returns {'success': True, 'amount': ...} or {'success': False, 'error': ...}.
+    Retrying with the same idempotency_key after a success returns the first result
+    without charging again; a retry that races the first attempt waits for it.
+    """
+    reference_id = f"{year}-{month}"
+    params = month_params(user_id, year, month)
+    cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+    try:
+        if idempotency_key:
+            try:
+                cursor.execute(CLAIM_PAYMENT_SQL, (user_id, idempotency_key, utility, reference_id))
+            except MySQLdb.IntegrityError as err:
+                if err.args[0] != DUPLICATE_KEY:
+                    raise
+                conn.rollback()
+                return _replayed_payment(cursor, user_id, utility, reference_id, idempotency_key)
+
+        # Lock the month's due rows, so a concurrent payment of the same bill waits here and then finds nothing due
+        cursor.execute(DUE_AMOUNT_SQL[utility] + " FOR UPDATE", params)
+        bill = cursor.fetchone()
+        amount = bill['total_amount'] if bill and bill['total_amount'] else 0
+        if amount <= 0:
+            conn.rollback()
+            return {'success': False, 'error': f"No unpaid {'fuel ' if utility == 'fuel' else ''}bills found for this period"}
+
+        cursor.execute(DEBIT_WALLET_SQL, (amount, user_id, amount))
+        if cursor.rowcount != 1:
+            conn.rollback()
+            return {'success': False, 'error': 'Insufficient balance'}
+
+        cursor.execute(MARK_PAID_SQL[utility], params)
+        cursor.execute(RECORD_PAYMENT_SQL, (
+            user_id, bill['provider_id'], -amount, utility, reference_id, PAYMENT_DESCRIPTIONS[utility]
+        ))
+        if idempotency_key:
+            cursor.execute(COMPLETE_PAYMENT_SQL, (amount, cursor.lastrowid, user_id, idempotency_key))
+        conn.commit()
+        return {'success': True, 'amount': amount}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _replayed_payment(cursor, user_id, utility, reference_id, idempotency_key):
+    cursor.execute(FIND_PAYMENT_SQL, (user_id, idempotency_key))
+    payment = cursor.fetchone()
+    if not payment or payment['utility_type'] != utility or payment['reference_id'] != reference_id:
+        return {'success': False, 'error': 'Idempotency key was already used for a different payment'}
+    return {'success': True, 'amount': payment['amount'], 'replayed': True}
@@ -4,49 +4,94 @@ import os
 import datetime
 from dotenv import load_dotenv
 from dateutil.relativedelta import relativedelta
-# from db import get_db_connection
+from functools import partial
+from iot_simulation.db import write_batches, stream_query, resume_start_date
+from iot_simulation.parallel import iter_shards, run_shards, cell_rng
 
 load_dotenv()  # This loads environment variables from the .env file
 
 # Define water usage categories with random distributions
+# ("normal"/"uniform"/"members_per_cycle" hold the same parameters for the array engine)
 water_usage_categories = {
     "drinking_cooking": {
-        "usage_per_person": lambda: max(0, np.random.normal(15, 2)),  # Normal distribution
+        "usage_per_person": lambda rng: max(0, rng.normal(15, 2)),  # Normal distribution
+        "normal": (15, 2),
         "type": "individual"
     },
     "bathing": {
-        "usage_per_person": lambda: max(0, np.random.normal(70, 10)),  # Normal distribution
+        "usage_per_person": lambda rng: max(0, rng.normal(70, 10)),  # Normal distribution
+        "normal": (70, 10),
         "type": "individual"
     },
     "toilet": {
-        "usage_per_person": lambda: max(0, np.random.normal(50, 5)),  # Normal distribution
+        "usage_per_person": lambda rng: max(0, rng.normal(50, 5)),  # Normal distribution
+        "normal": (50, 5),
         "type": "individual"
     },
     "cleaning": {
-        "usage_per_sqm": lambda: np.random.uniform(0.6, 1.0),  # Uniform distribution
+        "usage_per_sqm": lambda rng: rng.uniform(0.6, 1.0),  # Uniform distribution
+        "uniform": (0.6, 1.0),
         "type": "house_size"
     },
     "washing_machine": {
         "usage_per_cycle": 60,  # Fixed liters per cycle
-        "cycles_per_day": lambda members: max(1, np.random.poisson(members / 4)),  # Poisson distribution
+        "cycles_per_day": lambda members, rng: max(1, rng.poisson(members / 4)),  # Poisson distribution
+        "members_per_cycle": 4,
         "type": "appliance"
     },
     "dishwasher": {
         "usage_per_cycle": 20,  # Fixed liters per cycle
-        "cycles_per_day": lambda members: max(1, np.random.poisson(members / 5)),  # Poisson distribution
+        "cycles_per_day": lambda members, rng: max(1, rng.poisson(members / 5)),  # Poisson distribution
+        "members_per_cycle": 5,
         "type": "appliance"
     },
     "gardening": {
-        "usage_per_sqm": lambda: np.random.uniform(1.0, 2.0),  # Uniform distribution
+        "usage_per_sqm": lambda rng: rng.uniform(1.0, 2.0),  # Uniform distribution
+        "uniform": (1.0, 2.0),
         "type": "outdoor"
     },
     "car_washing": {
-        "usage_per_car": lambda: max(0, np.random.normal(120, 20)),  # Normal distribution
+        "usage_per_car": lambda rng: max(0, rng.normal(120, 20)),  # Normal distribution
+        "normal": (120, 20),
         "washes_per_week": 2,  # Fixed washes per week
         "type": "outdoor"
     }
 }
 
+# Backfill writer tuning: rows per committed batch, and the longest a partly filled
+# batch may wait (seconds) before it is committed anyway
+INSERT_BATCH_SIZE = int(os.getenv('WATER_BATCH_SIZE', '5000'))
+FLUSH_INTERVAL = float(os.getenv('WATER_FLUSH_INTERVAL', '5'))
+
+# Days simulated per array block
+DAY_BLOCK = 31
+
+INSERT_WATER_SQL = """
+    INSERT IGNORE INTO daily_water_consumption (user_id, utility_provider_id, consumption_date, liters_consumed, daily_bill, payment_status)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+# Users with their water tariff and most recent logged day, streamed by the backfill
+STREAM_USERS_SQL = """
+    SELECT
+        u.id AS user_id,
+        uh.house_size_sqft,
+        uh.num_members,
+        u.water_provider,
+        UP.unit_price,
+        u.car_ids,
+        w.last_date
+    FROM user u
+    JOIN user_housing uh ON u.id = uh.user_id
+    JOIN utility_providers UP ON u.water_provider = UP.id
+    LEFT JOIN (
+        SELECT user_id, MAX(consumption_date) AS last_date
+        FROM daily_water_consumption
+        GROUP BY user_id
+    ) w ON w.user_id = u.id
+    WHERE u.water_provider IS NOT NULL
+"""
+
 MYSQL_HOST = os.getenv('MYSQL_HOST')
 MYSQL_USER = os.getenv('MYSQL_USER')
 MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD')
@@ -54,7 +99,6 @@ MYSQL_DATABASE = "care_env"
 
 
 def get_db_connection():
-    print(f"MYSQL_HOST={MYSQL_HOST}, MYSQL_USER={MYSQL_USER}, MYSQL_PASSWORD={MYSQL_PASSWORD}, MYSQL_DATABASE={MYSQL_DATABASE}")
     try:
         conn = MySQLdb.connect(
             host=MYSQL_HOST,
@@ -110,16 +154,24 @@ def fetch_all_users():
     
     # Process car_ids to calculate num_cars
     for user in users:
-        if user['car_ids'] and user['car_ids'].strip():
-            # Count non-empty items in comma-separated list
-            user['num_cars'] = len([x for x in user['car_ids'].split(',') if x.strip()])
-        else:
-            user['num_cars'] = 0  # No cars if empty or None
+        user['num_cars'] = count_cars(user['car_ids'])
 
     cursor.close()
     conn.close()
     return users
 
+def count_cars(car_ids):
+    if car_ids and car_ids.strip():
+        # Count non-empty items in comma-separated list
+        return len([x for x in car_ids.split(',') if x.strip()])
+    return 0  # No cars if empty or None
+
+def get_payment_status(date, today=None):
+    today = today or datetime.date.today()
+    if (date.year == today.year and date.month >= today.month - 1) or (today.month == 1 and date.month == 12 and date.year == today.year - 1):
+        return 'due'
+    return 'paid'
+
 
 def log_daily_water_consumption(user_id, utility_provider_id, date, liters_consumed, unit_price):
     conn = get_db_connection()
@@ -127,11 +179,7 @@ def log_daily_water_consumption(user_id, utility_provider_id, date, liters_consu
 
     try:
         # 🆕 Determine payment status
-        today = datetime.date.today()
-        if (date.year == today.year and date.month >= today.month - 1) or (today.month == 1 and date.month == 12 and date.year == today.year - 1):
-            payment_status = 'due'
-        else:
-            payment_status = 'paid'
+        payment_status = get_payment_status(date)
 
         cursor.callproc('InsertWaterConsumption', (
             user_id,
@@ -160,102 +208,160 @@ def log_daily_water_consumption(user_id, utility_provider_id, date, liters_consu
 
 
 
-def calculate_and_log_water_consumption():
-    """
-    Calculate and log daily water consumption for all users for past 6 months + current month.
-    """
-    all_users = fetch_all_users()
-    today = datetime.date.today()
-    six_months_ago = (today.replace(day=1) - relativedelta(months=6))  # Start from 6 months back
+def simulate_water_day(user, date_obj, seed=None, rng=np.random):
+    # With a seed the draws come from the (user, date) keyed stream, so the day can be regenerated alone
+    if seed is not None:
+        rng = cell_rng(seed, "water", user['user_id'], date_obj)
+    season = get_water_season(date_obj)
 
-    for user in all_users:
-        user_id = user['user_id']
-        utility_provider_id = user['water_provider']
-        house_size = user['house_size_sqft']
-        num_members = user['num_members']
-        num_cars = user['num_cars']
-        unit_price = user['unit_price']
+    return simulate_daily_water_usage(
+        square_footage=user['house_size_sqft'],
+        num_members=user['num_members'],
+        has_garden=True,  # Assume garden
+        num_cars=user['num_cars'],
+        season=season,
+        rng=rng
+    )
 
-        # Get the most recent consumption date for this user
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT MAX(consumption_date) as last_date 
-            FROM daily_water_consumption 
-            WHERE user_id = %s
-        """, (user_id,))
-        result = cursor.fetchone()
-        last_date = result[0] if result and result[0] else None
-        cursor.close()
-        conn.close()
+def water_row(user, date_to_simulate, liters_consumed, today):
+    daily_bill = (liters_consumed / 1000) * user['unit_price']
+    return (user['user_id'], user['water_provider'], date_to_simulate, liters_consumed, daily_bill, get_payment_status(date_to_simulate, today))
 
-        # Determine starting point:
-        if last_date:
-            start_date = max(last_date + datetime.timedelta(days=1), six_months_ago)
-            if start_date > today:
-                print(f"User {user_id} already up to date (last record: {last_date})")
-                continue
-        else:
-            # No data at all: simulate from 6 months ago
-            start_date = six_months_ago
-
-        # Now simulate from start_date to today
-        days_to_simulate = (today - start_date).days + 1
-        if days_to_simulate <= 0:
+def simulate_water_shard(shard, rng, keyed_seed=None):
+    # Runs in a worker process: returns INSERT_WATER_SQL rows for each user-day
+    today = datetime.date.today()
+    rows = []
+    if keyed_seed is not None:
+        for user, start_date, end_date in shard:
+            for day_offset in range((end_date - start_date).days + 1):
+                date_to_simulate = start_date + datetime.timedelta(days=day_offset)
+                liters_consumed = simulate_water_day(user, date_to_simulate, keyed_seed)
+                rows.append(water_row(user, date_to_simulate, liters_consumed, today))
+        return rows
+
+    # Users with the same date range are simulated together, DAY_BLOCK days at a time
+    ranges = {}
+    for user, start_date, end_date in shard:
+        ranges.setdefault((start_date, end_date), []).append(user)
+    for (start_date, end_date), users in ranges.items():
+        dates = [start_date + datetime.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        for block_start in range(0, len(dates), DAY_BLOCK):
+            block_dates = dates[block_start:block_start + DAY_BLOCK]
+            block_liters = simulate_water_block(
+                [user['house_size_sqft'] for user in users],
+                [user['num_members'] for user in users],
+                [user['num_cars'] for user in users],
+                block_dates,
+                rng=rng
+            )
+            for user, user_liters in zip(users, block_liters.tolist()):
+                rows.extend(
+                    water_row(user, date_to_simulate, liters_consumed, today)
+                    for date_to_simulate, liters_consumed in zip(block_dates, user_liters)
+                )
+    return rows
+
+def stream_user_ranges(conn, window_start, today):
+    # One (user, start_date, end_date) per user with days left to simulate
+    for user in stream_query(conn, STREAM_USERS_SQL):
+        start_date = resume_start_date(user.pop('last_date'), window_start)
+        if start_date > today:
             continue
+        user['num_cars'] = count_cars(user.pop('car_ids'))
+        yield user, start_date, today
 
-        print(f"Generating {days_to_simulate} days of water data for user {user_id} from {start_date}")
-
-        for day_offset in range(days_to_simulate):
-            date_to_simulate = start_date + datetime.timedelta(days=day_offset)
-            
-            month = date_to_simulate.month
-            season = "summer" if 4 <= month <= 9 else "winter"
-
-            liters_consumed = simulate_daily_water_usage(
-                square_footage=house_size,
-                num_members=num_members,
-                has_garden=True,  # Assume garden
-                num_cars=num_cars,
-                season=season
-            )
+def calculate_and_log_water_consumption(workers=None, seed=None, keyed_seed=None, batch_size=INSERT_BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+    """
+    Calculate and log daily water consumption for all users for past 6 months + current month.
+    Users are streamed from the database, simulated in shards (across `workers` processes
+    when more than one is given) and written in batches on a single connection, so memory
+    stays flat however many users there are.
+    keyed_seed switches to per-(user, date) streams so reruns reproduce the same values.
+    """
+    today = datetime.date.today()
+    six_months_ago = (today.replace(day=1) - relativedelta(months=6))  # Start from 6 months back
 
-            log_daily_water_consumption(
-                user_id=user_id,
-                utility_provider_id=utility_provider_id,
-                date=date_to_simulate,
-                liters_consumed=liters_consumed,
-                unit_price=unit_price
-            )
+    # The user stream holds its own connection until it is drained
+    read_conn = get_db_connection()
+    write_conn = get_db_connection()
+    try:
+        shards = iter_shards(stream_user_ranges(read_conn, six_months_ago, today))
+        simulate_shard = partial(simulate_water_shard, keyed_seed=keyed_seed)
+        # Workers simulate; this process is the only writer
+        rows = (row for shard_rows in run_shards(simulate_shard, shards, workers, seed) for row in shard_rows)
+        written = write_batches(write_conn, INSERT_WATER_SQL, rows, batch_size, flush_interval)
+        print(f"✅ Logged {written} water records")
+    finally:
+        read_conn.close()
+        write_conn.close()
 
 # Function to simulate daily water usage
-def simulate_daily_water_usage(square_footage, num_members, has_garden=True, num_cars=1, season="summer"):
+def simulate_daily_water_usage(square_footage, num_members, has_garden=True, num_cars=1, season="summer", rng=np.random):
     daily_water_usage = 0
     adjustments = seasonal_adjustments.get(season, seasonal_adjustments["summer"])  # Default to summer
 
     # Calculate individual water usage
     for category, details in water_usage_categories.items():
         if details["type"] == "individual":
-            usage = sum(details["usage_per_person"]() for _ in range(num_members))  # Random per person
+            usage = sum(details["usage_per_person"](rng) for _ in range(num_members))  # Random per person
             daily_water_usage += usage * adjustments.get(category, 1.0)
         elif details["type"] == "house_size":
             sqm = square_footage / 10.764  # Convert sqft to sqm
-            usage = details["usage_per_sqm"]() * sqm  # Random per sqm
+            usage = details["usage_per_sqm"](rng) * sqm  # Random per sqm
             daily_water_usage += usage * adjustments.get(category, 1.0)
         elif details["type"] == "appliance":
-            cycles = details["cycles_per_day"](num_members)  # Random cycles
+            cycles = details["cycles_per_day"](num_members, rng)  # Random cycles
             daily_water_usage += details["usage_per_cycle"] * cycles * adjustments.get(category, 1.0)
         elif details["type"] == "outdoor" and has_garden:
             if category == "gardening":
                 sqm = square_footage / 10.764  # Convert sqft to sqm
-                usage = details["usage_per_sqm"]() * sqm  # Random per sqm
+                usage = details["usage_per_sqm"](rng) * sqm  # Random per sqm
                 daily_water_usage += usage * adjustments.get(category, 1.0)
             elif category == "car_washing":
-                weekly_usage = sum(details["usage_per_car"]() for _ in range(num_cars)) * details["washes_per_week"]
+                weekly_usage = sum(details["usage_per_car"](rng) for _ in range(num_cars)) * details["washes_per_week"]
                 daily_water_usage += weekly_usage / 7  # Average daily usage
 
     return daily_water_usage
 
+def get_water_season(date_obj):
+    return "summer" if 4 <= date_obj.month <= 9 else "winter"
+
+def simulate_water_block(house_sizes, num_members, num_cars, dates, has_garden=True, rng=np.random):
+    """
+    Vectorized simulate_daily_water_usage for every user (rows) on every date (columns).
+    Per-person and per-car amounts are drawn as one aggregate per user-day: the sum of
+    n normals N(mu, sd) is N(n*mu, sqrt(n)*sd).
+    """
+    members = np.asarray(num_members, dtype=float)[:, None]
+    cars = np.asarray(num_cars, dtype=float)[:, None]
+    sqm = np.asarray(house_sizes, dtype=float)[:, None] / 10.764
+    size = (len(members), len(dates))
+    seasons = [get_water_season(d) for d in dates]
+
+    daily_water_usage = np.zeros(size)
+    for category, details in water_usage_categories.items():
+        adjustment = np.array([seasonal_adjustments[season].get(category, 1.0) for season in seasons])
+        if details["type"] == "individual":
+            mean, std = details["normal"]
+            usage = np.maximum(0, rng.normal(members * mean, np.sqrt(members) * std, size=size))
+        elif details["type"] == "house_size":
+            usage = rng.uniform(*details["uniform"], size=size) * sqm
+        elif details["type"] == "appliance":
+            cycles = np.maximum(1, rng.poisson(np.broadcast_to(members / details["members_per_cycle"], size)))
+            usage = details["usage_per_cycle"] * cycles
+        elif not has_garden:
+            continue
+        elif category == "gardening":
+            usage = rng.uniform(*details["uniform"], size=size) * sqm
+        elif category == "car_washing":
+            mean, std = details["normal"]
+            weekly_usage = np.maximum(0, rng.normal(cars * mean, np.sqrt(cars) * std, size=size)) * details["washes_per_week"]
+            daily_water_usage += weekly_usage / 7  # Average daily usage, not seasonal
+            continue
+        daily_water_usage += usage * adjustment
+
+    return daily_water_usage
+
 def main(user_id):
     """
     Main function to calculate AND LOG daily water consumption for a user.
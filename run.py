@@ -1,18 +1,26 @@
 import sys
 import os
+import threading
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, render_template, request, redirect, url_for, session, g
+from werkzeug.local import LocalProxy
 from authlib.integrations.flask_client import OAuth
 from functools import wraps
 from dotenv import load_dotenv
-from iot_simulation.electricity import simulate_daily_consumption, fetch_user_data, calculate_bill, get_db_connection, calculate_and_log_consumption
+from iot_simulation.electricity import simulate_daily_consumption, fetch_user_data, calculate_bill, calculate_and_log_consumption
+from iot_simulation.db import get_pool, get_db_connection
 from iot_simulation.admin_model import get_admin_by_email
+from iot_simulation.catalog import providers_for_division, search_vehicles, add_vehicle_to_index, invalidate_catalog, warm_catalog, catalog_cache_stats, SEARCH_LIMIT
+from iot_simulation.bill_queries import DETAIL_SQL, month_params, is_valid_month
+from iot_simulation.wallet import unlock_wallet, revoke_unlock_tokens, pay_monthly_bill, WALLET_UNLOCK_TTL
+from iot_simulation.dashboard import load_dashboard_snapshot, refresh_dashboard_snapshot, refresh_dashboard_snapshots
+from iot_simulation.footprint import refresh_changed_footprints
 import MySQLdb
 import requests
 import io
 import base64
 from flask import flash
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 from flask import jsonify
 
 
@@ -23,48 +31,62 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY')
 
-MYSQL_HOST = os.getenv('MYSQL_HOST')
-MYSQL_USER = os.getenv('MYSQL_USER')
-MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD')
-MYSQL_DATABASE = os.getenv('MYSQL_DATABASE')
-
-# MySQL connection
-db = MySQLdb.connect(
-    host=MYSQL_HOST,
-    user=MYSQL_USER,
-    passwd=MYSQL_PASSWORD,
-    database=MYSQL_DATABASE
-)
+# MySQL connection pool, sized by DB_POOL_MIN_SIZE / DB_POOL_MAX_SIZE
+pool = get_pool()
+
+
+def get_db():
+    # Each request checks out one pooled connection on first use and keeps it until teardown
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        # A connection that failed mid-request may be broken, so don't reuse it
+        pool.release(conn, discard=isinstance(exception, MySQLdb.OperationalError))
+
+
+# Routes use db as before; it resolves to the current request's connection
+db = LocalProxy(get_db)
 
 # Initialize the database table
 def init_user_table():
     """Create the user table if it doesn't exist."""
-    cursor = db.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        google_id VARCHAR(255) NOT NULL UNIQUE,
-        display_name VARCHAR(255),
-        email VARCHAR(255) NOT NULL UNIQUE,
-        phone VARCHAR(15),
-        address TEXT,
-        division VARCHAR(50),
-        electricity_provider INT,
-        water_provider INT,
-        gas_provider INT,
-        gas_type ENUM('metered', 'non-metered'),
-        car_ids TEXT, -- Comma-separated list of car IDs
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (electricity_provider) REFERENCES utility_providers(id),
-        FOREIGN KEY (water_provider) REFERENCES utility_providers(id),
-        FOREIGN KEY (gas_provider) REFERENCES utility_providers(id)
-        );
-    """)
-    db.commit()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            google_id VARCHAR(255) NOT NULL UNIQUE,
+            display_name VARCHAR(255),
+            email VARCHAR(255) NOT NULL UNIQUE,
+            phone VARCHAR(15),
+            address TEXT,
+            division VARCHAR(50),
+            electricity_provider INT,
+            water_provider INT,
+            gas_provider INT,
+            gas_type ENUM('metered', 'non-metered'),
+            car_ids TEXT, -- Comma-separated list of car IDs
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (electricity_provider) REFERENCES utility_providers(id),
+            FOREIGN KEY (water_provider) REFERENCES utility_providers(id),
+            FOREIGN KEY (gas_provider) REFERENCES utility_providers(id)
+            );
+        """)
+        conn.commit()
 
 # Call the table initialization function
 init_user_table()
 
+# Build the provider catalog and vehicle search index up front so the first requests don't pay for them
+with pool.connection() as conn:
+    warm_catalog(conn)
+
 # OAuth setup
 oauth = OAuth(app)
 google = oauth.register(
@@ -114,7 +136,7 @@ def authorize():
     email = user_info.get('email', '')
     
      # First check if the email belongs to an Admin
-    admin = get_admin_by_email(email)
+    admin = get_admin_by_email(email, db)
     if admin:
         session['admin_id'] = admin['id']
         session['user_type'] = 'admin'
@@ -145,26 +167,17 @@ def authorize():
 @app.route('/get_providers/<division>')
 def get_providers(division):
     """Fetch utility providers based on the user's division."""
-    cursor = db.cursor(MySQLdb.cursors.DictCursor)
-    cursor.execute("""
-        SELECT id, provider_name, energy_type 
-        FROM utility_providers 
-        WHERE region = %s OR region = 'Nationwide'
-    """, (division,))
-    providers = cursor.fetchall()
+    # Served from the catalog cache; db is only checked out on a miss
+    providers = providers_for_division(db, division)
     return {'providers': providers}
 
 @app.route('/search_cars', methods=['GET'])
 def search_cars():
     """Search for car models based on user input."""
     query = request.args.get('q', '')
-    cursor = db.cursor(MySQLdb.cursors.DictCursor)
-    cursor.execute("""
-        SELECT id, model_name 
-        FROM vehicles
-        WHERE model_name LIKE %s
-    """, (f"%{query}%",))
-    cars = cursor.fetchall()
+    limit = request.args.get('limit', SEARCH_LIMIT, type=int)
+    # Ranked matches from the in-memory index; db is only checked out if it has to be rebuilt
+    cars = search_vehicles(db, query, limit)
     return {'cars': cars}
 
 
@@ -216,6 +229,14 @@ def admin_dashboard():
                             top_users=top_users)  
 
 
+@app.route('/admin/pool_stats')
+def pool_stats():
+    if session.get('user_type') != 'admin':
+        return "Access Denied", 403
+    # Stats for the pool and catalog cache of the worker process that served this request
+    return jsonify({**pool.stats(), 'catalog_cache': catalog_cache_stats()})
+
+
 @app.route('/admin_profile')
 def admin_profile():
     if 'user_type' not in session or session['user_type'] != 'admin':
@@ -289,6 +310,7 @@ def add_utility_provider():
         """, (provider_name, energy_type, transaction_phone, unit_price, emission_factor, billing_frequency, website, region, description))
         db.commit()
         cursor.close()
+        invalidate_catalog('providers')
 
         return redirect(url_for('view_providers'))  # after adding, redirect back to dashboard
 
@@ -378,6 +400,7 @@ def add_vehicle():
             VALUES (%s, %s, %s, %s, %s, %s, %s)
         """, (model_name, vehicle_type, fuel_type, urban_efficiency, highway_efficiency, daily_average_km, description))
         db.commit()
+        add_vehicle_to_index(cursor.lastrowid, model_name)
         cursor.close()
 
         return redirect(url_for('view_vehicles', success='1'))
@@ -389,325 +412,43 @@ def add_vehicle():
 def dashboard():
     user_profile = session['profile']
     google_id = user_profile['id']
-    cursor = db.cursor(MySQLdb.cursors.DictCursor)
-
-    # Fetch user details
-    cursor.execute("""
-        SELECT u.display_name, u.email, u.phone, u.address, u.division,
-               up.provider_name AS electricity_provider,
-               uw.provider_name AS water_provider,
-               ug.provider_name AS gas_provider, u.gas_type
-        FROM user u
-        LEFT JOIN utility_providers up ON u.electricity_provider = up.id
-        LEFT JOIN utility_providers uw ON u.water_provider = uw.id
-        LEFT JOIN utility_providers ug ON u.gas_provider = ug.id
-        WHERE u.google_id = %s
-    """, (google_id,))
-    user_data = cursor.fetchone()
 
-    if not user_data:
-        return "User information not found.", 404
-
-    # Fetch user_id
-    cursor.execute("SELECT id FROM user WHERE google_id = %s", (google_id,))
-    user_id_row = cursor.fetchone()
-    if not user_id_row:
+    # Precomputed per-user snapshot, rebuilt here only if it's missing
+    user_id, snapshot = load_dashboard_snapshot(db, google_id)
+    if not user_id:
         return "User not found.", 404
-    user_id = user_id_row['id']
-
-    # Fetch housing details
-    cursor.execute("""
-        SELECT house_size_sqft, num_members, solar_panel_watt, wind_source_watt, other_renewable_source
-        FROM user_housing
-        WHERE user_id = %s
-    """, (user_id,))
-    housing_data = cursor.fetchone()
-
-    # Fetch last 15 days' electricity consumption and daily bills
-    cursor.execute("""
-        SELECT consumption_date, units_consumed, daily_bill
-        FROM daily_electricity_consumption
-        WHERE user_id = %s
-        ORDER BY consumption_date DESC
-        LIMIT 15
-    """, (user_id,))
-    consumption_records = cursor.fetchall()
-
-    # Fetch last 15 days' water consumption and daily bills
-    cursor.execute("""
-        SELECT consumption_date, liters_consumed, daily_bill
-        FROM daily_water_consumption
-        WHERE user_id = %s
-        ORDER BY consumption_date DESC
-        LIMIT 15
-    """, (user_id,))
-    water_consumption_records = cursor.fetchall()
-    
-    # Fetch last 15 days' gas consumption
-    cursor.execute("""
-        SELECT consumption_date, gas_used_cubic_meters, gas_cost
-        FROM daily_gas_consumption
-        WHERE user_id = %s
-        ORDER BY consumption_date DESC
-        LIMIT 15
-    """, (user_id,))
-    gas_consumption_records = cursor.fetchall()
-
-    # Fetch last 15 days' fuel consumption
-    cursor.execute("""
-        SELECT consumption_date, fuel_used_liters, fuel_cost
-        FROM daily_fuel_consumption
-        WHERE user_id = %s
-        ORDER BY consumption_date DESC
-        LIMIT 15
-    """, (user_id,))
-    fuel_consumption_records = cursor.fetchall()
-
-
-    # Fetch last 15 days' carbon footprint
-    cursor.execute("""
-        SELECT consumption_date, total_emission_kg, emission_tag, suggestions
-        FROM daily_carbon_footprint
-        WHERE user_id = %s
-        ORDER BY consumption_date DESC
-        LIMIT 15
-    """, (user_id,))
-    carbon_footprint_records = cursor.fetchall()
-
-
-
-
-    # Fetch aggregated monthly electricity usage
-    cursor.execute("""
-        SELECT 
-        MONTH(consumption_date) AS bill_month, 
-        YEAR(consumption_date) AS bill_year, 
-        SUM(units_consumed) AS total_units,
-        SUM(daily_bill) AS total_bill
-        FROM daily_electricity_consumption
-        WHERE user_id = %s
-        GROUP BY bill_year, bill_month
-        ORDER BY bill_year DESC, bill_month DESC
-    """, (user_id,))
-    monthly_electricity_data = cursor.fetchall()
-    
-    # Fetch aggregated monthly water usage
-    cursor.execute("""
-        SELECT 
-            MONTH(consumption_date) AS month, 
-            YEAR(consumption_date) AS year, 
-            SUM(liters_consumed) AS total_liters,
-            SUM(daily_bill) AS total_bill
-        FROM daily_water_consumption
-        WHERE user_id = %s
-        GROUP BY year, month
-        ORDER BY year DESC, month DESC
-    """, (user_id,))
-    monthly_water_data = cursor.fetchall()
-    
-    # Fetch monthly gas usage
-    cursor.execute("""
-        SELECT 
-            MONTH(consumption_date) AS month,
-            YEAR(consumption_date) AS year,
-            SUM(gas_used_cubic_meters) AS total_cubic_meters,
-            SUM(gas_cost) AS total_bill
-        FROM daily_gas_consumption
-        WHERE user_id = %s
-        GROUP BY year, month
-        ORDER BY year DESC, month DESC
-    """, (user_id,))
-    monthly_gas_data = cursor.fetchall()
-
-    # Fetch monthly fuel usage
-    cursor.execute("""
-        SELECT 
-            MONTH(consumption_date) AS month,
-            YEAR(consumption_date) AS year,
-            SUM(fuel_used_liters) AS total_liters,
-            SUM(fuel_cost) AS total_bill
-        FROM daily_fuel_consumption
-        WHERE user_id = %s
-        GROUP BY year, month
-        ORDER BY year DESC, month DESC
-    """, (user_id,))
-    monthly_fuel_data = cursor.fetchall()  
-
-    # Fetch monthly carbon emissions
-    cursor.execute("""
-        SELECT 
-            MONTH(consumption_date) AS month,
-            YEAR(consumption_date) AS year,
-            SUM(total_emission_kg) AS total_carbon_kg
-        FROM daily_carbon_footprint
-        WHERE user_id = %s
-        GROUP BY year, month
-        ORDER BY year DESC, month DESC
-    """, (user_id,))
-    monthly_carbon_data = cursor.fetchall()
-
-    #  Fetch Monthly Carbon Footprint (electricity, fuel, gas, water individually)
-    cursor.execute("""
-        SELECT 
-            MONTH(consumption_date) AS month,
-            YEAR(consumption_date) AS year,
-            SUM(electricity_emission_kg) AS total_electricity_kg,
-            SUM(fuel_emission_kg) AS total_fuel_kg,
-            SUM(gas_emission_kg) AS total_gas_kg,
-            SUM(water_emission_kg) AS total_water_kg,
-            SUM(total_emission_kg) AS total_carbon_kg
-        FROM daily_carbon_footprint
-        WHERE user_id = %s
-        GROUP BY year, month
-        ORDER BY year DESC, month DESC
-    """, (user_id,))
-    monthly_carbon_detailed_data = cursor.fetchall()
-
-
-    # 2. Fetch the user's safe limits
-    cursor.execute("""
-        SELECT electricity_safe_limit, gas_safe_limit, fuel_safe_limit, water_safe_limit, total_safe_limit
-        FROM safe_limits
-        WHERE user_id = %s
-    """, (user_id,))
-    safe_limits_row = cursor.fetchone()
-
-    if safe_limits_row:
-        safe_limits = {
-            'electricity': safe_limits_row['electricity_safe_limit'],
-            'gas': safe_limits_row['gas_safe_limit'],
-            'fuel': safe_limits_row['fuel_safe_limit'],
-            'water': safe_limits_row['water_safe_limit'],
-            'total': safe_limits_row['total_safe_limit'],
-        }
-    else:
-        # fallback if not found
-        safe_limits = {
-            'electricity': 200,
-            'gas': 200,
-            'fuel': 200,
-            'water': 50,
-            'total': 500
-        }
-
-
-    # Determine average emission level
-    emission_levels = [record['emission_tag'] for record in carbon_footprint_records]
-
-    if emission_levels.count('high') > len(emission_levels) * 0.5:
-        average_emission_level = "high"
-    elif emission_levels.count('moderate') > len(emission_levels) * 0.5:
-        average_emission_level = "moderate"
-    else:
-        average_emission_level = "low"
-
-    reduction_suggestions = list(set(
-        record['suggestions'] for record in carbon_footprint_records if record['suggestions']
-    ))
-
-    recent_carbon_footprint = [
-        {
-            "date": record["consumption_date"].strftime("%m-%d"),
-            "carbon_kg": record["total_emission_kg"],
-            "level": record["emission_tag"],
-            "suggestion": record["suggestions"]
-        }
-        for record in carbon_footprint_records
-    ]   
-
-    # Fetch user's vehicles (NOW FROM user_vehicles)
-    cursor.execute("""
-        SELECT v.model_name 
-        FROM user_vehicles uv
-        JOIN vehicles v ON uv.vehicle_id = v.id
-        WHERE uv.user_id = %s
-    """, (user_id,))
-    car_list = [car['model_name'] for car in cursor.fetchall()]
-
-
-    # Combine all data
-    user_info = {
-        'profile': user_profile,
-        'details': user_data,
-        'housing': housing_data,
-        'cars': car_list,
-    }
+    if not snapshot['details']:
+        return "User information not found.", 404
 
-    # Structure  electricity `recent_consumption`
-    recent_consumption = [
-        {"date": record["consumption_date"].strftime("%m-%d"), "units": record["units_consumed"], "bill": record["daily_bill"]}
-        for record in consumption_records
-    ]
-
-    # Structure recent_water_consumption
-    recent_water_consumption = [
-        {
-            "date": record["consumption_date"].strftime("%m-%d"),
-            "liters": record["liters_consumed"],
-            "bill": record["daily_bill"]
-        }
-        for record in water_consumption_records
-    ]
-    
-    recent_gas_consumption=[
-        {
-            "date": record["consumption_date"].strftime("%m-%d"),
-            "cubic_meters": record["gas_used_cubic_meters"],
-            "bill": record["gas_cost"]
-        }
-        for record in gas_consumption_records
-    ]
-    recent_fuel_consumption=[
-        {
-            "date": record["consumption_date"].strftime("%m-%d"),
-            "liters": record["fuel_used_liters"],
-            "bill": record["fuel_cost"]
-        }
-        for record in fuel_consumption_records
-    ]
-    
     # Combine all user info
     user_info = {
         'profile': user_profile,
-        'details': user_data,
-        'housing': housing_data,
-        'cars': car_list,
+        'details': snapshot['details'],
+        'housing': snapshot['housing'],
+        'cars': snapshot['cars'],
     }
 
-    # Fetch wallet balance
-    cursor.execute("""
-        SELECT balance 
-        FROM user_wallet 
-        WHERE user_id = %s
-    """, (user_id,))
-    wallet_balance = cursor.fetchone()
-    
-    # Default to 0 if no wallet exists
-    balance = wallet_balance['balance'] if wallet_balance else 0.00
-
-    cursor.close()
-
     # Save into session ✅
     session['user_info'] = user_info
 
     return render_template(
         'dashboard.html',
         user_info=user_info,
-        recent_consumption=recent_consumption,
-        monthly_electricity_data=monthly_electricity_data,
-        recent_water_consumption=recent_water_consumption,
-        monthly_water_data=monthly_water_data,
-        monthly_gas_data=monthly_gas_data,
-        monthly_fuel_data=monthly_fuel_data,
-        recent_gas_consumption=recent_gas_consumption,
-        recent_fuel_consumption=recent_fuel_consumption,
-        recent_carbon_footprint=recent_carbon_footprint,
-        monthly_carbon_data=monthly_carbon_data,
-        average_emission_level=average_emission_level,
-        reduction_suggestions=reduction_suggestions,
-        monthly_carbon_detailed_data=monthly_carbon_detailed_data,
-        safe_limits=safe_limits,
-        wallet_balance=balance,
+        recent_consumption=snapshot['recent_consumption'],
+        monthly_electricity_data=snapshot['monthly_electricity_data'],
+        recent_water_consumption=snapshot['recent_water_consumption'],
+        monthly_water_data=snapshot['monthly_water_data'],
+        monthly_gas_data=snapshot['monthly_gas_data'],
+        monthly_fuel_data=snapshot['monthly_fuel_data'],
+        recent_gas_consumption=snapshot['recent_gas_consumption'],
+        recent_fuel_consumption=snapshot['recent_fuel_consumption'],
+        recent_carbon_footprint=snapshot['recent_carbon_footprint'],
+        monthly_carbon_data=snapshot['monthly_carbon_data'],
+        average_emission_level=snapshot['average_emission_level'],
+        reduction_suggestions=snapshot['reduction_suggestions'],
+        monthly_carbon_detailed_data=snapshot['monthly_carbon_detailed_data'],
+        safe_limits=snapshot['safe_limits'],
+        wallet_balance=snapshot['wallet_balance'],
     )
 
 
@@ -915,6 +656,9 @@ def update_user():
                     VALUES (%s, 15000)
                 """, (user['id'],))
                 db.commit()
+                if wallet_password:
+                    # Tokens unlocked with the old password must not outlive it
+                    revoke_unlock_tokens(db, user['id'])
                 print("✅ Wallet update committed successfully")
 
             except Exception as wallet_error:
@@ -923,6 +667,8 @@ def update_user():
                 flash("Failed to update wallet!", "error")
                 return redirect(url_for('update_user'))
 
+        # Profile, housing, vehicles or wallet may have changed
+        refresh_dashboard_snapshot(db, user['id'])
         return redirect(url_for('dashboard'))
 
     # ----------------- GET Method -----------------
@@ -956,16 +702,38 @@ def update_user():
 
 
 
+# Held while a /log_consumption job runs, so a process runs at most one at a time
+log_consumption_lock = threading.Lock()
+
+
+def log_consumption_job():
+    # Runs outside any request, so it opens its own connections
+    try:
+        calculate_and_log_consumption(resume=True)
+        # Only the users whose consumption changed get new footprints and dashboards
+        changed_users = refresh_changed_footprints()
+        conn = get_db_connection()
+        try:
+            refresh_dashboard_snapshots(conn, changed_users)
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"❌ Consumption logging failed: {e}")
+    finally:
+        log_consumption_lock.release()
+
+
 @app.route('/log_consumption', methods=['GET'])
 def log_consumption():
     """
-    Calculate and log daily consumption for all users for the last 30 days.
+    Start logging daily consumption for all users in the background (admins only).
     """
-    try:
-        calculate_and_log_consumption()
-        return "Daily consumption logged successfully for all users.", 200
-    except Exception as e:
-        return f"Error: {e}", 500
+    if session.get('user_type') != 'admin':
+        return "Access Denied", 403
+    if not log_consumption_lock.acquire(blocking=False):
+        return "Consumption logging is already running.", 409
+    threading.Thread(target=log_consumption_job, daemon=True).start()
+    return "Consumption logging started.", 202
 
 @app.route('/bills')
 @login_required
@@ -987,22 +755,17 @@ def view_electricity_bills():
 
     user_id = user['user_id']
 
-    # aggregated monthly electricity consumption and bill
+    # monthly electricity consumption and bill, one summary row per month
     cursor.execute("""
         SELECT 
-            MONTH(consumption_date) AS bill_month, 
-            YEAR(consumption_date) AS bill_year, 
-            SUM(units_consumed) AS total_units, 
-            SUM(daily_bill) AS total_bill,
-            -- Check if all days in the month are paid
-            CASE 
-                WHEN SUM(CASE WHEN payment_status = 'paid' THEN 0 ELSE 1 END) = 0 
-                THEN 'paid' 
-                ELSE 'due' 
-            END AS payment_status
-        FROM daily_electricity_consumption
-        WHERE user_id = %s
-        GROUP BY bill_year, bill_month
+            month AS bill_month, 
+            year AS bill_year, 
+            total_units, 
+            total_bill,
+            -- The month is paid once no day is left due
+            CASE WHEN due_records = 0 THEN 'paid' ELSE 'due' END AS payment_status
+        FROM monthly_electricity_summary
+        WHERE user_id = %s AND paid_records + due_records > 0
         ORDER BY bill_year DESC, bill_month DESC
     """, (user_id,))
     bills = cursor.fetchall()
@@ -1016,6 +779,8 @@ def view_electricity_bills():
 @app.route('/bills/<int:month>/<int:year>')
 @login_required
 def view_electricity_bill_detail(month, year):
+    if not is_valid_month(year, month):
+        return "Bill not found.", 404
     user_profile = session['profile']
     google_id = user_profile['id']
 
@@ -1034,12 +799,7 @@ def view_electricity_bill_detail(month, year):
     user_id = user['user_id']
 
     # Fetch detailed consumption for the given month and year
-    cursor.execute("""
-        SELECT consumption_date, units_consumed, daily_bill
-        FROM daily_electricity_consumption
-        WHERE user_id = %s AND MONTH(consumption_date) = %s AND YEAR(consumption_date) = %s
-        ORDER BY consumption_date
-    """, (user_id, month, year))
+    cursor.execute(DETAIL_SQL['electricity'], month_params(user_id, year, month))
     bill_details = cursor.fetchall()
     cursor.close()
 
@@ -1062,18 +822,13 @@ def view_water_bills():
 
     cursor.execute("""
         SELECT 
-            MONTH(consumption_date) AS month,
-            YEAR(consumption_date) AS year,
-            SUM(liters_consumed) AS total_liters,
-            SUM(daily_bill) AS total_bill,
-            CASE 
-                WHEN SUM(CASE WHEN payment_status = 'paid' THEN 0 ELSE 1 END) = 0 
-                THEN 'paid' 
-                ELSE 'due' 
-            END AS payment_status
-        FROM daily_water_consumption
-        WHERE user_id = %s
-        GROUP BY year, month
+            month,
+            year,
+            total_liters,
+            total_bill,
+            CASE WHEN due_records = 0 THEN 'paid' ELSE 'due' END AS payment_status
+        FROM monthly_water_summary
+        WHERE user_id = %s AND paid_records + due_records > 0
         ORDER BY year DESC, month DESC
     """, (user_id,))
     bills = cursor.fetchall()
@@ -1085,6 +840,8 @@ def view_water_bills():
 @app.route('/water_bills/<int:month>/<int:year>')
 @login_required
 def view_water_bill_detail(month, year):
+    if not is_valid_month(year, month):
+        return "Bill not found.", 404
     user_profile = session['profile']
     google_id = user_profile['id']
 
@@ -1096,12 +853,7 @@ def view_water_bill_detail(month, year):
 
     user_id = user['id']
 
-    cursor.execute("""
-        SELECT consumption_date, liters_consumed, daily_bill
-        FROM daily_water_consumption
-        WHERE user_id = %s AND MONTH(consumption_date) = %s AND YEAR(consumption_date) = %s
-        ORDER BY consumption_date
-    """, (user_id, month, year))
+    cursor.execute(DETAIL_SQL['water'], month_params(user_id, year, month))
     bill_details = cursor.fetchall()
     cursor.close()
 
@@ -1124,18 +876,13 @@ def view_fuel_bills():
 
     cursor.execute("""
         SELECT 
-            MONTH(consumption_date) AS month, 
-            YEAR(consumption_date) AS year,
-            SUM(fuel_used_liters) AS total_liters, 
-            SUM(fuel_cost) AS total_bill,
-            CASE 
-                WHEN SUM(CASE WHEN payment_status = 'paid' THEN 0 ELSE 1 END) = 0 
-                THEN 'paid' 
-                ELSE 'due' 
-            END AS payment_status
-        FROM daily_fuel_consumption
-        WHERE user_id = %s
-        GROUP BY year, month
+            month, 
+            year,
+            total_liters, 
+            total_bill,
+            CASE WHEN due_records = 0 THEN 'paid' ELSE 'due' END AS payment_status
+        FROM monthly_fuel_summary
+        WHERE user_id = %s AND paid_records + due_records > 0
         ORDER BY year DESC, month DESC
     """, (user_id,))
     fuel_bills = cursor.fetchall()
@@ -1146,6 +893,8 @@ def view_fuel_bills():
 @app.route('/fuel_bills/<int:month>/<int:year>')
 @login_required
 def view_fuel_bill_detail(month, year):
+    if not is_valid_month(year, month):
+        return "Bill not found.", 404
     user_profile = session['profile']
     google_id = user_profile['id']
 
@@ -1157,12 +906,7 @@ def view_fuel_bill_detail(month, year):
 
     user_id = user['id']
 
-    cursor.execute("""
-        SELECT consumption_date, fuel_used_liters, fuel_cost
-        FROM daily_fuel_consumption
-        WHERE user_id = %s AND MONTH(consumption_date) = %s AND YEAR(consumption_date) = %s
-        ORDER BY consumption_date
-    """, (user_id, month, year))
+    cursor.execute(DETAIL_SQL['fuel'], month_params(user_id, year, month))
     fuel_bill_details = cursor.fetchall()
 
     return render_template('fuel_bill_detail.html', fuel_bill_details=fuel_bill_details, month=month, year=year)
@@ -1184,16 +928,10 @@ def view_gas_bills():
     user_id = user['id']
 
     cursor.execute("""
-        SELECT MONTH(consumption_date) AS month, YEAR(consumption_date) AS year,
-               SUM(gas_used_cubic_meters) AS total_cubic_meters, SUM(gas_cost) AS total_bill,
-            CASE 
-                WHEN SUM(CASE WHEN payment_status = 'paid' THEN 0 ELSE 1 END) = 0 
-                THEN 'paid' 
-                ELSE 'due' 
-            END AS payment_status
-        FROM daily_gas_consumption
-        WHERE user_id = %s
-        GROUP BY year, month
+        SELECT month, year, total_cubic_meters, total_bill,
+            CASE WHEN due_records = 0 THEN 'paid' ELSE 'due' END AS payment_status
+        FROM monthly_gas_summary
+        WHERE user_id = %s AND paid_records + due_records > 0
         ORDER BY year DESC, month DESC
     """, (user_id,))
     gas_bills = cursor.fetchall()
@@ -1204,6 +942,8 @@ def view_gas_bills():
 @app.route('/gas_bills/<int:month>/<int:year>')
 @login_required
 def view_gas_bill_detail(month, year):
+    if not is_valid_month(year, month):
+        return "Bill not found.", 404
     user_profile = session['profile']
     google_id = user_profile['id']
 
@@ -1215,393 +955,79 @@ def view_gas_bill_detail(month, year):
 
     user_id = user['id']
 
-    cursor.execute("""
-        SELECT consumption_date, gas_used_cubic_meters, gas_cost
-        FROM daily_gas_consumption
-        WHERE user_id = %s AND MONTH(consumption_date) = %s AND YEAR(consumption_date) = %s
-        ORDER BY consumption_date
-    """, (user_id, month, year))
+    cursor.execute(DETAIL_SQL['gas'], month_params(user_id, year, month))
     gas_bill_details = cursor.fetchall()
 
     return render_template('gas_bill_detail.html', gas_bill_details=gas_bill_details, month=month, year=year)
 
 
-@app.route('/pay_electricity_bill', methods=['POST'])
-@login_required
-def pay_electricity_bill():
+def pay_bill(utility):
+    """Shared body of the pay_* routes: unlock the wallet, then pay the month through the payment core."""
     data = request.get_json()
-    month = data['month']
-    year = data['year']
-    password = data['password']
+    # The bill pages send month and year as strings
+    try:
+        month = int(data['month'])
+        year = int(data['year'])
+    except (TypeError, ValueError):
+        month = year = 0
+    if not is_valid_month(year, month):
+        return jsonify({'success': False, 'error': 'Invalid billing month'}), 400
+    password = data.get('password')
+    # The bill pages send one key per opened payment dialog, so a double submit is charged once
+    idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
     user_profile = session['profile']
     google_id = user_profile['id']
 
     cursor = db.cursor(MySQLdb.cursors.DictCursor)
     cursor.execute("SELECT id FROM user WHERE google_id = %s", (google_id,))
     user = cursor.fetchone()
+    cursor.close()
     if not user:
-        return "User not found.", 404
+        return jsonify({'success': False, 'error': 'User not found'}), 404
 
     user_id = user['id']
 
     try:
-        # 1. Verify wallet password
-        cursor.execute("""
-            SELECT password_hash 
-            FROM user_wallet_auth 
-            WHERE user_id = %s
-        """, (user_id,))
-        wallet_auth = cursor.fetchone()
-        
-        if not wallet_auth or not check_password_hash(wallet_auth['password_hash'], password):
-            return jsonify({'success': False, 'error': 'Invalid wallet password'})
-        
-        # 2. Get bill amount and provider_id
-        cursor.execute("""
-            SELECT 
-                SUM(daily_bill) AS total_amount,
-                MAX(utility_provider_id) AS provider_id -- Assuming all bills in a month belong to same provider
-            FROM daily_electricity_consumption
-            WHERE user_id = %s
-            AND MONTH(consumption_date) = %s
-            AND YEAR(consumption_date) = %s
-            AND payment_status = 'due'
-        """, (user_id, month, year))
-        bill = cursor.fetchone()
-        amount = bill['total_amount'] if bill else 0
-        provider_id = bill['provider_id'] if bill else None
-        
-        if amount <= 0:
-            return jsonify({'success': False, 'error': 'No unpaid bills found for this period'})
-        
-        # 3. Check wallet balance
-        cursor.execute("SELECT balance FROM user_wallet WHERE user_id = %s", (user_id,))
-        wallet = cursor.fetchone()
-        
-        if not wallet or wallet['balance'] < amount:
-            return jsonify({'success': False, 'error': 'Insufficient balance'})
-        
-        # 4. Deduct from wallet
-        cursor.execute("""
-            UPDATE user_wallet 
-            SET balance = balance - %s 
-            WHERE user_id = %s
-        """, (amount, user_id))
-        
-        # 5. Mark bills as paid
-        cursor.execute("""
-            UPDATE daily_electricity_consumption
-            SET payment_status = 'paid'
-            WHERE user_id = %s
-            AND MONTH(consumption_date) = %s
-            AND YEAR(consumption_date) = %s
-        """, (user_id, month, year))
-        
-        # 6. Record transaction
-        cursor.execute("""
-            INSERT INTO transactions (
-                user_id, 
-                provider_id, 
-                amount, 
-                transaction_type, 
-                utility_type, 
-                reference_id,
-                description
-            )
-            VALUES (%s, %s, %s, 'payment', 'electricity', %s, 'Electricity bill payment')
-        """, (user_id, provider_id, -amount, f"{year}-{month}"))
-        
-        db.commit()
-        return jsonify({'success': True})
-        
+        # 1. Accept a wallet unlock token, or verify the password and issue one
+        unlocked, unlock_token = unlock_wallet(db, app.secret_key, user_id, password, data.get('unlock_token'))
+        if not unlocked:
+            return jsonify({'success': False, 'error': 'Invalid wallet password', 'unlock_required': True})
+
+        # 2. Lock the due rows and the wallet, debit, mark paid and record the transaction
+        result = pay_monthly_bill(db, user_id, utility, year, month, idempotency_key)
+        if not result['success']:
+            return jsonify({'success': False, 'error': result['error'], 'unlock_token': unlock_token})
+
+        # Balance and due bills changed
+        refresh_dashboard_snapshot(db, user_id)
+        return jsonify({'success': True, 'unlock_token': unlock_token})
+
     except Exception as e:
-        db.rollback()
         return jsonify({'success': False, 'error': str(e)})
-    finally:
-        cursor.close()
 
 
-@app.route('/pay_water_bill', methods=['POST'])
+@app.route('/pay_electricity_bill', methods=['POST'])
 @login_required
-def pay_water_bill():
-    data = request.get_json()
-    month = data['month']
-    year = data['year']
-    password = data['password']
-    user_profile = session['profile']
-    google_id = user_profile['id']
-
-    cursor = db.cursor(MySQLdb.cursors.DictCursor)
-    cursor.execute("SELECT id FROM user WHERE google_id = %s", (google_id,))
-    user = cursor.fetchone()
-    if not user:
-        return "User not found.", 404
+def pay_electricity_bill():
+    return pay_bill('electricity')
 
-    user_id = user['id']
 
-    try:
-        # 1. Verify wallet password
-        cursor.execute("""
-            SELECT password_hash 
-            FROM user_wallet_auth 
-            WHERE user_id = %s
-        """, (user_id,))
-        wallet_auth = cursor.fetchone()
-        
-        if not wallet_auth or not check_password_hash(wallet_auth['password_hash'], password):
-            return jsonify({'success': False, 'error': 'Invalid wallet password'})
-        
-        # 2. Get bill amount and provider_id
-        cursor.execute("""
-            SELECT 
-                SUM(daily_bill) AS total_amount,
-                MAX(utility_provider_id) AS provider_id -- Assuming all bills in a month belong to same provider
-            FROM daily_water_consumption
-            WHERE user_id = %s
-            AND MONTH(consumption_date) = %s
-            AND YEAR(consumption_date) = %s
-            AND payment_status = 'due'
-        """, (user_id, month, year))
-        bill = cursor.fetchone()
-        amount = bill['total_amount'] if bill else 0
-        provider_id = bill['provider_id'] if bill else None
-        
-        if amount <= 0:
-            return jsonify({'success': False, 'error': 'No unpaid bills found for this period'})
-        
-        # 3. Check wallet balance
-        cursor.execute("SELECT balance FROM user_wallet WHERE user_id = %s", (user_id,))
-        wallet = cursor.fetchone()
-        
-        if not wallet or wallet['balance'] < amount:
-            return jsonify({'success': False, 'error': 'Insufficient balance'})
-        
-        # 4. Deduct from wallet
-        cursor.execute("""
-            UPDATE user_wallet 
-            SET balance = balance - %s 
-            WHERE user_id = %s
-        """, (amount, user_id))
-        
-        # 5. Mark bills as paid
-        cursor.execute("""
-            UPDATE daily_water_consumption
-            SET payment_status = 'paid'
-            WHERE user_id = %s
-            AND MONTH(consumption_date) = %s
-            AND YEAR(consumption_date) = %s
-        """, (user_id, month, year))
-        
-        # 6. Record transaction
-        cursor.execute("""
-            INSERT INTO transactions (
-                user_id, 
-                provider_id, 
-                amount, 
-                transaction_type, 
-                utility_type, 
-                reference_id,
-                description
-            )
-            VALUES (%s, %s, %s, 'payment', 'water', %s, 'Water bill payment')
-        """, (user_id, provider_id, -amount, f"{year}-{month}"))
-        
-        db.commit()
-        return jsonify({'success': True})
-        
-    except Exception as e:
-        db.rollback()
-        return jsonify({'success': False, 'error': str(e)})
-    finally:
-        cursor.close()
+@app.route('/pay_water_bill', methods=['POST'])
+@login_required
+def pay_water_bill():
+    return pay_bill('water')
 
 
 @app.route('/pay_gas_bill', methods=['POST'])
 @login_required
 def pay_gas_bill():
-    data = request.get_json()
-    month = data['month']
-    year = data['year']
-    password = data['password']
-    user_profile = session['profile']
-    google_id = user_profile['id']
-
-    cursor = db.cursor(MySQLdb.cursors.DictCursor)
-    cursor.execute("SELECT id FROM user WHERE google_id = %s", (google_id,))
-    user = cursor.fetchone()
-    if not user:
-        return "User not found.", 404
-
-    user_id = user['id']
-
-    try:
-        # 1. Verify wallet password
-        cursor.execute("""
-            SELECT password_hash 
-            FROM user_wallet_auth 
-            WHERE user_id = %s
-        """, (user_id,))
-        wallet_auth = cursor.fetchone()
-        
-        if not wallet_auth or not check_password_hash(wallet_auth['password_hash'], password):
-            return jsonify({'success': False, 'error': 'Invalid wallet password'})
-        
-        # 2. Get bill amount and provider_id
-        cursor.execute("""
-            SELECT 
-                SUM(gas_cost) AS total_amount,
-                MAX(utility_provider_id) AS provider_id -- Assuming all bills in a month belong to same provider
-            FROM daily_gas_consumption
-            WHERE user_id = %s
-            AND MONTH(consumption_date) = %s
-            AND YEAR(consumption_date) = %s
-            AND payment_status = 'due'
-        """, (user_id, month, year))
-        bill = cursor.fetchone()
-        amount = bill['total_amount'] if bill else 0
-        provider_id = bill['provider_id'] if bill else None
-        
-        if amount <= 0:
-            return jsonify({'success': False, 'error': 'No unpaid bills found for this period'})
-        
-        # 3. Check wallet balance
-        cursor.execute("SELECT balance FROM user_wallet WHERE user_id = %s", (user_id,))
-        wallet = cursor.fetchone()
-        
-        if not wallet or wallet['balance'] < amount:
-            return jsonify({'success': False, 'error': 'Insufficient balance'})
-        
-        # 4. Deduct from wallet
-        cursor.execute("""
-            UPDATE user_wallet 
-            SET balance = balance - %s 
-            WHERE user_id = %s
-        """, (amount, user_id))
-        
-        # 5. Mark bills as paid
-        cursor.execute("""
-            UPDATE daily_gas_consumption
-            SET payment_status = 'paid'
-            WHERE user_id = %s
-            AND MONTH(consumption_date) = %s
-            AND YEAR(consumption_date) = %s
-        """, (user_id, month, year))
-        
-        # 6. Record transaction
-        cursor.execute("""
-            INSERT INTO transactions (
-                user_id, 
-                provider_id, 
-                amount, 
-                transaction_type, 
-                utility_type, 
-                reference_id,
-                description
-            )
-            VALUES (%s, %s, %s, 'payment', 'gas', %s, 'Gas bill payment')
-        """, (user_id, provider_id, -amount, f"{year}-{month}"))
-        
-        db.commit()
-        return jsonify({'success': True})
-        
-    except Exception as e:
-        db.rollback()
-        return jsonify({'success': False, 'error': str(e)})
-    finally:
-        cursor.close()
+    return pay_bill('gas')
 
 
 @app.route('/pay_fuel_bill', methods=['POST'])
 @login_required
 def pay_fuel_bill():
-    data = request.get_json()
-    month = data['month']
-    year = data['year']
-    password = data['password']
-    user_profile = session['profile']
-    google_id = user_profile['id']
-
-    cursor = db.cursor(MySQLdb.cursors.DictCursor)
-    cursor.execute("SELECT id FROM user WHERE google_id = %s", (google_id,))
-    user = cursor.fetchone()
-    if not user:
-        return jsonify({'success': False, 'error': 'User not found'}), 404
-
-    user_id = user['id']
-
-    try:
-        # 1. Verify wallet password
-        cursor.execute("""
-            SELECT password_hash 
-            FROM user_wallet_auth 
-            WHERE user_id = %s
-        """, (user_id,))
-        wallet_auth = cursor.fetchone()
-        
-        if not wallet_auth or not check_password_hash(wallet_auth['password_hash'], password):
-            return jsonify({'success': False, 'error': 'Invalid wallet password'})
-        
-        # 2. Get bill amount (fuel doesn't have provider_id like utilities)
-        cursor.execute("""
-            SELECT 
-                SUM(fuel_cost) AS total_amount
-            FROM daily_fuel_consumption
-            WHERE user_id = %s
-            AND MONTH(consumption_date) = %s
-            AND YEAR(consumption_date) = %s
-            AND payment_status = 'due'
-        """, (user_id, month, year))
-        bill = cursor.fetchone()
-        amount = bill['total_amount'] if bill and bill['total_amount'] else 0
-        
-        if amount <= 0:
-            return jsonify({'success': False, 'error': 'No unpaid fuel bills found for this period'})
-        
-        # 3. Check wallet balance
-        cursor.execute("SELECT balance FROM user_wallet WHERE user_id = %s", (user_id,))
-        wallet = cursor.fetchone()
-        
-        if not wallet or wallet['balance'] < amount:
-            return jsonify({'success': False, 'error': 'Insufficient balance'})
-        
-        # 4. Deduct from wallet
-        cursor.execute("""
-            UPDATE user_wallet 
-            SET balance = balance - %s 
-            WHERE user_id = %s
-        """, (amount, user_id))
-        
-        # 5. Mark fuel bills as paid
-        cursor.execute("""
-            UPDATE daily_fuel_consumption
-            SET payment_status = 'paid'
-            WHERE user_id = %s
-            AND MONTH(consumption_date) = %s
-            AND YEAR(consumption_date) = %s
-            AND payment_status = 'due'
-        """, (user_id, month, year))
-        
-        # 6. Record transaction (no provider_id for fuel)
-        cursor.execute("""
-            INSERT INTO transactions (
-                user_id, 
-                amount, 
-                transaction_type, 
-                utility_type, 
-                reference_id,
-                description
-            )
-            VALUES (%s, %s, 'payment', 'fuel', %s, 'Fuel bill payment')
-        """, (user_id, -amount, f"{year}-{month}"))
-        
-        db.commit()
-        return jsonify({'success': True})
-        
-    except Exception as e:
-        db.rollback()
-        return jsonify({'success': False, 'error': str(e)})
-    finally:
-        cursor.close()
+    return pay_bill('fuel')
 
 
 @app.route('/detailed_carbon_reports', methods=['GET'])
@@ -1610,8 +1036,7 @@ def detailed_carbon_reports():
     user_profile = session['profile']
     google_id = user_profile['id']
 
-    conn = get_db_connection()
-    cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+    cursor = db.cursor(MySQLdb.cursors.DictCursor)
 
     carbon_reports = []
     error_message = None
@@ -1625,18 +1050,18 @@ def detailed_carbon_reports():
         else:
             user_id = user['id']
             
-            # Get carbon reports monthly
+            # Get carbon reports monthly; the rollup only sums one summary row per month
             cursor.execute("""
                 SELECT 
-                    YEAR(consumption_date) AS year,
-                    MONTH(consumption_date) AS month,
+                    year,
+                    month,
                     SUM(electricity_emission_kg) AS electricity_emission_kg,
                     SUM(fuel_emission_kg) AS fuel_emission_kg,
                     SUM(gas_emission_kg) AS gas_emission_kg,
                     SUM(water_emission_kg) AS water_emission_kg,
                     SUM(total_emission_kg) AS total_emission_kg
-                FROM daily_carbon_footprint
-                WHERE user_id = %s
+                FROM monthly_carbon_summary
+                WHERE user_id = %s AND days > 0
                 GROUP BY year, month WITH ROLLUP
             """, (user_id,))
             
@@ -1648,15 +1073,61 @@ def detailed_carbon_reports():
 
     finally:
         cursor.close()
-        conn.close()
 
     return render_template('detailed_carbon_reports.html', carbon_reports=carbon_reports, error_message=error_message)
 
 
         
 
+@app.route('/wallet/unlock', methods=['POST'])
+@login_required
+def unlock_wallet_route():
+    # Check the wallet password once and hand back a short-lived token for the pay_* routes
+    data = request.get_json()
+    google_id = session['profile']['id']
+
+    cursor = db.cursor(MySQLdb.cursors.DictCursor)
+    cursor.execute("SELECT id FROM user WHERE google_id = %s", (google_id,))
+    user = cursor.fetchone()
+    cursor.close()
+    if not user:
+        return jsonify({'success': False, 'error': 'User not found'}), 404
+
+    user_id = user['id']
+    unlocked, unlock_token = unlock_wallet(db, app.secret_key, user_id, data.get('password'))
+    if not unlocked:
+        return jsonify({'success': False, 'error': 'Invalid wallet password', 'unlock_required': True})
+    return jsonify({'success': True, 'unlock_token': unlock_token, 'expires_in': WALLET_UNLOCK_TTL})
+
+
+def revoke_wallet_unlocks(google_id):
+    # Revoke every outstanding unlock token of the user; returns False when the database could not be reached
+    try:
+        cursor = db.cursor(MySQLdb.cursors.DictCursor)
+        cursor.execute("SELECT id FROM user WHERE google_id = %s", (google_id,))
+        user = cursor.fetchone()
+        cursor.close()
+        if user:
+            revoke_unlock_tokens(db, user['id'])
+        return True
+    except MySQLdb.Error as e:
+        print(f"❌ Failed to revoke wallet unlock tokens: {e}")
+        return False
+
+
+@app.route('/wallet/lock', methods=['POST'])
+@login_required
+def lock_wallet():
+    if not revoke_wallet_unlocks(session['profile']['id']):
+        return jsonify({'success': False, 'error': 'Could not lock wallet'}), 500
+    return jsonify({'success': True})
+
+
 @app.route('/logout')
 def logout():
+    if 'profile' in session:
+        # Signing out locks the wallet on every device that unlocked it
+        revoke_wallet_unlocks(session['profile']['id'])
     session.clear()
     return redirect(url_for('home'))
 
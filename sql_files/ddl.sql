@@ -65,12 +65,22 @@ CREATE TABLE daily_electricity_consumption (
     consumption_date DATE NOT NULL,
     units_consumed FLOAT NOT NULL,
     daily_bill FLOAT NOT NULL,
+    payment_status ENUM('due', 'paid') DEFAULT 'due',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE (user_id, consumption_date),
     FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE,
     FOREIGN KEY (utility_provider_id) REFERENCES utility_providers(id) ON DELETE CASCADE
 );
 
+-- 24 hourly kWh values per user-day, packed as little-endian float32 (96 bytes)
+CREATE TABLE hourly_electricity_load (
+    user_id INT NOT NULL,
+    consumption_date DATE NOT NULL,
+    hourly_kwh BINARY(96) NOT NULL,
+    PRIMARY KEY (user_id, consumption_date),
+    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
+);
+
 -- 6. Create Daily Water Consumption Table
 CREATE TABLE daily_water_consumption (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -79,6 +89,7 @@ CREATE TABLE daily_water_consumption (
     consumption_date DATE NOT NULL,
     liters_consumed FLOAT NOT NULL,
     daily_bill FLOAT NOT NULL,
+    payment_status ENUM('due', 'paid') DEFAULT 'due',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE (user_id, consumption_date),
     FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE,
@@ -107,7 +118,9 @@ CREATE TABLE daily_fuel_consumption (
     fuel_used_liters FLOAT NOT NULL,
     fuel_cost FLOAT NOT NULL,
     driving_condition ENUM('urban', 'highway') DEFAULT 'urban',
+    payment_status ENUM('due', 'paid') DEFAULT 'due',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_fuel_vehicle_date (user_vehicle_id, consumption_date),
     FOREIGN KEY (user_id) REFERENCES user(id),
     FOREIGN KEY (vehicle_id) REFERENCES vehicles(id),
     FOREIGN KEY (user_vehicle_id) REFERENCES user_vehicles(id)
@@ -124,7 +137,9 @@ CREATE TABLE daily_gas_consumption (
     household_type ENUM('metered', 'non_metered') NOT NULL,
     burner_type ENUM('single', 'double') NULL,
     num_members INT NULL,
+    payment_status ENUM('due', 'paid') DEFAULT 'due',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_gas_user_date (user_id, consumption_date),
     FOREIGN KEY (user_id) REFERENCES user(id),
     FOREIGN KEY (utility_provider_id) REFERENCES utility_providers(id)
 );
@@ -141,9 +156,102 @@ CREATE TABLE daily_carbon_footprint (
     total_emission_kg FLOAT DEFAULT 0,
     emission_tag VARCHAR(20),
     suggestions TEXT,
+    UNIQUE KEY uq_carbon_user_date (user_id, consumption_date),
     FOREIGN KEY (user_id) REFERENCES user(id)
 );
 
+-- User-days whose consumption changed since their footprint was computed, fed by the
+-- consumption triggers and drained by footprint.refresh_changed_footprints
+CREATE TABLE footprint_changes (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    consumption_date DATE NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX (user_id, consumption_date)
+);
+
+-- Monthly rollups of the daily tables, one row per (user, year, month). Kept current by
+-- the monthly summary triggers so bill pages and reports never re-aggregate daily rows.
+-- due_records = 0 means the month is fully paid.
+CREATE TABLE monthly_electricity_summary (
+    user_id INT NOT NULL,
+    year SMALLINT NOT NULL,
+    month TINYINT NOT NULL,
+    total_units DOUBLE NOT NULL DEFAULT 0,
+    total_bill DOUBLE NOT NULL DEFAULT 0,
+    paid_records INT NOT NULL DEFAULT 0,
+    due_records INT NOT NULL DEFAULT 0,
+    paid_amount DOUBLE NOT NULL DEFAULT 0,
+    due_amount DOUBLE NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, year, month),
+    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
+);
+
+CREATE TABLE monthly_water_summary (
+    user_id INT NOT NULL,
+    year SMALLINT NOT NULL,
+    month TINYINT NOT NULL,
+    total_liters DOUBLE NOT NULL DEFAULT 0,
+    total_bill DOUBLE NOT NULL DEFAULT 0,
+    paid_records INT NOT NULL DEFAULT 0,
+    due_records INT NOT NULL DEFAULT 0,
+    paid_amount DOUBLE NOT NULL DEFAULT 0,
+    due_amount DOUBLE NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, year, month),
+    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
+);
+
+CREATE TABLE monthly_gas_summary (
+    user_id INT NOT NULL,
+    year SMALLINT NOT NULL,
+    month TINYINT NOT NULL,
+    total_cubic_meters DOUBLE NOT NULL DEFAULT 0,
+    total_bill DOUBLE NOT NULL DEFAULT 0,
+    paid_records INT NOT NULL DEFAULT 0,
+    due_records INT NOT NULL DEFAULT 0,
+    paid_amount DOUBLE NOT NULL DEFAULT 0,
+    due_amount DOUBLE NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, year, month),
+    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
+);
+
+-- Fuel records are per vehicle-day, so the record counts cover all of a user's vehicles
+CREATE TABLE monthly_fuel_summary (
+    user_id INT NOT NULL,
+    year SMALLINT NOT NULL,
+    month TINYINT NOT NULL,
+    total_liters DOUBLE NOT NULL DEFAULT 0,
+    total_bill DOUBLE NOT NULL DEFAULT 0,
+    paid_records INT NOT NULL DEFAULT 0,
+    due_records INT NOT NULL DEFAULT 0,
+    paid_amount DOUBLE NOT NULL DEFAULT 0,
+    due_amount DOUBLE NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, year, month),
+    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
+);
+
+CREATE TABLE monthly_carbon_summary (
+    user_id INT NOT NULL,
+    year SMALLINT NOT NULL,
+    month TINYINT NOT NULL,
+    electricity_emission_kg DOUBLE NOT NULL DEFAULT 0,
+    fuel_emission_kg DOUBLE NOT NULL DEFAULT 0,
+    gas_emission_kg DOUBLE NOT NULL DEFAULT 0,
+    water_emission_kg DOUBLE NOT NULL DEFAULT 0,
+    total_emission_kg DOUBLE NOT NULL DEFAULT 0,
+    days INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, year, month),
+    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
+);
+
+-- Precomputed dashboard data per user (JSON), rebuilt after ingestion and payments
+CREATE TABLE dashboard_snapshots (
+    user_id INT PRIMARY KEY,
+    payload JSON NOT NULL,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
+);
+
 -- 11. Create Safe Limits Table
 CREATE TABLE safe_limits (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -154,6 +262,7 @@ CREATE TABLE safe_limits (
     water_safe_limit FLOAT NOT NULL,
     total_safe_limit FLOAT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_safe_limits_user (user_id),
     FOREIGN KEY (user_id) REFERENCES user(id)
 );
 
@@ -184,6 +293,33 @@ CREATE TABLE user_wallet_auth (
     FOREIGN KEY (user_id) REFERENCES user(id)
 );
 
+-- Idempotency keys of completed bill payments; a row commits together with its payment,
+-- so a retried or double-submitted request finds it and isn't charged again
+CREATE TABLE payment_requests (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    idempotency_key VARCHAR(64) NOT NULL,
+    utility_type ENUM('electricity', 'water', 'gas', 'fuel') NOT NULL,
+    reference_id VARCHAR(50) NOT NULL,
+    amount DECIMAL(10,2) NULL,
+    transaction_id INT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (user_id, idempotency_key),
+    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
+);
+
+-- Signed wallet unlock tokens issued by a password check; a payment presenting one
+-- skips the password hash until it expires or is revoked
+CREATE TABLE wallet_unlock_tokens (
+    token_id CHAR(32) PRIMARY KEY,
+    user_id INT NOT NULL,
+    expires_at DATETIME NOT NULL,
+    revoked_at DATETIME NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX (user_id),
+    FOREIGN KEY (user_id) REFERENCES user(id) ON DELETE CASCADE
+);
+
 -- 15. Create Transaction Table
 CREATE TABLE IF NOT EXISTS transactions (
     id INT AUTO_INCREMENT PRIMARY KEY,
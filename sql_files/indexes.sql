@@ -0,0 +1,20 @@
+-- Covering indexes for the bill detail and payment queries. Those queries filter on
+-- user_id and a half-open consumption_date range (see iot_simulation/bill_queries.py),
+-- so MySQL range-scans these indexes and reads every selected column from them
+-- without touching the table rows. Run after ddl.sql, or on its own for an existing database.
+
+CREATE INDEX idx_electricity_user_date_status
+    ON daily_electricity_consumption (user_id, consumption_date, payment_status, units_consumed, daily_bill, utility_provider_id);
+
+CREATE INDEX idx_water_user_date_status
+    ON daily_water_consumption (user_id, consumption_date, payment_status, liters_consumed, daily_bill, utility_provider_id);
+
+CREATE INDEX idx_gas_user_date_status
+    ON daily_gas_consumption (user_id, consumption_date, payment_status, gas_used_cubic_meters, gas_cost, utility_provider_id);
+
+-- Fuel rows are unique per vehicle-day; this adds the per-user range the bill pages need
+CREATE INDEX idx_fuel_user_date_status
+    ON daily_fuel_consumption (user_id, consumption_date, payment_status, fuel_used_liters, fuel_cost);
+
+-- daily_carbon_footprint range-scans through its uq_carbon_user_date (user_id, consumption_date)
+-- key, declared in ddl.sql; databases created before that need migrations.sql first
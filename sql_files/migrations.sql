@@ -0,0 +1,50 @@
+-- Unique keys for databases created before ddl.sql declared them. The simulators'
+-- INSERT IGNORE writes and the upserts rely on these keys; without them reruns add
+-- duplicate rows. Each migration first deletes the duplicates (keeping the earliest
+-- row of each key, which is the one a rerun leaves in place) so the ALTER TABLE can
+-- succeed. Run once, after triggers.sql so the deletes reach the trigger-maintained
+-- tables. Not needed on a fresh database.
+
+-- Gas: one row per user-day
+DELETE later
+FROM daily_gas_consumption later
+JOIN daily_gas_consumption earlier
+    ON earlier.user_id = later.user_id
+    AND earlier.consumption_date = later.consumption_date
+    AND earlier.id < later.id;
+
+ALTER TABLE daily_gas_consumption
+    ADD UNIQUE KEY uq_gas_user_date (user_id, consumption_date);
+
+-- Fuel: one row per vehicle-day
+DELETE later
+FROM daily_fuel_consumption later
+JOIN daily_fuel_consumption earlier
+    ON earlier.user_vehicle_id = later.user_vehicle_id
+    AND earlier.consumption_date = later.consumption_date
+    AND earlier.id < later.id;
+
+ALTER TABLE daily_fuel_consumption
+    ADD UNIQUE KEY uq_fuel_vehicle_date (user_vehicle_id, consumption_date);
+
+-- Carbon footprint: one row per user-day
+DELETE later
+FROM daily_carbon_footprint later
+JOIN daily_carbon_footprint earlier
+    ON earlier.user_id = later.user_id
+    AND earlier.consumption_date = later.consumption_date
+    AND earlier.id < later.id;
+
+ALTER TABLE daily_carbon_footprint
+    ADD UNIQUE KEY uq_carbon_user_date (user_id, consumption_date);
+
+-- Safe limits: one row per user. Unlike the daily tables, the latest row is kept, as it
+-- holds the most recently computed limits.
+DELETE earlier
+FROM safe_limits earlier
+JOIN safe_limits later
+    ON later.user_id = earlier.user_id
+    AND later.id > earlier.id;
+
+ALTER TABLE safe_limits
+    ADD UNIQUE KEY uq_safe_limits_user (user_id);
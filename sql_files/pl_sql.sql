@@ -235,3 +235,262 @@ DELIMITER ;
 
 
 
+
+-- Monthly summary maintenance: the triggers call these with p_sign = 1 for a new row
+-- version and -1 for an old one, so inserts, payments, re-rating and deletes all net out
+
+DROP PROCEDURE IF EXISTS ApplyMonthlyElectricityDelta;
+
+DELIMITER //
+
+CREATE PROCEDURE ApplyMonthlyElectricityDelta(
+    IN p_user_id INT,
+    IN p_consumption_date DATE,
+    IN p_quantity DOUBLE,
+    IN p_bill DOUBLE,
+    IN p_payment_status VARCHAR(10),
+    IN p_sign INT
+)
+BEGIN
+    DECLARE is_paid INT DEFAULT IF(p_payment_status = 'paid', 1, 0);
+
+    INSERT INTO monthly_electricity_summary (
+        user_id, year, month, total_units, total_bill,
+        paid_records, due_records, paid_amount, due_amount
+    )
+    VALUES (
+        p_user_id, YEAR(p_consumption_date), MONTH(p_consumption_date),
+        p_sign * p_quantity, p_sign * p_bill,
+        p_sign * is_paid, p_sign * (1 - is_paid),
+        p_sign * is_paid * p_bill, p_sign * (1 - is_paid) * p_bill
+    )
+    ON DUPLICATE KEY UPDATE
+        total_units = total_units + VALUES(total_units),
+        total_bill = total_bill + VALUES(total_bill),
+        paid_records = paid_records + VALUES(paid_records),
+        due_records = due_records + VALUES(due_records),
+        paid_amount = paid_amount + VALUES(paid_amount),
+        due_amount = due_amount + VALUES(due_amount);
+END //
+
+DELIMITER ;
+
+DROP PROCEDURE IF EXISTS ApplyMonthlyWaterDelta;
+
+DELIMITER //
+
+CREATE PROCEDURE ApplyMonthlyWaterDelta(
+    IN p_user_id INT,
+    IN p_consumption_date DATE,
+    IN p_quantity DOUBLE,
+    IN p_bill DOUBLE,
+    IN p_payment_status VARCHAR(10),
+    IN p_sign INT
+)
+BEGIN
+    DECLARE is_paid INT DEFAULT IF(p_payment_status = 'paid', 1, 0);
+
+    INSERT INTO monthly_water_summary (
+        user_id, year, month, total_liters, total_bill,
+        paid_records, due_records, paid_amount, due_amount
+    )
+    VALUES (
+        p_user_id, YEAR(p_consumption_date), MONTH(p_consumption_date),
+        p_sign * p_quantity, p_sign * p_bill,
+        p_sign * is_paid, p_sign * (1 - is_paid),
+        p_sign * is_paid * p_bill, p_sign * (1 - is_paid) * p_bill
+    )
+    ON DUPLICATE KEY UPDATE
+        total_liters = total_liters + VALUES(total_liters),
+        total_bill = total_bill + VALUES(total_bill),
+        paid_records = paid_records + VALUES(paid_records),
+        due_records = due_records + VALUES(due_records),
+        paid_amount = paid_amount + VALUES(paid_amount),
+        due_amount = due_amount + VALUES(due_amount);
+END //
+
+DELIMITER ;
+
+DROP PROCEDURE IF EXISTS ApplyMonthlyGasDelta;
+
+DELIMITER //
+
+CREATE PROCEDURE ApplyMonthlyGasDelta(
+    IN p_user_id INT,
+    IN p_consumption_date DATE,
+    IN p_quantity DOUBLE,
+    IN p_bill DOUBLE,
+    IN p_payment_status VARCHAR(10),
+    IN p_sign INT
+)
+BEGIN
+    DECLARE is_paid INT DEFAULT IF(p_payment_status = 'paid', 1, 0);
+
+    INSERT INTO monthly_gas_summary (
+        user_id, year, month, total_cubic_meters, total_bill,
+        paid_records, due_records, paid_amount, due_amount
+    )
+    VALUES (
+        p_user_id, YEAR(p_consumption_date), MONTH(p_consumption_date),
+        p_sign * p_quantity, p_sign * p_bill,
+        p_sign * is_paid, p_sign * (1 - is_paid),
+        p_sign * is_paid * p_bill, p_sign * (1 - is_paid) * p_bill
+    )
+    ON DUPLICATE KEY UPDATE
+        total_cubic_meters = total_cubic_meters + VALUES(total_cubic_meters),
+        total_bill = total_bill + VALUES(total_bill),
+        paid_records = paid_records + VALUES(paid_records),
+        due_records = due_records + VALUES(due_records),
+        paid_amount = paid_amount + VALUES(paid_amount),
+        due_amount = due_amount + VALUES(due_amount);
+END //
+
+DELIMITER ;
+
+DROP PROCEDURE IF EXISTS ApplyMonthlyFuelDelta;
+
+DELIMITER //
+
+CREATE PROCEDURE ApplyMonthlyFuelDelta(
+    IN p_user_id INT,
+    IN p_consumption_date DATE,
+    IN p_quantity DOUBLE,
+    IN p_bill DOUBLE,
+    IN p_payment_status VARCHAR(10),
+    IN p_sign INT
+)
+BEGIN
+    DECLARE is_paid INT DEFAULT IF(p_payment_status = 'paid', 1, 0);
+
+    INSERT INTO monthly_fuel_summary (
+        user_id, year, month, total_liters, total_bill,
+        paid_records, due_records, paid_amount, due_amount
+    )
+    VALUES (
+        p_user_id, YEAR(p_consumption_date), MONTH(p_consumption_date),
+        p_sign * p_quantity, p_sign * p_bill,
+        p_sign * is_paid, p_sign * (1 - is_paid),
+        p_sign * is_paid * p_bill, p_sign * (1 - is_paid) * p_bill
+    )
+    ON DUPLICATE KEY UPDATE
+        total_liters = total_liters + VALUES(total_liters),
+        total_bill = total_bill + VALUES(total_bill),
+        paid_records = paid_records + VALUES(paid_records),
+        due_records = due_records + VALUES(due_records),
+        paid_amount = paid_amount + VALUES(paid_amount),
+        due_amount = due_amount + VALUES(due_amount);
+END //
+
+DELIMITER ;
+
+DROP PROCEDURE IF EXISTS ApplyMonthlyCarbonDelta;
+
+DELIMITER //
+
+CREATE PROCEDURE ApplyMonthlyCarbonDelta(
+    IN p_user_id INT,
+    IN p_consumption_date DATE,
+    IN p_electricity_kg DOUBLE,
+    IN p_fuel_kg DOUBLE,
+    IN p_gas_kg DOUBLE,
+    IN p_water_kg DOUBLE,
+    IN p_total_kg DOUBLE,
+    IN p_sign INT
+)
+BEGIN
+    INSERT INTO monthly_carbon_summary (
+        user_id, year, month, electricity_emission_kg, fuel_emission_kg,
+        gas_emission_kg, water_emission_kg, total_emission_kg, days
+    )
+    VALUES (
+        p_user_id, YEAR(p_consumption_date), MONTH(p_consumption_date),
+        p_sign * IFNULL(p_electricity_kg, 0), p_sign * IFNULL(p_fuel_kg, 0),
+        p_sign * IFNULL(p_gas_kg, 0), p_sign * IFNULL(p_water_kg, 0),
+        p_sign * IFNULL(p_total_kg, 0), p_sign
+    )
+    ON DUPLICATE KEY UPDATE
+        electricity_emission_kg = electricity_emission_kg + VALUES(electricity_emission_kg),
+        fuel_emission_kg = fuel_emission_kg + VALUES(fuel_emission_kg),
+        gas_emission_kg = gas_emission_kg + VALUES(gas_emission_kg),
+        water_emission_kg = water_emission_kg + VALUES(water_emission_kg),
+        total_emission_kg = total_emission_kg + VALUES(total_emission_kg),
+        days = days + VALUES(days);
+END //
+
+DELIMITER ;
+
+-- Rebuild every monthly summary from the daily tables. Run once after creating the
+-- summary tables on a database that already has consumption, or to repair drift.
+DROP PROCEDURE IF EXISTS RebuildMonthlySummaries;
+
+DELIMITER //
+
+CREATE PROCEDURE RebuildMonthlySummaries()
+BEGIN
+    DELETE FROM monthly_electricity_summary;
+    INSERT INTO monthly_electricity_summary (
+        user_id, year, month, total_units, total_bill,
+        paid_records, due_records, paid_amount, due_amount
+    )
+    SELECT
+        user_id, YEAR(consumption_date), MONTH(consumption_date),
+        SUM(units_consumed), SUM(daily_bill),
+        SUM(IF(payment_status = 'paid', 1, 0)), SUM(IF(payment_status = 'paid', 0, 1)),
+        SUM(IF(payment_status = 'paid', daily_bill, 0)), SUM(IF(payment_status = 'paid', 0, daily_bill))
+    FROM daily_electricity_consumption
+    GROUP BY user_id, YEAR(consumption_date), MONTH(consumption_date);
+
+    DELETE FROM monthly_water_summary;
+    INSERT INTO monthly_water_summary (
+        user_id, year, month, total_liters, total_bill,
+        paid_records, due_records, paid_amount, due_amount
+    )
+    SELECT
+        user_id, YEAR(consumption_date), MONTH(consumption_date),
+        SUM(liters_consumed), SUM(daily_bill),
+        SUM(IF(payment_status = 'paid', 1, 0)), SUM(IF(payment_status = 'paid', 0, 1)),
+        SUM(IF(payment_status = 'paid', daily_bill, 0)), SUM(IF(payment_status = 'paid', 0, daily_bill))
+    FROM daily_water_consumption
+    GROUP BY user_id, YEAR(consumption_date), MONTH(consumption_date);
+
+    DELETE FROM monthly_gas_summary;
+    INSERT INTO monthly_gas_summary (
+        user_id, year, month, total_cubic_meters, total_bill,
+        paid_records, due_records, paid_amount, due_amount
+    )
+    SELECT
+        user_id, YEAR(consumption_date), MONTH(consumption_date),
+        SUM(gas_used_cubic_meters), SUM(gas_cost),
+        SUM(IF(payment_status = 'paid', 1, 0)), SUM(IF(payment_status = 'paid', 0, 1)),
+        SUM(IF(payment_status = 'paid', gas_cost, 0)), SUM(IF(payment_status = 'paid', 0, gas_cost))
+    FROM daily_gas_consumption
+    GROUP BY user_id, YEAR(consumption_date), MONTH(consumption_date);
+
+    DELETE FROM monthly_fuel_summary;
+    INSERT INTO monthly_fuel_summary (
+        user_id, year, month, total_liters, total_bill,
+        paid_records, due_records, paid_amount, due_amount
+    )
+    SELECT
+        user_id, YEAR(consumption_date), MONTH(consumption_date),
+        SUM(fuel_used_liters), SUM(fuel_cost),
+        SUM(IF(payment_status = 'paid', 1, 0)), SUM(IF(payment_status = 'paid', 0, 1)),
+        SUM(IF(payment_status = 'paid', fuel_cost, 0)), SUM(IF(payment_status = 'paid', 0, fuel_cost))
+    FROM daily_fuel_consumption
+    GROUP BY user_id, YEAR(consumption_date), MONTH(consumption_date);
+
+    DELETE FROM monthly_carbon_summary;
+    INSERT INTO monthly_carbon_summary (
+        user_id, year, month, electricity_emission_kg, fuel_emission_kg,
+        gas_emission_kg, water_emission_kg, total_emission_kg, days
+    )
+    SELECT
+        user_id, YEAR(consumption_date), MONTH(consumption_date),
+        IFNULL(SUM(electricity_emission_kg), 0), IFNULL(SUM(fuel_emission_kg), 0),
+        IFNULL(SUM(gas_emission_kg), 0), IFNULL(SUM(water_emission_kg), 0),
+        IFNULL(SUM(total_emission_kg), 0), COUNT(*)
+    FROM daily_carbon_footprint
+    GROUP BY user_id, YEAR(consumption_date), MONTH(consumption_date);
+END //
+
+DELIMITER ;
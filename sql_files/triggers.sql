@@ -128,3 +128,316 @@ BEGIN
 END //
 
 DELIMITER ;
+
+
+-- Record changed consumption days for the incremental carbon footprint refresh
+
+DELIMITER //
+
+CREATE TRIGGER after_insert_electricity_log_footprint_change
+AFTER INSERT ON daily_electricity_consumption
+FOR EACH ROW
+BEGIN
+    INSERT INTO footprint_changes (user_id, consumption_date)
+    VALUES (NEW.user_id, NEW.consumption_date);
+END //
+
+CREATE TRIGGER after_update_electricity_log_footprint_change
+AFTER UPDATE ON daily_electricity_consumption
+FOR EACH ROW
+BEGIN
+    -- Payment status updates don't change the footprint
+    IF NOT (OLD.units_consumed <=> NEW.units_consumed) OR OLD.user_id != NEW.user_id OR OLD.consumption_date != NEW.consumption_date THEN
+        INSERT INTO footprint_changes (user_id, consumption_date)
+        VALUES (NEW.user_id, NEW.consumption_date);
+    END IF;
+    IF OLD.user_id != NEW.user_id OR OLD.consumption_date != NEW.consumption_date THEN
+        INSERT INTO footprint_changes (user_id, consumption_date)
+        VALUES (OLD.user_id, OLD.consumption_date);
+    END IF;
+END //
+
+CREATE TRIGGER after_delete_electricity_log_footprint_change
+AFTER DELETE ON daily_electricity_consumption
+FOR EACH ROW
+BEGIN
+    INSERT INTO footprint_changes (user_id, consumption_date)
+    VALUES (OLD.user_id, OLD.consumption_date);
+END //
+
+DELIMITER ;
+
+DELIMITER //
+
+CREATE TRIGGER after_insert_water_log_footprint_change
+AFTER INSERT ON daily_water_consumption
+FOR EACH ROW
+BEGIN
+    INSERT INTO footprint_changes (user_id, consumption_date)
+    VALUES (NEW.user_id, NEW.consumption_date);
+END //
+
+CREATE TRIGGER after_update_water_log_footprint_change
+AFTER UPDATE ON daily_water_consumption
+FOR EACH ROW
+BEGIN
+    -- Payment status updates don't change the footprint
+    IF NOT (OLD.liters_consumed <=> NEW.liters_consumed) OR OLD.user_id != NEW.user_id OR OLD.consumption_date != NEW.consumption_date THEN
+        INSERT INTO footprint_changes (user_id, consumption_date)
+        VALUES (NEW.user_id, NEW.consumption_date);
+    END IF;
+    IF OLD.user_id != NEW.user_id OR OLD.consumption_date != NEW.consumption_date THEN
+        INSERT INTO footprint_changes (user_id, consumption_date)
+        VALUES (OLD.user_id, OLD.consumption_date);
+    END IF;
+END //
+
+CREATE TRIGGER after_delete_water_log_footprint_change
+AFTER DELETE ON daily_water_consumption
+FOR EACH ROW
+BEGIN
+    INSERT INTO footprint_changes (user_id, consumption_date)
+    VALUES (OLD.user_id, OLD.consumption_date);
+END //
+
+DELIMITER ;
+
+DELIMITER //
+
+CREATE TRIGGER after_insert_gas_log_footprint_change
+AFTER INSERT ON daily_gas_consumption
+FOR EACH ROW
+BEGIN
+    INSERT INTO footprint_changes (user_id, consumption_date)
+    VALUES (NEW.user_id, NEW.consumption_date);
+END //
+
+CREATE TRIGGER after_update_gas_log_footprint_change
+AFTER UPDATE ON daily_gas_consumption
+FOR EACH ROW
+BEGIN
+    -- Payment status updates don't change the footprint
+    IF NOT (OLD.gas_used_cubic_meters <=> NEW.gas_used_cubic_meters) OR OLD.user_id != NEW.user_id OR OLD.consumption_date != NEW.consumption_date THEN
+        INSERT INTO footprint_changes (user_id, consumption_date)
+        VALUES (NEW.user_id, NEW.consumption_date);
+    END IF;
+    IF OLD.user_id != NEW.user_id OR OLD.consumption_date != NEW.consumption_date THEN
+        INSERT INTO footprint_changes (user_id, consumption_date)
+        VALUES (OLD.user_id, OLD.consumption_date);
+    END IF;
+END //
+
+CREATE TRIGGER after_delete_gas_log_footprint_change
+AFTER DELETE ON daily_gas_consumption
+FOR EACH ROW
+BEGIN
+    INSERT INTO footprint_changes (user_id, consumption_date)
+    VALUES (OLD.user_id, OLD.consumption_date);
+END //
+
+DELIMITER ;
+
+DELIMITER //
+
+CREATE TRIGGER after_insert_fuel_log_footprint_change
+AFTER INSERT ON daily_fuel_consumption
+FOR EACH ROW
+BEGIN
+    INSERT INTO footprint_changes (user_id, consumption_date)
+    VALUES (NEW.user_id, NEW.consumption_date);
+END //
+
+CREATE TRIGGER after_update_fuel_log_footprint_change
+AFTER UPDATE ON daily_fuel_consumption
+FOR EACH ROW
+BEGIN
+    -- Payment status updates don't change the footprint
+    IF NOT (OLD.fuel_used_liters <=> NEW.fuel_used_liters) OR OLD.user_id != NEW.user_id OR OLD.consumption_date != NEW.consumption_date THEN
+        INSERT INTO footprint_changes (user_id, consumption_date)
+        VALUES (NEW.user_id, NEW.consumption_date);
+    END IF;
+    IF OLD.user_id != NEW.user_id OR OLD.consumption_date != NEW.consumption_date THEN
+        INSERT INTO footprint_changes (user_id, consumption_date)
+        VALUES (OLD.user_id, OLD.consumption_date);
+    END IF;
+END //
+
+CREATE TRIGGER after_delete_fuel_log_footprint_change
+AFTER DELETE ON daily_fuel_consumption
+FOR EACH ROW
+BEGIN
+    INSERT INTO footprint_changes (user_id, consumption_date)
+    VALUES (OLD.user_id, OLD.consumption_date);
+END //
+
+DELIMITER ;
+
+-- Keep the monthly summaries in step with the daily tables. An update takes the old row
+-- version out and puts the new one in, which covers payments and re-rated bills alike.
+-- Updates that leave the summarized columns as they were (no-op upserts) are skipped.
+
+DELIMITER //
+
+CREATE TRIGGER after_insert_electricity_monthly_summary
+AFTER INSERT ON daily_electricity_consumption
+FOR EACH ROW
+BEGIN
+    CALL ApplyMonthlyElectricityDelta(NEW.user_id, NEW.consumption_date, NEW.units_consumed, NEW.daily_bill, NEW.payment_status, 1);
+END //
+
+CREATE TRIGGER after_update_electricity_monthly_summary
+AFTER UPDATE ON daily_electricity_consumption
+FOR EACH ROW
+BEGIN
+    IF OLD.user_id != NEW.user_id OR
+       OLD.consumption_date != NEW.consumption_date OR
+       NOT (OLD.units_consumed <=> NEW.units_consumed) OR
+       NOT (OLD.daily_bill <=> NEW.daily_bill) OR
+       NOT (OLD.payment_status <=> NEW.payment_status) THEN
+        CALL ApplyMonthlyElectricityDelta(OLD.user_id, OLD.consumption_date, OLD.units_consumed, OLD.daily_bill, OLD.payment_status, -1);
+        CALL ApplyMonthlyElectricityDelta(NEW.user_id, NEW.consumption_date, NEW.units_consumed, NEW.daily_bill, NEW.payment_status, 1);
+    END IF;
+END //
+
+CREATE TRIGGER after_delete_electricity_monthly_summary
+AFTER DELETE ON daily_electricity_consumption
+FOR EACH ROW
+BEGIN
+    CALL ApplyMonthlyElectricityDelta(OLD.user_id, OLD.consumption_date, OLD.units_consumed, OLD.daily_bill, OLD.payment_status, -1);
+END //
+
+DELIMITER ;
+
+DELIMITER //
+
+CREATE TRIGGER after_insert_water_monthly_summary
+AFTER INSERT ON daily_water_consumption
+FOR EACH ROW
+BEGIN
+    CALL ApplyMonthlyWaterDelta(NEW.user_id, NEW.consumption_date, NEW.liters_consumed, NEW.daily_bill, NEW.payment_status, 1);
+END //
+
+CREATE TRIGGER after_update_water_monthly_summary
+AFTER UPDATE ON daily_water_consumption
+FOR EACH ROW
+BEGIN
+    IF OLD.user_id != NEW.user_id OR
+       OLD.consumption_date != NEW.consumption_date OR
+       NOT (OLD.liters_consumed <=> NEW.liters_consumed) OR
+       NOT (OLD.daily_bill <=> NEW.daily_bill) OR
+       NOT (OLD.payment_status <=> NEW.payment_status) THEN
+        CALL ApplyMonthlyWaterDelta(OLD.user_id, OLD.consumption_date, OLD.liters_consumed, OLD.daily_bill, OLD.payment_status, -1);
+        CALL ApplyMonthlyWaterDelta(NEW.user_id, NEW.consumption_date, NEW.liters_consumed, NEW.daily_bill, NEW.payment_status, 1);
+    END IF;
+END //
+
+CREATE TRIGGER after_delete_water_monthly_summary
+AFTER DELETE ON daily_water_consumption
+FOR EACH ROW
+BEGIN
+    CALL ApplyMonthlyWaterDelta(OLD.user_id, OLD.consumption_date, OLD.liters_consumed, OLD.daily_bill, OLD.payment_status, -1);
+END //
+
+DELIMITER ;
+
+DELIMITER //
+
+CREATE TRIGGER after_insert_gas_monthly_summary
+AFTER INSERT ON daily_gas_consumption
+FOR EACH ROW
+BEGIN
+    CALL ApplyMonthlyGasDelta(NEW.user_id, NEW.consumption_date, NEW.gas_used_cubic_meters, NEW.gas_cost, NEW.payment_status, 1);
+END //
+
+CREATE TRIGGER after_update_gas_monthly_summary
+AFTER UPDATE ON daily_gas_consumption
+FOR EACH ROW
+BEGIN
+    IF OLD.user_id != NEW.user_id OR
+       OLD.consumption_date != NEW.consumption_date OR
+       NOT (OLD.gas_used_cubic_meters <=> NEW.gas_used_cubic_meters) OR
+       NOT (OLD.gas_cost <=> NEW.gas_cost) OR
+       NOT (OLD.payment_status <=> NEW.payment_status) THEN
+        CALL ApplyMonthlyGasDelta(OLD.user_id, OLD.consumption_date, OLD.gas_used_cubic_meters, OLD.gas_cost, OLD.payment_status, -1);
+        CALL ApplyMonthlyGasDelta(NEW.user_id, NEW.consumption_date, NEW.gas_used_cubic_meters, NEW.gas_cost, NEW.payment_status, 1);
+    END IF;
+END //
+
+CREATE TRIGGER after_delete_gas_monthly_summary
+AFTER DELETE ON daily_gas_consumption
+FOR EACH ROW
+BEGIN
+    CALL ApplyMonthlyGasDelta(OLD.user_id, OLD.consumption_date, OLD.gas_used_cubic_meters, OLD.gas_cost, OLD.payment_status, -1);
+END //
+
+DELIMITER ;
+
+DELIMITER //
+
+CREATE TRIGGER after_insert_fuel_monthly_summary
+AFTER INSERT ON daily_fuel_consumption
+FOR EACH ROW
+BEGIN
+    CALL ApplyMonthlyFuelDelta(NEW.user_id, NEW.consumption_date, NEW.fuel_used_liters, NEW.fuel_cost, NEW.payment_status, 1);
+END //
+
+CREATE TRIGGER after_update_fuel_monthly_summary
+AFTER UPDATE ON daily_fuel_consumption
+FOR EACH ROW
+BEGIN
+    IF OLD.user_id != NEW.user_id OR
+       OLD.consumption_date != NEW.consumption_date OR
+       NOT (OLD.fuel_used_liters <=> NEW.fuel_used_liters) OR
+       NOT (OLD.fuel_cost <=> NEW.fuel_cost) OR
+       NOT (OLD.payment_status <=> NEW.payment_status) THEN
+        CALL ApplyMonthlyFuelDelta(OLD.user_id, OLD.consumption_date, OLD.fuel_used_liters, OLD.fuel_cost, OLD.payment_status, -1);
+        CALL ApplyMonthlyFuelDelta(NEW.user_id, NEW.consumption_date, NEW.fuel_used_liters, NEW.fuel_cost, NEW.payment_status, 1);
+    END IF;
+END //
+
+CREATE TRIGGER after_delete_fuel_monthly_summary
+AFTER DELETE ON daily_fuel_consumption
+FOR EACH ROW
+BEGIN
+    CALL ApplyMonthlyFuelDelta(OLD.user_id, OLD.consumption_date, OLD.fuel_used_liters, OLD.fuel_cost, OLD.payment_status, -1);
+END //
+
+DELIMITER ;
+
+DELIMITER //
+
+CREATE TRIGGER after_insert_carbon_monthly_summary
+AFTER INSERT ON daily_carbon_footprint
+FOR EACH ROW
+BEGIN
+    CALL ApplyMonthlyCarbonDelta(NEW.user_id, NEW.consumption_date, NEW.electricity_emission_kg, NEW.fuel_emission_kg,
+                                 NEW.gas_emission_kg, NEW.water_emission_kg, NEW.total_emission_kg, 1);
+END //
+
+CREATE TRIGGER after_update_carbon_monthly_summary
+AFTER UPDATE ON daily_carbon_footprint
+FOR EACH ROW
+BEGIN
+    IF OLD.user_id != NEW.user_id OR
+       OLD.consumption_date != NEW.consumption_date OR
+       NOT (OLD.electricity_emission_kg <=> NEW.electricity_emission_kg) OR
+       NOT (OLD.fuel_emission_kg <=> NEW.fuel_emission_kg) OR
+       NOT (OLD.gas_emission_kg <=> NEW.gas_emission_kg) OR
+       NOT (OLD.water_emission_kg <=> NEW.water_emission_kg) OR
+       NOT (OLD.total_emission_kg <=> NEW.total_emission_kg) THEN
+        CALL ApplyMonthlyCarbonDelta(OLD.user_id, OLD.consumption_date, OLD.electricity_emission_kg, OLD.fuel_emission_kg,
+                                     OLD.gas_emission_kg, OLD.water_emission_kg, OLD.total_emission_kg, -1);
+        CALL ApplyMonthlyCarbonDelta(NEW.user_id, NEW.consumption_date, NEW.electricity_emission_kg, NEW.fuel_emission_kg,
+                                     NEW.gas_emission_kg, NEW.water_emission_kg, NEW.total_emission_kg, 1);
+    END IF;
+END //
+
+CREATE TRIGGER after_delete_carbon_monthly_summary
+AFTER DELETE ON daily_carbon_footprint
+FOR EACH ROW
+BEGIN
+    CALL ApplyMonthlyCarbonDelta(OLD.user_id, OLD.consumption_date, OLD.electricity_emission_kg, OLD.fuel_emission_kg,
+                                 OLD.gas_emission_kg, OLD.water_emission_kg, OLD.total_emission_kg, -1);
+END //
+
+DELIMITER ;
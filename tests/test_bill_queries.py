@@ -0,0 +1,76 @@
+import os
+import datetime
+import pytest
+import MySQLdb
+from iot_simulation.bill_queries import BILL_TABLES, DETAIL_SQL, DUE_AMOUNT_SQL, MARK_PAID_SQL, busiest_user_month, explain_month_query, is_valid_month, month_range
+from iot_simulation.db import get_db_connection
+
+# The EXPLAIN tests need a MySQL database with ddl.sql, indexes.sql and some simulated consumption
+needs_mysql = pytest.mark.skipif(not os.getenv('MYSQL_HOST'), reason="MYSQL_HOST is not configured")
+
+QUERIES = [
+    pytest.param(utility, queries[utility], id=f"{utility}-{kind}")
+    for kind, queries in (("detail", DETAIL_SQL), ("due_amount", DUE_AMOUNT_SQL), ("mark_paid", MARK_PAID_SQL))
+    for utility in BILL_TABLES
+]
+
+
+def test_month_range_is_half_open():
+    assert month_range(2024, 2) == (datetime.date(2024, 2, 1), datetime.date(2024, 3, 1))
+    assert month_range(2024, 12) == (datetime.date(2024, 12, 1), datetime.date(2025, 1, 1))
+
+
+@pytest.mark.parametrize("year, month, valid", [
+    (2024, 1, True),
+    (2024, 12, True),
+    (2024, 0, False),
+    (2024, 13, False),
+    (0, 6, False),
+    (9999, 12, False),
+])
+def test_is_valid_month(year, month, valid):
+    assert is_valid_month(year, month) == valid
+    if valid:
+        month_range(year, month)
+
+
+@pytest.fixture(scope="module")
+def conn():
+    try:
+        conn = get_db_connection()
+    except MySQLdb.Error as err:
+        pytest.skip(f"MySQL is not reachable: {err}")
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="module")
+def user_month(conn):
+    row = busiest_user_month(conn)
+    if not row:
+        pytest.skip("No consumption logged yet")
+    return row
+
+
+def leading_column(conn, table, index):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT column_name
+            FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s AND seq_in_index = 1
+        """, (table, index))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return row[0] if row else None
+
+
+@needs_mysql
+@pytest.mark.parametrize("utility, sql", QUERIES)
+def test_month_query_range_scans_user_index(conn, user_month, utility, sql):
+    # Any index leading with user_id will do, e.g. the covering index or the table's unique key
+    plan = explain_month_query(conn, sql, *user_month)
+    assert plan['type'] == 'range'
+    assert plan['key'] is not None
+    assert leading_column(conn, BILL_TABLES[utility][0], plan['key']) == 'user_id'
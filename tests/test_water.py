@@ -0,0 +1,43 @@
+import datetime
+import numpy as np
+import pytest
+from iot_simulation.water import simulate_daily_water_usage, simulate_water_block
+
+SAMPLES = 4000
+
+SUMMER_DAY = datetime.date(2024, 7, 15)
+WINTER_DAY = datetime.date(2024, 1, 15)
+
+
+@pytest.mark.parametrize("house_size, num_members, num_cars", [
+    (600, 1, 0),
+    (1200, 4, 1),
+    (2500, 7, 3),
+])
+@pytest.mark.parametrize("date_obj, season", [(SUMMER_DAY, "summer"), (WINTER_DAY, "winter")])
+def test_closed_form_block_matches_per_person_simulation(house_size, num_members, num_cars, date_obj, season):
+    rng = np.random.default_rng(1234)
+    scalar = np.array([
+        simulate_daily_water_usage(house_size, num_members, has_garden=True, num_cars=num_cars, season=season, rng=rng)
+        for _ in range(SAMPLES)
+    ])
+    # One household on SAMPLES copies of the same day
+    block = simulate_water_block([house_size], [num_members], [num_cars], [date_obj] * SAMPLES, rng=rng)[0]
+
+    standard_error = np.sqrt(scalar.var(ddof=1) / SAMPLES + block.var(ddof=1) / SAMPLES)
+    assert abs(scalar.mean() - block.mean()) < 4 * standard_error
+    assert block.std(ddof=1) == pytest.approx(scalar.std(ddof=1), rel=0.1)
+
+
+def test_block_without_garden_drops_outdoor_usage():
+    rng = np.random.default_rng(7)
+    with_garden = simulate_water_block([1500], [3], [2], [SUMMER_DAY] * SAMPLES, rng=rng)[0]
+    without_garden = simulate_water_block([1500], [3], [2], [SUMMER_DAY] * SAMPLES, has_garden=False, rng=rng)[0]
+    scalar = np.array([
+        simulate_daily_water_usage(1500, 3, has_garden=False, num_cars=2, season="summer", rng=rng)
+        for _ in range(SAMPLES)
+    ])
+
+    assert without_garden.mean() < with_garden.mean()
+    standard_error = np.sqrt(scalar.var(ddof=1) / SAMPLES + without_garden.var(ddof=1) / SAMPLES)
+    assert abs(scalar.mean() - without_garden.mean()) < 4 * standard_error